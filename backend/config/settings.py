@@ -1,9 +1,18 @@
 import json
 import os
+import tempfile
+import threading
+from contextlib import contextmanager
+
+try:
+    import fcntl  # 多 worker 进程间互斥 (Linux/Docker)
+except ImportError:  # Windows 本地调试时退化为进程内锁
+    fcntl = None
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # 定位到 backend 目录
 DATA_DIR = os.path.join(BASE_DIR, 'data') # backend/data
 CONFIG_FILE = os.path.join(DATA_DIR, 'config.json')
+CONFIG_LOCK_FILE = CONFIG_FILE + '.lock'
 # 确保 data 目录存在
 if not os.path.exists(DATA_DIR):
     os.makedirs(DATA_DIR)
@@ -13,36 +22,211 @@ DEFAULT_CONFIG = {
     "emby_api_key": "",
     "emby_user_id": "",
     "sf_api_key": "",
-    
+
     # MP 基础配置
     "mp_host": "http://127.0.0.1:3000",
     "mp_username": "",
     "mp_password": "",
 
     "tmdb_api_key": "",
-    
+
     # 洗版策略 (默认空)
     "wash_schemes": [],
     # 追更配置策略
     "subscribe_schemes": [],
     # qBittorrent 配置
-    "qb_configs": []
+    "qb_configs": [],
+    # 上游 HTTP 连接池大小 (emby / mp / tmdb / siliconflow)
+    "http_pool_sizes": {"emby": 20, "mp": 10, "tmdb": 10, "siliconflow": 10},
+    # 后台任务队列：总 worker 数 / 各任务类型并发上限 / 最大尝试次数
+    "job_workers": 4,
+    "job_concurrency": {
+        "mp.new_subscription": 4,
+        "mp.wash": 2,
+        "emby.item_added": 4,
+        "emby.series_analyze": 2,
+        "emby.ai_batch": 1
+    },
+    "job_max_attempts": 5,
+    # Webhook 去重窗口 (秒)，0 表示关闭去重
+    "webhook_dedup_window": 300,
+    # MP 站点/规则组/下载器 列表缓存时间 (秒)
+    "mp_resource_cache_ttl": 300,
+    # 洗版历史批量写入：每批条数 / 最长等待毫秒 / 内存队列上限
+    "history_batch_size": 50,
+    "history_flush_ms": 500,
+    "history_max_pending": 1000,
+    # TMDB 缓存有效期 (小时) / 内存 LRU 条数
+    "tmdb_cache_ttl_hours": 72,
+    "tmdb_cache_lru_size": 2000,
+    # 上游限流：rate 每秒请求数 / burst 突发容量；429/503/网络错误的最大重试次数
+    "rate_limits": {
+        "emby": {"rate": 50, "burst": 100},
+        "mp": {"rate": 20, "burst": 40},
+        "tmdb": {"rate": 40, "burst": 40},
+        "siliconflow": {"rate": 5, "burst": 10}
+    },
+    "upstream_max_retries": 3,
+    # 批量分类时并发查询 TMDB 的数量
+    "category_bulk_concurrency": 8,
+    # Emby 媒体库镜像：增量同步间隔 (分钟，0 = 只靠 Webhook / 手动) 与全量同步间隔 (小时)
+    "emby_sync_interval_minutes": 10,
+    "emby_full_sync_hours": 24,
+    # AI 打标签：单个 Prompt 的 Token 预算 (输入 + 预计输出) 与同时进行的请求数
+    "ai_prompt_token_budget": 4000,
+    "ai_concurrency": 4
 }
 
+# ===========================
+# 只读配置快照
+# ===========================
+
+class FrozenDict(dict):
+    """只读字典：仍是 dict 子类，json.dump / FastAPI 序列化不受影响"""
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("配置快照是只读的，请通过 save_config 修改")
+    __setitem__ = __delitem__ = _readonly
+    clear = pop = popitem = setdefault = update = _readonly
+
+class FrozenList(list):
+    """只读列表：保持 isinstance(x, list) 判断不变"""
+    def _readonly(self, *args, **kwargs):
+        raise TypeError("配置快照是只读的，请通过 save_config 修改")
+    __setitem__ = __delitem__ = __iadd__ = __imul__ = _readonly
+    append = extend = insert = pop = remove = clear = sort = reverse = _readonly
+
+def _freeze(value):
+    if isinstance(value, dict):
+        return FrozenDict((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return FrozenList(_freeze(v) for v in value)
+    return value
+
+def thaw(value):
+    """把快照转回普通 dict/list，用于需要修改的场景"""
+    if isinstance(value, dict):
+        return {k: thaw(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [thaw(v) for v in value]
+    return value
+
+# 快照: (文件签名, 配置)，整体替换保证读者拿到的一定是一致的一份
+_snapshot = (None, _freeze(DEFAULT_CONFIG))
+_reload_lock = threading.Lock()
+
+def _file_signature():
+    try:
+        st = os.stat(CONFIG_FILE)
+    except FileNotFoundError:
+        return None
+    return (st.st_mtime_ns, st.st_size)
+
+def _merge_defaults(data, defaults):
+    """
+    缺失的字段用默认值补齐；字典类型的默认值逐层合并，
+    这样新加的嵌套项 (如 job_concurrency / rate_limits 里的新 key) 也能生效
+    """
+    for key, value in defaults.items():
+        if key not in data:
+            data[key] = thaw(value)
+        elif isinstance(value, dict) and isinstance(data[key], dict):
+            _merge_defaults(data[key], value)
+    return data
+
+def _read_raw():
+    """磁盘上的原始内容 (不含默认值)，写回时只写用户真正设置过的字段"""
+    if not os.path.exists(CONFIG_FILE):
+        return {}
+    with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def _read_file():
+    # 只做简单的字段合并，不再做数据格式转换
+    return _merge_defaults(_read_raw(), DEFAULT_CONFIG)
+
 def load_config():
-    if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, 'r', encoding='utf-8') as f:
-            data = json.load(f)
-            # 只做简单的字段合并，不再做数据格式转换
-            for key, value in DEFAULT_CONFIG.items():
-                if key not in data:
-                    data[key] = value
-            return data
-    return DEFAULT_CONFIG
+    """
+    返回进程内共享的只读配置快照。
+    只有 config.json 的 mtime/size 变化时才会重新读取解析。
+    """
+    global _snapshot
+    signature = _file_signature()
+    cached_sig, cached = _snapshot
+    if signature == cached_sig:
+        return cached
+    if signature is None:
+        _snapshot = (None, _freeze(DEFAULT_CONFIG))
+        return _snapshot[1]
+
+    with _reload_lock:
+        # 双重检查：等锁期间可能已被其他线程刷新
+        cached_sig, cached = _snapshot
+        if signature == cached_sig:
+            return cached
+        data = _freeze(_read_file())
+        _snapshot = (signature, data)
+        return data
+
+# ===========================
+# 写入：加锁 + 临时文件 + os.replace
+# ===========================
+
+_write_lock = threading.Lock()
+
+@contextmanager
+def _config_write_lock():
+    """
+    串行化所有写者：线程锁管进程内，flock 管多个 worker 进程。
+    读者不参与加锁，os.replace 保证它们看到的要么是旧文件要么是新文件。
+    """
+    with _write_lock:
+        if fcntl is None:
+            yield
+            return
+        with open(CONFIG_LOCK_FILE, 'a') as lock_fp:
+            fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_fp, fcntl.LOCK_UN)
+
+def _write_file(data):
+    fd, tmp_path = tempfile.mkstemp(prefix='.config.', suffix='.tmp', dir=os.path.dirname(CONFIG_FILE))
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=4, ensure_ascii=False)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, CONFIG_FILE)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+def _patch_locked(apply):
+    """在写锁内基于磁盘上的最新内容打补丁 (其他 worker 可能刚写过)"""
+    global _snapshot
+    with _config_write_lock():
+        # 补丁打在原始内容上，默认值不会被永久写进 config.json
+        current = _read_raw()
+        result = apply(current)
+        _write_file(current)
+        _snapshot = (_file_signature(), _freeze(_merge_defaults(thaw(current), DEFAULT_CONFIG)))
+        return result
 
 def save_config(new_config: dict):
-    current = load_config()
-    current.update(new_config)
-    with open(CONFIG_FILE, 'w', encoding='utf-8') as f:
-        json.dump(current, f, indent=4, ensure_ascii=False)
-    return current
+    """按 key 局部更新配置，返回更新后的快照"""
+    _patch_locked(lambda current: current.update(new_config))
+    return load_config()
+
+def update_config(key, mutator):
+    """
+    对单个 key 做原子的读-改-写 (例如 qb_configs 列表的增删改)。
+    mutator 接收该 key 当前值的可变副本，返回新值；抛出的异常会中止本次写入。
+    :return: mutator 的返回值 (即写入的新值)
+    """
+    def apply(current):
+        value = mutator(thaw(current[key] if key in current else DEFAULT_CONFIG.get(key)))
+        current[key] = value
+        return value
+    return _patch_locked(apply)
@@ -3,16 +3,36 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 import uvicorn
 import os
+import asyncio
+from contextlib import asynccontextmanager
 from database import Base, engine
 from config.settings import CONFIG_FILE, save_config
+from services import http_client, job_queue, history_writer, library_mirror, search_index, tag_store
 
 # 导入路由
-from routers import moviepilot, system, emby, history, qb, file_editor
+from routers import moviepilot, system, emby, history, qb, file_editor, jobs, category, tags
 
 # 初始化数据库表
 Base.metadata.create_all(bind=engine)
 
-app = FastAPI(title="Emby AI Manager")
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    history_writer.writer.start()
+    # 旧版 MediaTag.tags JSON 列迁移到 tags / item_tags 关联表
+    migrated = await asyncio.to_thread(tag_store.migrate_json_tags)
+    # 全文索引 (FTS5 虚拟表 + 触发器)，与镜像表不一致或刚迁移过标签时重建
+    await asyncio.to_thread(search_index.ensure_index, migrated > 0)
+    await job_queue.queue.start()
+    # 启动后先做一次媒体库镜像同步，之后按 emby_sync_interval_minutes 周期执行
+    library_mirror.schedule_sync(delay=5, periodic=True)
+    yield
+    await job_queue.queue.stop()
+    # 任务停止后再关闭写入器，把缓冲中的历史全部落库
+    history_writer.writer.stop()
+    # 关闭共享的上游连接池
+    await http_client.close_all()
+
+app = FastAPI(title="Emby AI Manager", lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -27,6 +47,9 @@ app.include_router(emby.router, prefix="/api", tags=["Emby"])
 app.include_router(history.router, prefix="/api", tags=["History"])
 app.include_router(qb.router, prefix="/api", tags=["qBittorrent"])
 app.include_router(file_editor.router, prefix="/api", tags=["Editor"])
+app.include_router(jobs.router, prefix="/api", tags=["Jobs"])
+app.include_router(category.router, prefix="/api", tags=["Category"])
+app.include_router(tags.router, prefix="/api", tags=["Tags"])
 # 注意：你需要确保前端调用 emby 接口时路径是否匹配，如果前端是 /api/libraries，这里 prefix="/api" 就对了
 if os.path.exists("backend/static"):
     app.mount("/", StaticFiles(directory="backend/static", html=True), name="static")
@@ -1,6 +1,6 @@
 # backend/models.py
 from database import Base
-from sqlalchemy import Column, Integer, String, JSON, DateTime, func
+from sqlalchemy import Column, Integer, String, JSON, DateTime, ForeignKey, func
 from datetime import datetime
 
 class MediaTag(Base):
@@ -9,7 +9,8 @@ class MediaTag(Base):
     # item_id 是主键，对应 Emby 的 ID
     item_id = Column(String, primary_key=True, index=True)
     name = Column(String)
-    # 使用 JSON 类型直接存列表 ['古装', '悬疑']
+    # 旧版本用 JSON 直接存列表 ['古装', '悬疑']；现已迁移到 tags / item_tags，
+    # 迁移后置空，列只为兼容旧库保留
     tags = Column(JSON)
 
 
@@ -25,4 +26,111 @@ class WashHistory(Base):
     wash_params = Column(JSON)
     # 🔥 新增字段，默认值为 'complete'
     wash_type = Column(String, default="complete") 
-    created_at = Column(DateTime, default=func.now())
\ No newline at end of file
+    created_at = Column(DateTime, default=func.now())
+
+class Job(Base):
+    """持久化任务队列 (Webhook 处理等后台任务)"""
+    __tablename__ = "jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_type = Column(String, index=True)
+    payload = Column(JSON)
+    # pending / running / done / dead(重试耗尽) / cancelled
+    status = Column(String, index=True, default="pending")
+    attempts = Column(Integer, default=0)
+    max_attempts = Column(Integer, default=5)
+    last_error = Column(String)
+    # 防抖键：同一个键只保留一个待执行任务 (如同一部剧的多集入库)
+    dedup_key = Column(String, index=True)
+    run_after = Column(DateTime, index=True)
+    locked_at = Column(DateTime)                # 租约：运行中由所属进程定期刷新
+    locked_by = Column(String)                  # 持有租约的进程 (job_queue.OWNER_ID)
+    created_at = Column(DateTime, default=func.now())
+    updated_at = Column(DateTime, default=func.now(), onupdate=func.now())
+
+
+class WebhookEvent(Base):
+    """Webhook 幂等去重索引：窗口期内同一个事件键只处理一次"""
+    __tablename__ = "webhook_events"
+
+    event_key = Column(String, primary_key=True)
+    expires_at = Column(DateTime, index=True)
+    created_at = Column(DateTime, default=func.now())
+
+
+class TmdbCache(Base):
+    """TMDB 详情缓存 (按 类型 + ID + 语言)"""
+    __tablename__ = "tmdb_cache"
+
+    media_type = Column(String, primary_key=True)   # tv / movie
+    tmdb_id = Column(String, primary_key=True)
+    language = Column(String, primary_key=True)
+    payload = Column(JSON)
+    etag = Column(String)
+    last_modified = Column(String)
+    fetched_at = Column(DateTime)
+    expires_at = Column(DateTime, index=True)
+
+
+class EmbyItem(Base):
+    """Emby 媒体库本地镜像 (电影 / 剧集)，列表和搜索直接查这里"""
+    __tablename__ = "emby_items"
+
+    id = Column(String, primary_key=True)
+    library_id = Column(String, index=True)
+    item_type = Column(String)                  # Movie / Series
+    name = Column(String, index=True)
+    original_title = Column(String)
+    pinyin = Column(String)                     # 标题拼音全拼 + 首字母 (装了 pypinyin 才有)
+    year = Column(Integer)
+    overview = Column(String)
+    overview_hash = Column(String)              # 简介变化检测 (sha1)
+    tmdb_id = Column(String, index=True)
+    tags = Column(JSON)
+    date_created = Column(String, index=True)   # Emby 原样的 ISO 时间，用于排序
+    date_last_saved = Column(String)
+    synced_at = Column(DateTime)
+
+
+class EmbySyncState(Base):
+    """每个媒体库的同步水位"""
+    __tablename__ = "emby_sync_state"
+
+    library_id = Column(String, primary_key=True)
+    last_saved = Column(String)                 # 已同步到的最大 DateLastSaved
+    last_full_sync = Column(DateTime)
+    last_sync = Column(DateTime)
+    item_count = Column(Integer, default=0)
+
+
+class Tag(Base):
+    """标签词表"""
+    __tablename__ = "tags"
+
+    id = Column(Integer, primary_key=True)
+    name = Column(String, unique=True, index=True, nullable=False)
+    created_at = Column(DateTime, default=func.now())
+
+
+class ItemTag(Base):
+    """物品 <-> 标签 关联 (替代 MediaTag.tags 的 JSON 列)"""
+    __tablename__ = "item_tags"
+
+    item_id = Column(String, ForeignKey("media_tags.item_id", ondelete="CASCADE"), primary_key=True)
+    tag_id = Column(Integer, ForeignKey("tags.id", ondelete="CASCADE"), primary_key=True, index=True)
+    # 标签在该物品上的顺序 (保持 AI 返回 / 用户保存时的顺序)
+    position = Column(Integer, default=0)
+
+
+class AiTagCache(Base):
+    """AI 标签结果缓存，按内容哈希 (标题 + 年份 + TMDB ID + 简介开头)，跨媒体库 / 重新扫描共用"""
+    __tablename__ = "ai_tag_cache"
+
+    content_hash = Column(String, primary_key=True)
+    name = Column(String)
+    year = Column(Integer)
+    tmdb_id = Column(String, index=True)
+    tags = Column(JSON)
+    hits = Column(Integer, default=0)
+    created_at = Column(DateTime, default=func.now())
+    last_hit_at = Column(DateTime)
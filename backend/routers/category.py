@@ -0,0 +1,67 @@
+from fastapi import APIRouter, HTTPException
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel
+from typing import List, Optional, Union
+import asyncio
+import json
+import logging
+from config.settings import load_config
+from services import category_service
+from services.emby_service import iter_library_tmdb_items
+from services.tmdb_service import load_cached_records
+
+router = APIRouter()
+logger = logging.getLogger("uvicorn")
+
+class BulkCategorizeRequest(BaseModel):
+    tmdb_ids: List[Union[int, str]] = []
+    media_type: str = "tv"             # tmdb_ids 的类型: tv / movie (或 电视剧 / 电影)
+    library_id: Optional[str] = None   # 传了则遍历整个 Emby 媒体库
+    concurrency: Optional[int] = None
+
+@router.get("/category/rules")
+def get_rules_status():
+    """当前生效的分类规则版本状态 (条数 / 最近一次解析错误)"""
+    category_service.reload_rules()
+    return category_service.rules_status()
+
+@router.post("/category/bulk")
+async def bulk_categorize(req: BulkCategorizeRequest):
+    """
+    批量分类：按行返回 NDJSON，每完成一条输出一行，最后一行是 summary
+    (各分类计数 / 未分类列表 / 失败列表)
+    """
+    if not req.tmdb_ids and not req.library_id:
+        raise HTTPException(status_code=400, detail="请提供 tmdb_ids 或 library_id")
+    concurrency = req.concurrency or int(load_config().get("category_bulk_concurrency") or 8)
+    concurrency = max(1, min(concurrency, 32))
+
+    async def targets():
+        for tmdb_id in req.tmdb_ids:
+            yield {"tmdb_id": tmdb_id, "media_type": req.media_type}
+        if req.library_id:
+            async for item in iter_library_tmdb_items(req.library_id):
+                yield item
+
+    async def stream():
+        try:
+            async for result in category_service.categorize_many(targets(), concurrency):
+                yield json.dumps(result, ensure_ascii=False) + "\n"
+        except Exception as e:
+            logger.error(f"❌ [批量分类] 中断: {e}")
+            yield json.dumps({"type": "error", "error": str(e)}, ensure_ascii=False) + "\n"
+
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+class RuleTestRequest(BaseModel):
+    content: str                       # 待验证的 category.yaml 草稿 (不保存)
+    diff_limit: int = 500
+
+@router.post("/category/test")
+async def test_category_rules(req: RuleTestRequest):
+    """
+    规则试运行：用草稿对本地 TMDB 缓存语料求分类，
+    返回与当前规则的差异、每条规则的命中数和耗时、无效 / 被遮蔽的规则
+    """
+    records = await asyncio.to_thread(load_cached_records)
+    return await asyncio.to_thread(category_service.test_rules, req.content, records, req.diff_limit)
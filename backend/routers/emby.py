@@ -1,21 +1,20 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks, Request
-from sqlalchemy.orm import Session
-from database import get_db
-from models import MediaTag
+from fastapi import APIRouter, HTTPException, Request, Query, Header
+from fastapi.responses import StreamingResponse
+from database import SessionLocal
 from pydantic import BaseModel
-from typing import List, Optional, Dict
-import requests
+from typing import List, Optional
 import json
 import logging
 import traceback
 import asyncio  # 👈 必须引入：用于异步延时(防抖)
 import re       # 👈 必须引入：用于正则清洗字符串
-from openai import OpenAI
 from config.settings import load_config
 import time
 
 # 引入服务层函数 (确保 services/emby_service.py 也是最新版)
-from services.emby_service import get_item_info, update_item_tags
+from services.emby_service import get_item_info, get_items_bulk, update_item_tags
+from services.http_client import ai_client, emby_client
+from services import job_queue, webhook_dedup, library_mirror, search_index, tag_store, ai_tag_cache, task_events
 
 router = APIRouter()
 logger = logging.getLogger("uvicorn")
@@ -50,13 +49,19 @@ class AIBatchRequest(AppConfig):
     item_ids: List[str]
     force_refresh: bool = False
 
+# 批量任务不带凭据：jobs.payload 会被列出 / 反复改写，执行时从配置读取
+class AIBatchJobRequest(BaseModel):
+    item_ids: List[str]
+    force_refresh: bool = False
+
 # ==========================================
 # 🛠️ 全局工具 & 辅助函数
 # ==========================================
 
-# 全局任务字典：用于存储正在倒计时的剧集任务
-# Key: SeriesId (剧集ID), Value: asyncio.Task (异步任务对象)
-SERIES_TASKS: Dict[str, asyncio.Task] = {}
+# 剧集防抖时间 (秒)：同一部剧在此时间内不断有新集数入库，就不断推迟分析
+SERIES_DEBOUNCE_SECONDS = 15
+# Webhook 触发媒体库镜像同步的防抖时间 (秒)
+MIRROR_SYNC_DELAY_SECONDS = 10
 
 def clean_string(s):
     """
@@ -66,52 +71,152 @@ def clean_string(s):
     if not s: return ""
     return re.sub(r'[\u200b-\u200f\ufeff]', '', s).strip()
 
-def ask_ai(items, api_key):
-    """
-    调用 SiliconFlow (DeepSeek) AI 进行分析
-    :param items: 包含 name, year, overview 的字典列表
-    :return: JSON 格式的标签字典 {"剧名": ["标签1", ...]}
-    """
-    if not items or not api_key: return {}
-    
-    client = OpenAI(api_key=api_key, base_url="https://api.siliconflow.cn/v1")
-    
-    # 构造简化版的数据发给 AI，节省 Token 且提高准确率
-    simple_list = []
-    for i in items:
-        simple_list.append({
-            "name": i.get("Name"),
-            "year": i.get("ProductionYear"),
-            "overview": i.get("Overview", "")[:150] # 截取前150字简介，防止 Token 溢出
-        })
-
-    logger.info(f"🤖 [AI请求] 正在请求 AI 分析 {len(simple_list)} 个项目...")
+# ==========================================
+# 🤖 AI 批量打标签：按 Token 预算分组 + 并发请求
+# ==========================================
+# 一次把所有条目塞进一个 Prompt 容易超出上下文，或回复被截断导致 json.loads 失败、整批作废。
+# 这里先估算每个条目的 Token 数 (输入 + 预计输出)，按 ai_prompt_token_budget 装箱成多个 Prompt，
+# 再以 ai_concurrency 为上限并发请求，最后合并结果；某一组失败只丢这一组。
+# 每个条目在组内带一个短编号 id，AI 按编号返回，结果按位置对应回原条目 (不再按名字匹配)；
+# 回复里缺失 / 不合格的条目单独再请求 AI_MISSING_RETRIES 轮。
 
-    prompt = f"""
+PROMPT_TEMPLATE = """
     请为以下影视作品打上 8-10 个精准的中文标签。
     标签范围参考：题材(如科幻,古装), 风格(如悬疑,喜剧), 元素(如穿越,权谋), 受众(如职场,大女主)。
     要求：
     1. 只返回纯 JSON 格式
     2. 不要包含 Markdown 代码块
-    3. 格式示例: {{"作品名": ["标签1", "标签2"]}}
+    3. 用数据里每个作品的 id 作为键，每个作品都要返回，格式示例: {{"0": ["标签1", "标签2"], "1": ["标签1", "标签2"]}}
     
-    数据内容：{json.dumps(simple_list, ensure_ascii=False)}
+    数据内容：{data}
+    """
+OUTPUT_TOKENS_PER_ITEM = 60   # 10 个标签 + 编号 + JSON 符号的大致输出量
+AI_MISSING_RETRIES = 1
+MAX_TAGS_PER_ITEM = 15
+MAX_TAG_LENGTH = 20
+
+def estimate_tokens(text):
+    """粗略估算：中日韩字符约 1 字 1 Token，其余约 4 字符 1 Token"""
+    if not text:
+        return 0
+    cjk = sum(1 for ch in text if ord(ch) >= 0x2E80)
+    return cjk + (len(text) - cjk + 3) // 4
+
+def plan_prompts(simple_list, budget):
+    """
+    把条目装箱成若干组，每组 Prompt 输入 + 预计输出不超过 budget
+    单个条目超预算时独占一组
+    :return: [[条目下标...], ...]
     """
+    overhead = estimate_tokens(PROMPT_TEMPLATE)
+    groups, current, used = [], [], overhead
+    for index, entry in enumerate(simple_list):
+        cost = estimate_tokens(json.dumps(entry, ensure_ascii=False)) + OUTPUT_TOKENS_PER_ITEM
+        if current and used + cost > budget:
+            groups.append(current)
+            current, used = [], overhead
+        current.append(index)
+        used += cost
+    if current:
+        groups.append(current)
+    return groups
+
+def parse_ai_reply(content, size):
+    """
+    校验 AI 回复：{"<组内编号>": ["标签", ...]}
+    编号越界 / 值不是字符串列表的条目丢弃
+    :return: {组内编号: [标签...]}
+    """
+    # 清理可能存在的 Markdown 标记 (```json ... ```)
+    content = (content or "").replace("```json", "").replace("```", "").strip()
+    data = json.loads(content)
+    if not isinstance(data, dict):
+        raise ValueError("返回的不是 JSON 对象")
+    result = {}
+    for key, value in data.items():
+        try:
+            index = int(str(key).strip())
+        except ValueError:
+            continue
+        if not 0 <= index < size or not isinstance(value, list):
+            continue
+        tags = []
+        for tag in value:
+            if isinstance(tag, str) and tag.strip() and len(tag.strip()) <= MAX_TAG_LENGTH and tag.strip() not in tags:
+                tags.append(tag.strip())
+        if tags:
+            result[index] = tags[:MAX_TAGS_PER_ITEM]
+    return result
+
+async def _ask_ai_prompt(client, entries):
+    """单个 Prompt 的请求；失败返回空字典，不影响其他组"""
+    data = [{"id": i, **entry} for i, entry in enumerate(entries)]
+    prompt = PROMPT_TEMPLATE.format(data=json.dumps(data, ensure_ascii=False))
     try:
-        response = client.chat.completions.create(
+        response = await client.chat.completions.create(
             model="deepseek-ai/DeepSeek-V3",
             messages=[{"role": "user", "content": prompt}],
             temperature=0.2, stream=False
         )
-        content = response.choices[0].message.content
-        
-        # 清理可能存在的 Markdown 标记 (```json ... ```)
-        content = content.replace("```json", "").replace("```", "").strip()
-        return json.loads(content)
+        return parse_ai_reply(response.choices[0].message.content, len(entries))
     except Exception as e:
-        logger.error(f"❌ AI 解析返回失败: {e}")
+        logger.error(f"❌ AI 解析返回失败 ({len(entries)} 个项目): {e}")
         return {}
 
+async def ask_ai(items, api_key, use_cache=True):
+    """
+    调用 SiliconFlow (DeepSeek) AI 进行分析
+    :param items: 包含 Name, ProductionYear, Overview, ProviderIds 的字典列表
+    :param use_cache: 先查内容缓存 (同一作品在其他媒体库 / 重新扫描后不再请求 AI)；强制刷新时传 False
+    :return: 与 items 一一对应的标签列表，AI 没给出结果的位置为 None
+    """
+    results = [None] * len(items)
+    if not items: return results
+
+    if use_cache:
+        results = await asyncio.to_thread(ai_tag_cache.get_many, items)
+        hits = sum(1 for r in results if r is not None)
+        if hits:
+            logger.info(f"💾 [AI缓存] 命中 {hits}/{len(items)} 个项目")
+    pending = [i for i, r in enumerate(results) if r is None]
+    if not pending or not api_key: return results
+    
+    client = ai_client(api_key)
+    cfg = load_config()
+    budget = int(cfg.get("ai_prompt_token_budget") or 4000)
+    concurrency = max(1, int(cfg.get("ai_concurrency") or 4))
+    
+    # 构造简化版的数据发给 AI，节省 Token 且提高准确率
+    simple_list = []
+    for i in items:
+        simple_list.append({
+            "name": i.get("Name"),
+            "year": i.get("ProductionYear"),
+            "overview": (i.get("Overview") or "")[:150] # 截取前150字简介，防止 Token 溢出
+        })
+
+    semaphore = asyncio.Semaphore(concurrency)
+    async def run(indexes):
+        async with semaphore:
+            reply = await _ask_ai_prompt(client, [simple_list[i] for i in indexes])
+        for local, tags in reply.items():
+            results[indexes[local]] = tags
+
+    asked = list(pending)
+    for attempt in range(AI_MISSING_RETRIES + 1):
+        groups = [[pending[i] for i in g] for g in plan_prompts([simple_list[i] for i in pending], budget)]
+        if attempt == 0:
+            logger.info(f"🤖 [AI请求] 正在请求 AI 分析 {len(pending)} 个项目 (分 {len(groups)} 组, 并发 {min(concurrency, len(groups))})...")
+        else:
+            logger.info(f"🔁 [AI重试] {len(pending)} 个项目未返回有效标签，单独重试...")
+        await asyncio.gather(*(run(g) for g in groups))
+        pending = [i for i in pending if results[i] is None]
+        if not pending:
+            break
+
+    await asyncio.to_thread(ai_tag_cache.put_many, [items[i] for i in asked], [results[i] for i in asked])
+    return results
+
 # ==========================================
 # ⏳ 核心逻辑 1: 剧集防抖处理 (Series/Episode)
 # ==========================================
@@ -120,15 +225,9 @@ async def analyze_series_finally(series_id: str, series_name: str):
     """
     剧集防抖结束后的最终执行逻辑。
     只有当 15秒 内没有新的集数入库时，才会执行此函数。
+    (防抖由任务队列的 dedup_key + 延迟执行实现，重启不会丢失)
     """
     try:
-        # 1. 等待防抖时间 (让 Emby 数据库写入完成，等待同一季其他集数入库)
-        await asyncio.sleep(15) 
-        
-        # 任务执行了，从全局字典里把自己移除
-        if series_id in SERIES_TASKS:
-            del SERIES_TASKS[series_id]
-
         logger.info(f"⏳ [防抖结束] 开始处理整部剧集: {series_name} (ID: {series_id})")
 
         # 2. 检查配置
@@ -137,8 +236,8 @@ async def analyze_series_finally(series_id: str, series_name: str):
         if not sf_api_key: return
 
         # 3. 查询 Emby 获取最新状态
-        # (经过 15s 等待，Emby 接口肯定通了，不用担心 404)
-        series_info = get_item_info(series_id)
+        # (经过防抖等待，Emby 接口肯定通了，不用担心 404)
+        series_info = await get_item_info(series_id)
         if not series_info:
             logger.error(f"❌ 无法获取剧集详情: {series_id}")
             return
@@ -154,46 +253,38 @@ async def analyze_series_finally(series_id: str, series_name: str):
         target_info = {
             "Name": clean_name,
             "ProductionYear": series_info.get("ProductionYear"),
-            "Overview": series_info.get("Overview", "")
+            "Overview": series_info.get("Overview", ""),
+            "ProviderIds": series_info.get("ProviderIds", {})
         }
         
         logger.info(f"   🤖 正在请求 AI 分析剧集: [{clean_name}] ...")
         
-        # 6. 调用 AI
-        ai_result = ask_ai([target_info], sf_api_key)
-        
-        # 7. 解析 AI 结果与匹配
-        suggested_tags = []
-        if clean_name in ai_result:
-            suggested_tags = ai_result[clean_name] # 精确匹配
-        else:
-            # 模糊匹配 (防止 AI 返回的名字略有不同)
-            for k, v in ai_result.items():
-                if clean_string(k) == clean_name or clean_name in k:
-                    suggested_tags = v
-                    break
-            # 兜底 (如果 AI 只返回了一个结果，就默认是它)
-            if not suggested_tags and len(ai_result) == 1:
-                suggested_tags = list(ai_result.values())[0]
-
-        # 8. 执行更新
+        # 6. 调用 AI (结果与输入按位置对应)
+        suggested_tags = (await ask_ai([target_info], sf_api_key))[0]
+
+        # 7. 执行更新
         if suggested_tags:
             logger.info(f"   🏷 [AI完成] 为《{clean_name}》打标: {suggested_tags}")
-            update_item_tags(series_id, suggested_tags)
+            await update_item_tags(series_id, suggested_tags)
         else:
             logger.warning(f"   ⚠️ AI 未返回有效标签: {clean_name}")
 
     except asyncio.CancelledError:
-        # 如果在 sleep 期间被 cancel() 了，说明又有新集数来了
-        logger.info(f"   🔄 [重置计时] {series_name} 又有新集数入库，推迟分析...")
+        logger.info(f"   ⏹ [任务取消] 剧集《{series_name}》分析已中断")
         raise
     except Exception as e:
         logger.error(f"❌ 剧集分析任务异常: {e}")
+        raise
+
+@job_queue.register("emby.series_analyze")
+async def _series_analyze_job(payload: dict):
+    await analyze_series_finally(payload["series_id"], payload.get("series_name", ""))
 
 # ==========================================
 # 🚀 核心逻辑 2: 入库事件分流 (Movie vs Series)
 # ==========================================
 
+@job_queue.register("emby.item_added")
 async def process_emby_item_added(payload: dict):
     """
     后台任务：处理 Emby Webhook 入库事件
@@ -228,28 +319,14 @@ async def process_emby_item_added(payload: dict):
                 "ProviderIds": item.get("ProviderIds", {})
             }
             
-            # 调用 AI
-            ai_result = ask_ai([target_info], sf_api_key)
-            
-            # 解析匹配逻辑
-            suggested_tags = []
-            if clean_name in ai_result:
-                suggested_tags = ai_result[clean_name]
-            else:
-                # 模糊匹配
-                for k, v in ai_result.items():
-                    if clean_string(k) == clean_name or clean_name in k:
-                        suggested_tags = v
-                        break
-                # 兜底
-                if not suggested_tags and len(ai_result) == 1:
-                    suggested_tags = list(ai_result.values())[0]
+            # 调用 AI (结果与输入按位置对应)
+            suggested_tags = (await ask_ai([target_info], sf_api_key))[0]
 
             # 更新 Emby
             if suggested_tags:
                 logger.info(f"   🏷 准备打标签: {suggested_tags}")
                 await asyncio.sleep(1) # 小睡1秒，防止 Emby 数据库被锁
-                update_item_tags(item_id, suggested_tags)
+                await update_item_tags(item_id, suggested_tags)
             return
 
         # -------------------------------------------------------
@@ -268,25 +345,25 @@ async def process_emby_item_added(payload: dict):
 
         # 如果能提取到 SeriesId，进入防抖队列
         if target_series_id:
-            # 如果已有任务在跑，取消它（相当于重置计时器）
-            if target_series_id in SERIES_TASKS:
-                SERIES_TASKS[target_series_id].cancel()
-            
-            # 创建新任务：15秒后执行
-            logger.info(f"   ⏱ [防抖计时] {target_series_name} (ID: {target_series_id}) - 15秒后执行")
-            task = asyncio.create_task(analyze_series_finally(target_series_id, target_series_name))
-            SERIES_TASKS[target_series_id] = task
+            # 同一剧集已有待执行任务时，入队会推迟其执行时间（相当于重置计时器）
+            logger.info(f"   ⏱ [防抖计时] {target_series_name} (ID: {target_series_id}) - {SERIES_DEBOUNCE_SECONDS}秒后执行")
+            await asyncio.to_thread(
+                job_queue.enqueue, "emby.series_analyze",
+                {"series_id": target_series_id, "series_name": target_series_name},
+                delay=SERIES_DEBOUNCE_SECONDS, dedup_key=f"emby.series:{target_series_id}",
+            )
         
     except Exception as e:
         logger.error(f"❌ 后台任务异常: {e}")
         logger.error(traceback.format_exc())
+        raise
 
 # ==========================================
 # 📡 接口: Webhook 接收
 # ==========================================
 
 @router.post("/webhook/emby")
-async def emby_webhook(request: Request, background_tasks: BackgroundTasks):
+async def emby_webhook(request: Request):
     content_type = request.headers.get("content-type", "")
     try:
         payload = {}
@@ -307,9 +384,31 @@ async def emby_webhook(request: Request, background_tasks: BackgroundTasks):
 
         event = payload.get("Event")
         
+        # 媒体库镜像保持新鲜：删除直接删本地，其余变化合并成一次增量同步
+        if event in ["library.deleted", "item.removed"]:
+            item_id = (payload.get("Item") or {}).get("Id")
+            if item_id:
+                await asyncio.to_thread(library_mirror.remove_items, [item_id])
+            return {"status": "received"}
+        if event in ["item.created", "library.new", "item.updated", "metadata.update"]:
+            await asyncio.to_thread(library_mirror.schedule_sync, MIRROR_SYNC_DELAY_SECONDS)
+
         # 监听 item.created (单集入库) 和 library.new (整季入库)
         if event in ["item.created", "library.new"]:
-            background_tasks.add_task(process_emby_item_added, payload)
+            item = payload.get("Item", {}) or {}
+            # 幂等去重：item.created 与 library.new 归一为同一事件，同一物品只处理一次
+            event_key = webhook_dedup.make_key(event, item.get("Id"), (item.get("ProviderIds") or {}).get("Tmdb"))
+            if not await asyncio.to_thread(webhook_dedup.claim, event_key):
+                logger.info(f"⚪ [重复事件] 已忽略: {event_key}")
+                return {"status": "duplicate"}
+
+            # 只保留处理需要的字段入队，Server/User 等信息不落库
+            job_payload = {"Event": event, "Item": item}
+            try:
+                await asyncio.to_thread(job_queue.enqueue, "emby.item_added", job_payload)
+            except Exception:
+                await asyncio.to_thread(webhook_dedup.release, event_key)
+                raise
         
         return {"status": "received"}
         
@@ -317,12 +416,38 @@ async def emby_webhook(request: Request, background_tasks: BackgroundTasks):
         logger.error(f"❌ Webhook 接收错误: {e}")
         return {"status": "error"}
 
+# ==========================================
+# 🗄️ 本地标签库读写 (同步 SQLAlchemy，接口里经 asyncio.to_thread 调用，不阻塞事件循环)
+# ==========================================
+
+def _save_batch_results(entries):
+    db = SessionLocal()
+    try:
+        tag_store.set_tags_bulk(db, entries)
+        db.commit()
+    finally:
+        db.close()
+
+def _load_cached_tags(item_ids):
+    db = SessionLocal()
+    try:
+        return tag_store.get_tags_bulk(db, item_ids)
+    finally:
+        db.close()
+
+def _load_item_tags(item_id):
+    db = SessionLocal()
+    try:
+        return tag_store.get_item(db, item_id)
+    finally:
+        db.close()
+
 # ==========================================
 # 💾 接口: 手动保存标签 (健壮版)
 # ==========================================
 
 @router.post("/save_tags")
-def save_tags(req: TagUpdateRequest, db: Session = Depends(get_db)):
+async def save_tags(req: TagUpdateRequest):
     """
     前端手动点击'保存'时调用此接口
     包含逻辑：解锁元数据、清理只读字段、覆盖/合并标签、同步数据库
@@ -333,14 +458,14 @@ def save_tags(req: TagUpdateRequest, db: Session = Depends(get_db)):
     if not req.emby_host or not req.emby_api_key:
         raise HTTPException(status_code=400, detail="未配置 Emby Host 或 API Key")
 
-    headers = {"X-Emby-Token": req.emby_api_key, "Content-Type": "application/json"}
+    client = emby_client(req.emby_host, req.emby_api_key)
     
     # 2. 获取详情 (显式请求 LockData, Tags 字段)
-    get_url = f"{req.emby_host}/emby/Users/{req.emby_user_id}/Items/{req.item_id}"
-    params = {'api_key': req.emby_api_key, 'Fields': 'Tags,TagItems,LockData,LockedFields'}
+    get_url = f"/emby/Users/{req.emby_user_id}/Items/{req.item_id}"
+    params = {'Fields': 'Tags,TagItems,LockData,LockedFields'}
     
     try:
-        res = requests.get(get_url, params=params, headers=headers)
+        res = await client.get(get_url, params=params)
         if res.status_code != 200:
              raise HTTPException(status_code=400, detail=f"无法获取物品: {res.text}")
         item_data = res.json()
@@ -366,20 +491,15 @@ def save_tags(req: TagUpdateRequest, db: Session = Depends(get_db)):
         if k in item_data: del item_data[k]
 
     # 5. 提交更新
-    post_url = f"{req.emby_host}/emby/Items/{req.item_id}"
+    post_url = f"/emby/Items/{req.item_id}"
     try:
-        update_res = requests.post(post_url, json=item_data, headers=headers, params={'api_key': req.emby_api_key})
+        update_res = await client.post(post_url, json=item_data)
         if update_res.status_code not in [200, 204]:
              raise HTTPException(status_code=400, detail=update_res.text)
         
         # 6. 同步本地数据库缓存
-        db_item = db.query(MediaTag).filter(MediaTag.item_id == req.item_id).first()
-        if db_item:
-            db_item.tags = final_tags
-            if item_data.get("Name"): db_item.name = item_data.get("Name")
-        else:
-            db.add(MediaTag(item_id=req.item_id, name=item_data.get("Name","Unknown"), tags=final_tags))
-        db.commit()
+        await asyncio.to_thread(_save_batch_results, [(req.item_id, item_data.get("Name"), final_tags)])
+        await asyncio.to_thread(library_mirror.update_tags, req.item_id, final_tags)
 
         return {"status": "success", "tags": final_tags}
     except Exception as e:
@@ -390,18 +510,18 @@ def save_tags(req: TagUpdateRequest, db: Session = Depends(get_db)):
 # ==========================================
 
 @router.post("/ai_single")
-def ai_analyze_single(req: AISingleRequest, db: Session = Depends(get_db)):
+async def ai_analyze_single(req: AISingleRequest):
     try:
         # 1. 优先查库 (除非强制刷新)
         if not req.force_refresh:
-            cached = db.query(MediaTag).filter(MediaTag.item_id == req.item_id).first()
-            if cached:
-                return {"id": req.item_id, "name": cached.name, "suggested_tags": cached.tags, "source": "database"}
+            cached_name, cached_tags = await asyncio.to_thread(_load_item_tags, req.item_id)
+            if cached_tags is not None:
+                return {"id": req.item_id, "name": cached_name, "suggested_tags": cached_tags, "source": "database"}
 
         # 2. 查 Emby 获取详情
-        get_url = f"{req.emby_host}/emby/Users/{req.emby_user_id}/Items/{req.item_id}"
+        get_url = f"/emby/Users/{req.emby_user_id}/Items/{req.item_id}"
         try:
-            item_res = requests.get(get_url, params={'api_key': req.emby_api_key})
+            item_res = await emby_client(req.emby_host, req.emby_api_key).get(get_url)
             item_res.raise_for_status()
             item = item_res.json()
         except Exception as e:
@@ -413,31 +533,13 @@ def ai_analyze_single(req: AISingleRequest, db: Session = Depends(get_db)):
         item['Name'] = name # 替换给 AI，提高准确度
 
         # 3. 调用 AI
-        ai_res = ask_ai([item], req.sf_api_key)
-        
-        # 4. 匹配结果
-        if name in ai_res:
-            suggested = ai_res[name]
-        else:
-            # 模糊匹配
-            found_key = None
-            for k in ai_res.keys():
-                if clean_string(k) == name or name in clean_string(k):
-                    found_key = k
-                    break
-            suggested = ai_res[found_key] if found_key else (list(ai_res.values())[0] if len(ai_res)==1 else [])
+        suggested = (await ask_ai([item], req.sf_api_key, use_cache=not req.force_refresh))[0]
 
         if not suggested:
             raise HTTPException(status_code=500, detail="AI 返回空结果")
 
-        # 5. 写入数据库缓存
-        db_item = db.query(MediaTag).filter(MediaTag.item_id == req.item_id).first()
-        if db_item:
-            db_item.tags = suggested
-            db_item.name = name
-        else:
-            db.add(MediaTag(item_id=req.item_id, name=name, tags=suggested))
-        db.commit()
+        # 4. 写入数据库缓存
+        await asyncio.to_thread(_save_batch_results, [(req.item_id, name, suggested)])
 
         return {"id": req.item_id, "name": name, "suggested_tags": suggested, "source": "ai"}
 
@@ -450,118 +552,305 @@ def ai_analyze_single(req: AISingleRequest, db: Session = Depends(get_db)):
 # ==========================================
 
 @router.post("/libraries")
-def get_libs(config: AppConfig):
+async def get_libs(config: AppConfig):
     """获取 Emby 媒体库列表"""
-    url = f"{config.emby_host}/emby/Library/VirtualFolders"
     try:
-        res = requests.get(url, params={'api_key': config.emby_api_key}, timeout=5)
+        res = await emby_client(config.emby_host, config.emby_api_key).get("/emby/Library/VirtualFolders", timeout=5)
         res.raise_for_status()
         return res.json()
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
-def process_emby_items(items):
-    """处理 Emby 返回的项目列表 (格式化)"""
-    result = []
-    for item in items:
-        # 兼容 Tags 和 TagItems
-        tags = item.get('Tags', [])
-        if not tags and item.get('TagItems'):
-            tags = [t.get('Name') for t in item.get('TagItems')]
-        result.append({
-            "id": item['Id'], "name": item.get('Name'),
-            "year": item.get('ProductionYear'), "current_tags": tags,
-            "overview": item.get('Overview', '')
-        })
-    return result
-
 @router.post("/library_items")
-def get_library_items(req: LibraryItemsRequest):
-    """获取指定库下的媒体项"""
-    url = f"{req.emby_host}/emby/Users/{req.emby_user_id}/Items"
-    params = {
-        'IncludeItemTypes': 'Series,Movie', 'Recursive': 'true',
-        'ParentId': req.library_id, 'Fields': 'Tags,TagItems,OriginalTitle,ProductionYear,Overview',
-        'StartIndex': req.start_index, 'SortBy': 'DateCreated', 'SortOrder': 'Descending',
-        'api_key': req.emby_api_key
-    }
-    if req.limit != -1: params['Limit'] = req.limit
+async def get_library_items(req: LibraryItemsRequest):
+    """获取指定库下的媒体项 (读本地镜像，首次访问时先同步)"""
     try:
-        res = requests.get(url, params=params)
-        res.raise_for_status()
-        return {"items": process_emby_items(res.json().get('Items', [])), "total": res.json().get('TotalRecordCount')}
+        await library_mirror.ensure_library(req.library_id)
+        items, total = await asyncio.to_thread(
+            library_mirror.list_items, req.library_id, req.start_index, req.limit
+        )
+        return {"items": items, "total": total}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
 @router.post("/search_items")
-def search_items(req: SearchRequest):
-    """搜索媒体项"""
-    url = f"{req.emby_host}/emby/Users/{req.emby_user_id}/Items"
-    params = {
-        'IncludeItemTypes': 'Series,Movie', 'Recursive': 'true',
-        'SearchTerm': req.search_term, 'Fields': 'Tags,TagItems,OriginalTitle,ProductionYear,Overview',
-        'api_key': req.emby_api_key
-    }
+async def search_items(req: SearchRequest):
+    """搜索媒体项 (读本地镜像)"""
     try:
-        res = requests.get(url, params=params)
-        res.raise_for_status()
-        return {"items": process_emby_items(res.json().get('Items', []))}
+        if not await asyncio.to_thread(library_mirror.is_synced):
+            await library_mirror.sync_all()
+        return {"items": await asyncio.to_thread(library_mirror.search_items, req.search_term)}
     except Exception as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@router.get("/search")
+async def full_text_search(
+    q: str = "", tags: List[str] = Query([]), library_id: Optional[str] = None,
+    offset: int = 0, limit: int = 50,
+):
+    """
+    全文检索 (本地 FTS5 索引)：标题 / 原标题 / 简介 / 标签 / 拼音
+    tags 可多选 (同时满足)，可只按标签筛选不带关键词
+    """
+    try:
+        return await asyncio.to_thread(search_index.search, q, tags, library_id, offset, limit)
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.post("/search/rebuild")
+async def rebuild_search_index():
+    """重建全文索引 (如安装 pypinyin 后补上拼音)"""
+    return {"count": await asyncio.to_thread(search_index.rebuild)}
+
+@router.post("/library/sync")
+async def sync_library_mirror(full: bool = False):
+    """手动触发媒体库镜像同步 (full=True 全量，清理已删除条目)"""
+    try:
+        return {"results": await library_mirror.sync_all(full)}
+    except Exception as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+@router.get("/library/sync")
+def get_library_mirror_status():
+    return library_mirror.sync_status()
+
+async def _fetch_batch_items(item_ids, client=None, user_id=None):
+    """批量取详情并清洗名字，返回 [(item_id, item)]，查不到的跳过"""
+    try:
+        details = await get_items_bulk(item_ids, client=client, user_id=user_id)
+    except Exception as e:
+        logger.error(f"❌ 批量获取 Emby 详情失败: {e}")
+        return []
+    result = []
+    for item_id in item_ids:
+        d = details.get(item_id)
+        if not d: continue
+        d['Name'] = clean_string(d.get('Name'))
+        result.append((item_id, d))
+    return result
+
 @router.post("/ai_batch")
-def ai_analyze_batch(req: AIBatchRequest, db: Session = Depends(get_db)):
+async def ai_analyze_batch(req: AIBatchRequest):
     """批量 AI 分析"""
     logger.info(f"📦 批量 AI: {len(req.item_ids)} 个")
     items_to_process = []
-    id_map = {}
-    
-    # 1. 筛选需要分析的项目 (无缓存或强制刷新)
-    for item_id in req.item_ids:
-        if not req.force_refresh:
-            cached = db.query(MediaTag).filter(MediaTag.item_id == item_id).first()
-            if cached and cached.tags: continue
 
-        try:
-            url = f"{req.emby_host}/emby/Users/{req.emby_user_id}/Items/{item_id}"
-            res = requests.get(url, params={'api_key': req.emby_api_key})
-            if res.status_code == 200:
-                d = res.json()
-                clean_name = clean_string(d.get('Name'))
-                d['Name'] = clean_name
-                items_to_process.append(d)
-                id_map[clean_name] = item_id
-        except: pass
+    # 1. 筛选需要分析的项目 (无缓存或强制刷新)：一次 IN 查询取出全部缓存
+    pending = list(dict.fromkeys(req.item_ids))
+    if not req.force_refresh:
+        cached = await asyncio.to_thread(_load_cached_tags, pending)
+        pending = [i for i in pending if not cached.get(i)]
+
+    # 2. 一次 Ids=a,b,c 请求批量取详情 (替代逐个请求)
+    if pending:
+        items_to_process = await _fetch_batch_items(
+            pending, client=emby_client(req.emby_host, req.emby_api_key), user_id=req.emby_user_id
+        )
 
     if not items_to_process: return {"status": "skipped"}
 
-    # 2. 批量调用 AI
-    ai_results = ask_ai(items_to_process, req.sf_api_key)
-    success_count = 0
+    # 3. 批量调用 AI
+    ai_results = await ask_ai([d for _, d in items_to_process], req.sf_api_key, use_cache=not req.force_refresh)
     results_map = {}
+    to_save = []
 
-    # 3. 匹配结果并入库
-    for item in items_to_process:
-        name = item['Name']
-        item_id = id_map.get(name)
-        suggested = ai_results.get(name) or []
-        
-        if not suggested:
-             # 简单模糊匹配
-             for k, v in ai_results.items():
-                 if name in k or k in name:
-                     suggested = v
-                     break
-
+    # 4. 结果与输入按位置对应，一次批量 upsert 入库
+    for (item_id, item), suggested in zip(items_to_process, ai_results):
         if suggested:
-            db_item = db.query(MediaTag).filter(MediaTag.item_id == item_id).first()
-            if db_item:
-                db_item.tags = suggested
-                db_item.name = name
-            else:
-                db.add(MediaTag(item_id=item_id, name=name, tags=suggested))
+            to_save.append((item_id, item['Name'], suggested))
             results_map[item_id] = suggested
-            success_count += 1
-            
-    db.commit()
-    return {"status": "success", "results": results_map}
\ No newline at end of file
+
+    await asyncio.to_thread(_save_batch_results, to_save)
+    return {"status": "success", "results": results_map}
+
+# ==========================================
+# 📡 批量 AI 分析任务 (提交即返回 job_id，进度走 SSE)
+# ==========================================
+# 同步的 /ai_batch 要等整批完成才返回：没有进度、占着连接、大批量容易被代理超时。
+# 这里把整批放进任务队列执行，前端订阅 /ai_batch/jobs/{id}/events 实时拿到每个物品的结果。
+# 执行时流水线化：下一组的 Emby 详情请求、当前组的 AI 请求、上一组的数据库写入同时进行。
+# 每组写库后把已完成的 ID 记进任务 payload (done_ids)：任务被回收或重启后重跑时，
+# 即使 force_refresh 也直接跳过这些物品，不再重复花 AI Token。
+
+AI_BATCH_JOB = "emby.ai_batch"
+AI_BATCH_CHUNK = 50       # 每组物品数 (一次 Emby 批量请求 + 一次 ask_ai)
+AI_BATCH_PREFETCH = 2     # 最多提前取好几组详情
+AI_BATCH_POLL_SECONDS = 2 # 任务在其他进程执行时，SSE 轮询 jobs 表的间隔
+
+@job_queue.register(AI_BATCH_JOB)
+async def _ai_batch_job(payload: dict):
+    job_id = job_queue.current_job_id()
+    task_events.open_channel(job_id)
+    started = time.perf_counter()
+    item_ids = list(dict.fromkeys(payload.get("item_ids") or []))
+    progress = {"total": len(item_ids), "finished": 0, "success": 0, "fail": 0}
+
+    def report(item_id, name, tags, source):
+        progress["finished"] += 1
+        progress["success" if tags else "fail"] += 1
+        task_events.publish(job_id, "item", {"id": item_id, "name": name, "tags": tags or [], "source": source})
+
+    force_refresh = payload.get("force_refresh")
+    done_ids = set(payload.get("done_ids") or [])
+    checkpoint_lock = asyncio.Lock()
+    producer = None
+    writes = []
+
+    async def save(entries):
+        await asyncio.to_thread(_save_batch_results, entries)
+        async with checkpoint_lock:
+            done_ids.update(item_id for item_id, _, _ in entries)
+            await asyncio.to_thread(job_queue.checkpoint, job_id, {**payload, "done_ids": sorted(done_ids)})
+
+    try:
+        # 1. 已有结果的直接返回 (一次 IN 查询)；强制刷新时只跳过本任务上次运行已完成的
+        lookup = item_ids if not force_refresh else [i for i in item_ids if i in done_ids]
+        cached = await asyncio.to_thread(_load_cached_tags, lookup) if lookup else {}
+        pending = [i for i in item_ids if not cached.get(i)]
+        for item_id in item_ids:
+            if cached.get(item_id):
+                report(item_id, None, cached[item_id], "database")
+        task_events.publish(job_id, "start", {**progress, "pending": len(pending)})
+
+        # 凭据执行时从配置读取 (不存进任务 payload)
+        sf_api_key = load_config().get("sf_api_key")
+        if pending and not sf_api_key:
+            raise RuntimeError("未配置 sf_api_key")
+
+        # 2. 生产者：按组批量取 Emby 详情
+        chunks = [pending[i:i + AI_BATCH_CHUNK] for i in range(0, len(pending), AI_BATCH_CHUNK)]
+        fetched = asyncio.Queue(maxsize=AI_BATCH_PREFETCH)
+
+        async def produce():
+            for chunk in chunks:
+                await fetched.put((chunk, await _fetch_batch_items(chunk)))
+            await fetched.put(None)
+
+        producer = asyncio.create_task(produce())
+
+        # 3. 消费者：AI 分析 -> 后台写库 -> 推送结果
+        while True:
+            batch = await fetched.get()
+            if batch is None:
+                break
+            chunk, items = batch
+            # 取消请求可能发到了其他 worker：每组开始前查一次库，已取消就不再花 AI Token
+            if await asyncio.to_thread(job_queue.is_cancelled, job_id):
+                logger.info(f"⏹ [批量AI任务] #{job_id} 已被取消，停止处理")
+                await asyncio.gather(*writes, return_exceptions=True)
+                task_events.close(job_id, "cancelled", dict(progress))
+                return
+            found = {item_id for item_id, _ in items}
+            for item_id in chunk:
+                if item_id not in found:
+                    report(item_id, None, None, "emby")
+            # 内容缓存命中的单独标记为 cache，前端能区分哪些真正花了 AI Token
+            tags_list = [None] * len(items)
+            if not force_refresh:
+                tags_list = await asyncio.to_thread(ai_tag_cache.get_many, [d for _, d in items])
+            sources = ["cache" if tags else "ai" for tags in tags_list]
+            misses = [k for k, tags in enumerate(tags_list) if tags is None]
+            asked = await ask_ai([items[k][1] for k in misses], sf_api_key, use_cache=False)
+            for k, tags in zip(misses, asked):
+                tags_list[k] = tags
+            entries = [(item_id, d['Name'], tags) for (item_id, d), tags in zip(items, tags_list) if tags]
+            if entries:
+                writes.append(asyncio.create_task(save(entries)))
+            for (item_id, d), tags, source in zip(items, tags_list, sources):
+                report(item_id, d['Name'], tags, source)
+            task_events.publish(job_id, "progress", dict(progress))
+
+        await asyncio.gather(*writes)
+        summary = {**progress, "elapsed_ms": round((time.perf_counter() - started) * 1000)}
+        logger.info(f"📦 [批量AI任务] #{job_id} 完成: {summary}")
+        task_events.close(job_id, "done", summary)
+    except asyncio.CancelledError:
+        # 已经分析完的结果照常落库
+        await asyncio.gather(*writes, return_exceptions=True)
+        task_events.close(job_id, "cancelled", dict(progress))
+        raise
+    except Exception as e:
+        await asyncio.gather(*writes, return_exceptions=True)
+        task_events.close(job_id, "error", {**progress, "message": str(e)})
+        raise
+    finally:
+        if producer and not producer.done():
+            producer.cancel()
+
+@router.post("/ai_batch/jobs")
+async def submit_ai_batch_job(req: AIBatchJobRequest):
+    """提交批量 AI 分析任务，立即返回 job_id"""
+    if not req.item_ids:
+        raise HTTPException(status_code=400, detail="item_ids 不能为空")
+    job_id = await asyncio.to_thread(
+        job_queue.enqueue, AI_BATCH_JOB, {"item_ids": req.item_ids, "force_refresh": req.force_refresh},
+        delay=0, dedup_key=None, max_attempts=1,
+    )
+    logger.info(f"📦 批量 AI 任务 #{job_id}: {len(req.item_ids)} 个")
+    return {"job_id": job_id, "total": len(req.item_ids)}
+
+async def _follow_job_events(job_id, after):
+    """
+    本进程没有这个任务的事件 (由其他 worker 执行 / 还没开始 / 进程重启过)：轮询 jobs 表
+    - 已写库的物品 (payload.done_ids) 从库里取标签推 item 事件；任务结束时补齐其余物品
+    - 任务被本进程接手后切换为实时事件流
+    """
+    reported = set()
+    while True:
+        if task_events.has_channel(job_id):
+            async for chunk in task_events.subscribe(job_id, after):
+                yield chunk
+            return
+        job = await asyncio.to_thread(job_queue.get_job, job_id)
+        if not job:
+            return
+        payload = job["payload"] or {}
+        finished = job["status"] not in ("pending", "running")
+        ids = payload.get("item_ids") if finished else payload.get("done_ids")
+        new_ids = [i for i in dict.fromkeys(ids or []) if i not in reported]
+        if new_ids:
+            tags = await asyncio.to_thread(_load_cached_tags, new_ids)
+            for item_id in new_ids:
+                reported.add(item_id)
+                yield task_events.format_sse(None, "item", {"id": item_id, "name": None,
+                                                            "tags": tags.get(item_id) or [], "source": "database"})
+        if finished:
+            status = {"done": "done", "cancelled": "cancelled"}.get(job["status"], "error")
+            yield task_events.format_sse(None, status, {"status": job["status"], "message": job["last_error"]})
+            return
+        if not new_ids:
+            yield ": ping\n\n"
+        await asyncio.sleep(AI_BATCH_POLL_SECONDS)
+
+@router.get("/ai_batch/jobs/{job_id}/events")
+async def ai_batch_job_events(job_id: int, last_event_id: Optional[str] = Header(None)):
+    """
+    SSE 进度流：start / item (每个物品的结果) / progress / done | cancelled | error
+    断线重连时浏览器会带上 Last-Event-ID，只补发之后的事件
+    任务不在本进程执行时退化为轮询 jobs 表 (见 _follow_job_events)
+    """
+    try:
+        after = int(last_event_id or 0)
+    except ValueError:
+        after = 0
+    if task_events.has_channel(job_id):
+        events = task_events.subscribe(job_id, after)
+    else:
+        job = await asyncio.to_thread(job_queue.get_job, job_id)
+        if not job or job["job_type"] != AI_BATCH_JOB:
+            raise HTTPException(status_code=404, detail="任务不存在")
+        events = _follow_job_events(job_id, after)
+    return StreamingResponse(
+        events, media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@router.post("/ai_batch/jobs/{job_id}/cancel")
+async def cancel_ai_batch_job(job_id: int):
+    job = await asyncio.to_thread(job_queue.cancel_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在或已结束")
+    # 本进程运行中的任务会被立即中断，其他进程的在下一组开始前发现已取消；
+    # 还没开始执行的不会进入处理函数，统一在这里结束本进程的事件流
+    task_events.close(job_id, "cancelled", {"status": "cancelled"})
+    return job
@@ -1,6 +1,8 @@
 from fastapi import APIRouter, HTTPException
 from pydantic import BaseModel
 import os
+import tempfile
+from services import category_service
 
 router = APIRouter()
 
@@ -49,12 +51,35 @@ def save_file_content(file_key: str, payload: FileContent):
         raise HTTPException(status_code=400, detail="不支持的文件类型")
     
     file_path = ALLOWED_FILES[file_key]
+
+    # 规则文件先校验再落盘：坏文件一旦写入，重启 / 其他 worker 就没有可用的规则了
+    if file_key == "category_yaml":
+        error = category_service.validate_rules(payload.content)
+        if error:
+            raise HTTPException(status_code=400, detail=f"规则解析失败，未保存: {error}")
+
     try:
         # 确保 data 目录存在
         os.makedirs(os.path.dirname(file_path), exist_ok=True)
-        
-        with open(file_path, "w", encoding="utf-8") as f:
-            f.write(payload.content)
-        return {"status": "success", "message": "配置已保存，下次分类时自动生效"}
+        # 先写临时文件再 os.replace，写到一半崩溃也不会留下截断的文件
+        fd, tmp_path = tempfile.mkstemp(prefix='.editor.', suffix='.tmp', dir=os.path.dirname(file_path))
+        try:
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(payload.content)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, file_path)
+        except BaseException:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=500, detail=str(e))
+
+    if file_key == "category_yaml":
+        # 立即重新编译分类规则 (已校验过，这里失败只可能是文件被并发改动)
+        error = category_service.reload_rules(force=True)
+        if error:
+            return {"status": "warning", "message": f"已保存，但规则解析失败，仍使用上一版规则: {error}"}
+        return {"status": "success", "message": "配置已保存，分类规则已生效"}
+    return {"status": "success", "message": "配置已保存，下次分类时自动生效"}
@@ -3,18 +3,26 @@ from sqlalchemy.orm import Session
 from sqlalchemy import desc
 from database import get_db
 from models import WashHistory
+from services.history_writer import writer
 
 router = APIRouter()
 
 @router.get("/history")
 def get_wash_history(limit: int = 50, db: Session = Depends(get_db)):
     """获取最近的洗版记录"""
+    writer.flush()
     records = db.query(WashHistory).order_by(desc(WashHistory.created_at)).limit(limit).all()
     return records
 
 @router.delete("/history")
 def clear_history(db: Session = Depends(get_db)):
     """清空历史"""
+    writer.flush()
     db.query(WashHistory).delete()
     db.commit()
-    return {"status": "success"}
\ No newline at end of file
+    return {"status": "success"}
+
+@router.get("/history/writer")
+def get_writer_stats():
+    """历史批量写入器状态 (积压数量 / 已写入 / 失败 / 背压阻塞次数)"""
+    return writer.stats()
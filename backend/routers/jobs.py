@@ -0,0 +1,25 @@
+from fastapi import APIRouter, HTTPException
+from typing import Optional
+import asyncio
+from services import job_queue
+
+router = APIRouter()
+
+@router.get("/jobs")
+async def get_jobs(status: Optional[str] = None, job_type: Optional[str] = None, limit: int = 50):
+    """查看任务队列 (可按状态/类型过滤，如 status=dead 查看死信)"""
+    return await asyncio.to_thread(job_queue.list_jobs, status, job_type, limit)
+
+@router.post("/jobs/{job_id}/retry")
+async def retry_job(job_id: int):
+    job = await asyncio.to_thread(job_queue.retry_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在或正在运行")
+    return job
+
+@router.post("/jobs/{job_id}/cancel")
+async def cancel_job(job_id: int):
+    job = await asyncio.to_thread(job_queue.cancel_job, job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="任务不存在或已结束")
+    return job
@@ -1,17 +1,16 @@
-from fastapi import APIRouter, Request, BackgroundTasks
+from fastapi import APIRouter, Request, Body
+from typing import List
+import asyncio
 import logging
-# 引入重构后的 Service
-from services.mp_service import (
-    get_mp_resources, 
-    handle_new_subscription, 
-    run_wash_process
-)
+# 引入重构后的 Service (导入即注册 mp.* 任务处理函数)
+from services.mp_service import get_mp_resources, match_schemes_bulk
+from services import job_queue, webhook_dedup
 
 router = APIRouter()
 logger = logging.getLogger("uvicorn")
 
 @router.post("/webhook/moviepilot")
-async def mp_webhook(request: Request, background_tasks: BackgroundTasks):
+async def mp_webhook(request: Request):
     try:
         payload = await request.json()
         event_type = payload.get("type")
@@ -36,27 +35,42 @@ async def mp_webhook(request: Request, background_tasks: BackgroundTasks):
         if not sub_info["name"]:
             return {"status": "skipped"}
 
-        # 分发任务
         if event_type in ["subscribe.added", "subscribe", "subscribe.add"]:
-            background_tasks.add_task(handle_new_subscription, sub_info)
-            return {"status": "processing_new_sub"}
-
+            job_type, status = "mp.new_subscription", "processing_new_sub"
         elif event_type == "subscribe.complete":
-            background_tasks.add_task(run_wash_process, sub_info)
-            return {"status": "processing_wash"}
-        
+            job_type, status = "mp.wash", "processing_wash"
         else:
             return {"status": "ignored"}
 
+        # 幂等去重：窗口期内同一订阅的重复事件直接丢弃
+        season = data.get("season") or subscribe_info.get("season") or mediainfo.get("season")
+        event_key = webhook_dedup.make_key(event_type, sub_info["id"], sub_info["tmdbid"], season)
+        if not await asyncio.to_thread(webhook_dedup.claim, event_key):
+            logger.info(f"⚪ [重复事件] 已忽略: {event_key}")
+            return {"status": "duplicate"}
+
+        # 分发任务 (只入队，由任务队列 worker 异步处理)
+        try:
+            await asyncio.to_thread(job_queue.enqueue, job_type, sub_info)
+        except Exception:
+            await asyncio.to_thread(webhook_dedup.release, event_key)
+            raise
+        return {"status": status}
+
     except Exception as e:
         logger.error(f"❌ Webhook 处理异常: {e}")
         return {"status": "error"}
 
 @router.get("/resources")
-def get_all_resources():
-    return get_mp_resources()
+async def get_all_resources(refresh: bool = False):
+    return await get_mp_resources(refresh)
 
 @router.get("/sites")
-def get_sites_list():
-    res = get_mp_resources()
-    return res.get("sites", [])
\ No newline at end of file
+async def get_sites_list(refresh: bool = False):
+    res = await get_mp_resources(refresh)
+    return res.get("sites", [])
+
+@router.post("/schemes/match")
+def match_schemes(items: List[dict] = Body(...), scheme_type: str = "wash"):
+    """批量试匹配策略：items 为 [{"title": ..., "category": ...}]，scheme_type 为 wash / subscribe"""
+    return match_schemes_bulk(items, scheme_type)
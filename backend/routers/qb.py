@@ -1,6 +1,6 @@
 from fastapi import APIRouter, HTTPException, Body
 from typing import List, Optional
-from config.settings import load_config, save_config
+from config.settings import load_config, update_config
 from services.qb_service import get_qb_data, get_torrents, delete_torrents,get_torrent_files
 import uuid
 
@@ -9,6 +9,7 @@ router = APIRouter()
 # ===========================
 # 1. qBittorrent 配置管理
 # ===========================
+# 写配置要拿文件锁 + fsync，增删改接口用同步 def，由 FastAPI 放到线程池执行，不阻塞事件循环
 
 @router.get("/qb/configs")
 async def get_qb_configs():
@@ -16,52 +17,46 @@ async def get_qb_configs():
     return cfg.get("qb_configs", [])
 
 @router.post("/qb/configs")
-async def add_qb_config(config: dict = Body(...)):
+def add_qb_config(config: dict = Body(...)):
     if not config.get("name") or not config.get("host"):
         raise HTTPException(status_code=400, detail="Name and Host are required")
     
-    cfg = load_config()
-    qb_configs = cfg.get("qb_configs", [])
-    
     # 生成 ID
     config["id"] = str(uuid.uuid4())
     if "active" not in config:
         config["active"] = True
         
-    qb_configs.append(config)
-    save_config({"qb_configs": qb_configs})
+    def append(qb_configs):
+        qb_configs.append(config)
+        return qb_configs
+
+    update_config("qb_configs", append)
     return config
 
 @router.put("/qb/configs/{config_id}")
-async def update_qb_config(config_id: str, config: dict = Body(...)):
-    cfg = load_config()
-    qb_configs = cfg.get("qb_configs", [])
-    
-    index = -1
-    for i, c in enumerate(qb_configs):
-        if c.get("id") == config_id:
-            index = i
-            break
-            
-    if index == -1:
-        raise HTTPException(status_code=404, detail="Config not found")
-        
+def update_qb_config(config_id: str, config: dict = Body(...)):
     # 保持 ID 不变
     config["id"] = config_id
-    qb_configs[index] = config
-    save_config({"qb_configs": qb_configs})
+
+    def replace(qb_configs):
+        for i, c in enumerate(qb_configs):
+            if c.get("id") == config_id:
+                qb_configs[i] = config
+                return qb_configs
+        raise HTTPException(status_code=404, detail="Config not found")
+
+    update_config("qb_configs", replace)
     return config
 
 @router.delete("/qb/configs/{config_id}")
-async def delete_qb_config(config_id: str):
-    cfg = load_config()
-    qb_configs = cfg.get("qb_configs", [])
-    
-    new_configs = [c for c in qb_configs if c.get("id") != config_id]
-    if len(new_configs) == len(qb_configs):
-        raise HTTPException(status_code=404, detail="Config not found")
-        
-    save_config({"qb_configs": new_configs})
+def delete_qb_config(config_id: str):
+    def remove(qb_configs):
+        new_configs = [c for c in qb_configs if c.get("id") != config_id]
+        if len(new_configs) == len(qb_configs):
+            raise HTTPException(status_code=404, detail="Config not found")
+        return new_configs
+
+    update_config("qb_configs", remove)
     return {"message": "Deleted successfully"}
 
 # ===========================
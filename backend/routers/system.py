@@ -1,5 +1,6 @@
 from fastapi import APIRouter, Body
 from config.settings import load_config, save_config
+from services.rate_limit import upstream_stats
 
 router = APIRouter()
 
@@ -7,6 +8,15 @@ router = APIRouter()
 def get_configuration():
     return load_config()
 
+# 有专门接口做原子增删改的字段，不接受整体覆盖 (避免覆盖并发的修改)
+MANAGED_KEYS = {"qb_configs"}
+
 @router.post("/config")
 def update_configuration(config: dict = Body(...)):
-    return save_config(config)
\ No newline at end of file
+    """局部更新：只写入请求里带的字段，其余字段保持磁盘上的最新值"""
+    return save_config({k: v for k, v in config.items() if k not in MANAGED_KEYS})
+
+@router.get("/upstreams")
+def get_upstream_stats():
+    """各上游的令牌桶状态：剩余令牌、当前速率、被限流/重试次数"""
+    return upstream_stats()
@@ -0,0 +1,80 @@
+from fastapi import APIRouter, Depends, HTTPException, Query
+from sqlalchemy.orm import Session
+from database import get_db
+from pydantic import BaseModel
+from typing import List, Optional
+import asyncio
+import logging
+from services import job_queue, tag_store, ai_tag_cache
+from services.emby_service import update_item_tags
+
+router = APIRouter()
+logger = logging.getLogger("uvicorn")
+
+SYNC_JOB = "tags.sync_emby"
+
+class TagRenameRequest(BaseModel):
+    old: str
+    new: str
+    sync_emby: bool = False   # 同时把 Emby 上的旧标签改掉 (后台任务逐个物品更新)
+
+class TagMergeRequest(BaseModel):
+    sources: List[str]
+    target: str
+    sync_emby: bool = False
+
+class AiCacheInvalidateRequest(BaseModel):
+    content_hashes: List[str] = []
+    item_ids: List[str] = []     # Emby 物品 ID，按镜像表里的内容换算
+    tmdb_ids: List[str] = []
+    all: bool = False
+
+@job_queue.register(SYNC_JOB)
+async def _sync_emby_job(payload: dict):
+    ok = await update_item_tags(payload["item_id"], [], rename=payload["rename"])
+    if not ok:
+        raise RuntimeError(f"Emby 标签更新失败: {payload['item_id']}")
+
+def _apply(db: Session, sources, target, sync_emby):
+    affected = tag_store.merge_tags(db, sources, target)
+    db.commit()
+    if sync_emby and affected:
+        rename = {s: target.strip() for s in sources}
+        for item_id in affected:
+            job_queue.enqueue(SYNC_JOB, {"item_id": item_id, "rename": rename})
+    return {"status": "success", "affected": len(affected), "item_ids": affected}
+
+@router.get("/tags/facets")
+def tag_facets(prefix: Optional[str] = None, limit: int = Query(200, ge=1, le=2000), db: Session = Depends(get_db)):
+    """标签 -> 物品数 (按数量倒序)，prefix 用于输入联想"""
+    return {"tags": tag_store.facets(db, prefix, limit)}
+
+@router.get("/tags/items")
+def tag_items(tag: str, offset: int = Query(0, ge=0), limit: int = Query(50, ge=1, le=500),
+              db: Session = Depends(get_db)):
+    """带某标签的物品 (分页)"""
+    return tag_store.items_by_tag(db, tag, offset, limit)
+
+@router.post("/tags/rename")
+async def rename_tag(req: TagRenameRequest, db: Session = Depends(get_db)):
+    if not req.old.strip() or not req.new.strip():
+        raise HTTPException(status_code=400, detail="标签名不能为空")
+    return await asyncio.to_thread(_apply, db, [req.old], req.new, req.sync_emby)
+
+@router.post("/tags/merge")
+async def merge_tags(req: TagMergeRequest, db: Session = Depends(get_db)):
+    if not req.target.strip() or not [s for s in req.sources if s.strip()]:
+        raise HTTPException(status_code=400, detail="请提供来源标签和目标标签")
+    return await asyncio.to_thread(_apply, db, req.sources, req.target, req.sync_emby)
+
+@router.get("/tags/ai_cache")
+def ai_cache_stats():
+    """AI 标签内容缓存：条目数 / 本次运行命中率 / 累计命中"""
+    return ai_tag_cache.stats()
+
+@router.post("/tags/ai_cache/invalidate")
+def invalidate_ai_cache(req: AiCacheInvalidateRequest):
+    if not (req.all or req.content_hashes or req.item_ids or req.tmdb_ids):
+        raise HTTPException(status_code=400, detail="请指定要失效的条目，或 all=true 清空")
+    removed = ai_tag_cache.invalidate(req.content_hashes, req.item_ids, req.tmdb_ids, everything=req.all)
+    return {"status": "success", "removed": removed}
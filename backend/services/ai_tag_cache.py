@@ -0,0 +1,178 @@
+import hashlib
+import logging
+import re
+import threading
+import unicodedata
+from datetime import datetime
+from sqlalchemy import func, or_
+from sqlalchemy.dialects.sqlite import insert
+from database import SessionLocal
+from models import AiTagCache, EmbyItem
+
+logger = logging.getLogger("uvicorn")
+
+# ===========================
+# AI 标签内容缓存
+# ===========================
+# MediaTag 按 Emby item_id 缓存：同一部作品出现在另一个媒体库、或 Emby 重新扫描换了 ID，
+# 都会再花一次 AI Token。这里按作品内容算哈希：
+#   规范化标题 + 年份 + TMDB ID + 简介前 OVERVIEW_PREFIX 个字 (和发给 AI 的内容一致)
+# ask_ai 调用前先查这里，命中的条目不再请求 AI。
+
+OVERVIEW_PREFIX = 150
+_SEPARATORS = re.compile(r'[\s\u200b-\u200f\ufeff]+')
+_PUNCT = re.compile(r"[^\w]+")
+
+_stats = {"hits": 0, "misses": 0, "stores": 0}
+_stats_lock = threading.Lock()
+
+def _normalize(value):
+    """全角转半角、小写、去掉空白和标点"""
+    value = unicodedata.normalize("NFKC", str(value or "")).lower()
+    return _PUNCT.sub("", _SEPARATORS.sub("", value))
+
+def content_key(item):
+    """
+    :param item: Emby 格式的物品 (Name / ProductionYear / Overview / ProviderIds)
+    :return: sha1 内容哈希
+    """
+    overview = _SEPARATORS.sub(" ", unicodedata.normalize("NFKC", item.get("Overview") or "")).strip()
+    parts = [
+        _normalize(item.get("Name")),
+        str(item.get("ProductionYear") or ""),
+        str((item.get("ProviderIds") or {}).get("Tmdb") or ""),
+        overview[:OVERVIEW_PREFIX],
+    ]
+    return hashlib.sha1("\x1f".join(parts).encode("utf-8")).hexdigest()
+
+def _count(key, n=1):
+    with _stats_lock:
+        _stats[key] += n
+
+# ===========================
+# 1. 查询 / 写入
+# ===========================
+
+def get_many(items):
+    """
+    :return: 与 items 一一对应的标签列表，未命中为 None
+    """
+    keys = [content_key(i) for i in items]
+    if not keys:
+        return []
+    db = SessionLocal()
+    try:
+        found = {}
+        unique = list(dict.fromkeys(keys))
+        for start in range(0, len(unique), 500):
+            chunk = unique[start:start + 500]
+            for row in db.query(AiTagCache.content_hash, AiTagCache.tags).filter(AiTagCache.content_hash.in_(chunk)):
+                if row.tags:
+                    found[row.content_hash] = list(row.tags)
+        if found:
+            hit_keys = list(found)
+            for start in range(0, len(hit_keys), 500):
+                db.query(AiTagCache).filter(AiTagCache.content_hash.in_(hit_keys[start:start + 500])).update(
+                    {AiTagCache.hits: AiTagCache.hits + 1, AiTagCache.last_hit_at: datetime.utcnow()},
+                    synchronize_session=False,
+                )
+            db.commit()
+    finally:
+        db.close()
+    results = [found.get(k) for k in keys]
+    hits = sum(1 for r in results if r is not None)
+    _count("hits", hits)
+    _count("misses", len(results) - hits)
+    return results
+
+def put_many(items, tags_list):
+    """写入 AI 结果 (空结果不缓存)；同一内容再次写入时覆盖"""
+    rows = {}
+    for item, tags in zip(items, tags_list):
+        if not tags:
+            continue
+        key = content_key(item)
+        rows[key] = {
+            "content_hash": key,
+            "name": item.get("Name"),
+            "year": item.get("ProductionYear"),
+            "tmdb_id": (item.get("ProviderIds") or {}).get("Tmdb"),
+            "tags": list(tags),
+        }
+    if not rows:
+        return
+    db = SessionLocal()
+    try:
+        stmt = insert(AiTagCache)
+        db.execute(stmt.on_conflict_do_update(
+            index_elements=[AiTagCache.content_hash],
+            set_={"name": stmt.excluded.name, "year": stmt.excluded.year,
+                  "tmdb_id": stmt.excluded.tmdb_id, "tags": stmt.excluded.tags},
+        ), list(rows.values()))
+        db.commit()
+        _count("stores", len(rows))
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"⚠️ AI 标签缓存写入失败: {e}")
+    finally:
+        db.close()
+
+# ===========================
+# 2. 失效 / 统计
+# ===========================
+
+def _mirror_items(item_ids):
+    """从媒体库镜像里取物品内容，换算成内容哈希"""
+    db = SessionLocal()
+    try:
+        rows = db.query(EmbyItem).filter(EmbyItem.id.in_(list(item_ids))).all()
+        return [{"Name": r.name, "ProductionYear": r.year, "Overview": r.overview,
+                 "ProviderIds": {"Tmdb": r.tmdb_id} if r.tmdb_id else {}} for r in rows]
+    finally:
+        db.close()
+
+def invalidate(content_hashes=None, item_ids=None, tmdb_ids=None, everything=False):
+    """
+    删除缓存条目
+    :param item_ids: Emby 物品 ID (按镜像表里的内容换算哈希)
+    :param tmdb_ids: 删除这些 TMDB ID 的所有条目 (标题 / 简介改过的旧版本也一起删)
+    :return: 删除条数
+    """
+    db = SessionLocal()
+    try:
+        query = db.query(AiTagCache)
+        if not everything:
+            keys = set(content_hashes or [])
+            if item_ids:
+                keys.update(content_key(i) for i in _mirror_items(item_ids))
+            conditions = []
+            if keys:
+                conditions.append(AiTagCache.content_hash.in_(list(keys)))
+            if tmdb_ids:
+                conditions.append(AiTagCache.tmdb_id.in_([str(t) for t in tmdb_ids]))
+            if not conditions:
+                return 0
+            query = query.filter(or_(*conditions))
+        removed = query.delete(synchronize_session=False)
+        db.commit()
+        if removed:
+            logger.info(f"🧹 [AI缓存] 已失效 {removed} 条")
+        return removed
+    finally:
+        db.close()
+
+def stats():
+    db = SessionLocal()
+    try:
+        entries, total_hits = db.query(func.count(AiTagCache.content_hash), func.coalesce(func.sum(AiTagCache.hits), 0)).one()
+    finally:
+        db.close()
+    with _stats_lock:
+        current = dict(_stats)
+    lookups = current["hits"] + current["misses"]
+    return {
+        "entries": entries,
+        "lifetime_hits": total_hits,
+        **current,
+        "hit_rate": round(current["hits"] / lookups, 4) if lookups else None,
+    }
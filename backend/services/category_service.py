@@ -1,6 +1,9 @@
 import yaml
 import os
 import logging
+import threading
+import asyncio
+import time
 # 如果你的 config.settings 没问题，保留这个引入；
 # 如果报错找不到 DATA_DIR，可以用注释掉的那行 os.path 替代
 from config.settings import DATA_DIR
@@ -14,19 +17,124 @@ BACKEND_DIR = os.path.dirname(CURRENT_DIR)
 # 🔥 拼接出准确的 data 路径 (/app/backend/data/category.yaml)
 RULES_FILE = os.path.join(BACKEND_DIR, 'data', 'category.yaml')
 
-def load_rules():
+# ===========================
+# 编译后的分类规则 (按文件变更热加载)
+# ===========================
+# category.yaml 只在文件变化 (mtime/size) 或编辑器保存时重新解析，
+# 解析结果编译成有序的 [(分类名, ((字段, 规则值集合), ...)), ...]，
+# 每次分类只做内存里的集合求交，不再读文件 / 解析 YAML。
+# 解析失败时保留上一个可用版本。
+
+RULE_FIELDS = ("origin_country", "genre_ids", "original_language")
+
+_compiled = {"signature": None, "rules": {}, "error": None}
+_compile_lock = threading.Lock()
+
+def _file_signature():
+    try:
+        st = os.stat(RULES_FILE)
+        return (st.st_mtime_ns, st.st_size)
+    except FileNotFoundError:
+        return None
+
+def _normalize(values):
+    """转成大写字符串集合 (兼容数字 ID 和字符串)"""
+    return frozenset(str(x).strip().upper() for x in values if x is not None)
+
+def compile_rules(data):
     """
-    加载规则文件，增加空文件保护
+    把 YAML 解析结果编译成 {'movie': [...], 'tv': [...]}
+    每个分类: (分类名, 条件元组)；条件元组为空表示无条件直接命中
     """
+    compiled = {}
+    for root_key in ("movie", "tv"):
+        # 如果 yaml 里写了 'movie:' 但下面没缩进内容，get 返回 None
+        type_rules = data.get(root_key) or {}
+        if not isinstance(type_rules, dict):
+            raise ValueError(f"'{root_key}' 下应为 分类名: 条件 的映射")
+        entries = []
+        for category_name, conditions in type_rules.items():
+            conditions = conditions or {}
+            if not isinstance(conditions, dict):
+                raise ValueError(f"分类 [{category_name}] 的条件应为映射")
+            preds = []
+            for field in RULE_FIELDS:
+                rule_val = conditions.get(field)
+                # 规则为空则视为通过，不生成条件
+                if not rule_val:
+                    continue
+                preds.append((field, _normalize(str(rule_val).split(','))))
+            entries.append((category_name, tuple(preds)))
+        compiled[root_key] = entries
+    return compiled
+
+def parse_rules_text(content):
+    """解析规则 YAML 文本；格式不对抛异常"""
+    data = yaml.safe_load(content) if content and content.strip() else {}
+    # 空文件 safe_load 会返回 None
+    if data is None:
+        return {}
+    if not isinstance(data, dict):
+        raise ValueError("规则文件顶层应为映射 (movie / tv)")
+    return data
+
+def validate_rules(content):
+    """保存前校验：能解析并编译返回 None，否则返回错误信息"""
+    try:
+        compile_rules(parse_rules_text(content))
+    except Exception as e:
+        return str(e)
+    return None
+
+def _parse_file():
     if not os.path.exists(RULES_FILE):
-        # 找不到文件时不报错，只返回空，避免刷屏
         return {}
+    with open(RULES_FILE, 'r', encoding='utf-8') as f:
+        return parse_rules_text(f.read())
+
+def reload_rules(force=False):
+    """
+    文件有变化 (或 force) 时重新编译规则；失败保留上一个可用版本
+    :return: 错误信息，成功返回 None
+    """
+    signature = _file_signature()
+    if not force and signature == _compiled["signature"]:
+        return _compiled["error"]
+    with _compile_lock:
+        signature = _file_signature()
+        if not force and signature == _compiled["signature"]:
+            return _compiled["error"]
+        try:
+            rules = compile_rules(_parse_file())
+        except Exception as e:
+            logger.error(f"❌ 规则文件解析失败，继续使用上一版规则: {e}")
+            _compiled["error"] = str(e)
+        else:
+            _compiled["rules"] = rules
+            _compiled["error"] = None
+            logger.info(f"📂 分类规则已加载: 电影 {len(rules['movie'])} 条, 剧集 {len(rules['tv'])} 条")
+        # 失败的版本也记录签名，避免每次分类都重复解析同一个坏文件
+        _compiled["signature"] = signature
+        return _compiled["error"]
+
+def get_compiled_rules():
+    reload_rules()
+    return _compiled["rules"]
+
+def rules_status():
+    return {
+        "loaded": bool(_compiled["rules"]),
+        "movie": len(_compiled["rules"].get("movie", [])),
+        "tv": len(_compiled["rules"].get("tv", [])),
+        "error": _compiled["error"],
+    }
+
+def load_rules():
+    """
+    加载规则文件原始内容，增加空文件保护
+    """
     try:
-        with open(RULES_FILE, 'r', encoding='utf-8') as f:
-            data = yaml.safe_load(f)
-            # 🔥 核心修复 1：如果不检查，空文件 safe_load 会返回 None，导致后续报错
-            # 这里强制保证返回的是一个字典
-            return data if isinstance(data, dict) else {}
+        return _parse_file()
     except Exception as e:
         logger.error(f"❌ 规则文件解析失败: {e}")
         return {}
@@ -43,83 +151,225 @@ def check_condition(rule_val, data_val):
     if not data_val:
         return False # 规则不为空，但数据为空，视为不通过
         
-    # 将规则转为列表 (字符串转大写，去空格)
-    rule_list = [str(x).strip().upper() for x in str(rule_val).split(',')]
-    
-    # 将数据转为字符串列表 (兼容数字ID和字符串)
-    data_list = [str(x).strip().upper() for x in data_val]
-    
-    # 取交集，如果有交集则命中
-    return bool(set(rule_list) & set(data_list))
+    return not _normalize(str(rule_val).split(',')).isdisjoint(_normalize(data_val))
+
+def extract_features(tmdb_info, root_key):
+    """提取 TMDB 关键特征，转成与编译规则相同的大写字符串集合"""
+    # --- 产地 --- 电影用 production_countries，剧集用 origin_country
+    countries = tmdb_info.production_countries if root_key == "movie" else tmdb_info.origin_country
+    return {
+        "origin_country": _normalize(countries),
+        "genre_ids": _normalize(tmdb_info.genre_ids),
+        "original_language": _normalize([tmdb_info.original_language]),
+    }
+
+def match_category(entries, features):
+    """按顺序返回第一个命中的分类名；规则不为空但数据为空视为不通过"""
+    for category_name, preds in entries:
+        if all(not rule_set.isdisjoint(features[field]) for field, rule_set in preds):
+            return category_name
+    return None
 
 def determine_category(tmdb_info, media_type_cn):
     """
     根据 TMDB 信息和规则，决定分类
-    :param tmdb_info: TMDB 返回的详情字典
+    :param tmdb_info: TmdbRecord (tmdb_service.get_tmdb_info 的返回值)
     :param media_type_cn: '电影' 或 '电视剧' (或其他)
     """
-    # 1. 加载规则 (现在很安全，一定返回字典)
-    rules = load_rules()
-    if not rules:
-        return None
+    # 1. 取编译好的规则 (文件没变化时不会重新解析)
+    rules = get_compiled_rules()
     
     # 2. 确定根节点 (movie 或 tv)
     # 兼容 '电影' / 'movie' 两种写法，防止传参不一致
     is_movie = str(media_type_cn) == "电影" or str(media_type_cn).lower() == "movie"
     root_key = "movie" if is_movie else "tv"
     
-    # 🔥 核心修复 2：如果 yaml 里写了 'movie:' 但下面没缩进内容，get 返回 None
-    # 使用 ( ... or {} ) 强制转为字典，防止后续 .items() 报错
-    type_rules = rules.get(root_key) or {}
-    
-    if not type_rules:
+    entries = rules.get(root_key)
+    if not entries:
         return None
 
-    # 3. 提取 TMDB 关键特征 (保留了你优秀的处理逻辑)
-    # --- 产地 ---
-    origin_countries = tmdb_info.get("origin_country", []) # 默认取 TV 的字段
-    if root_key == "movie":
-        # 电影通常用 production_countries，结构是 list[dict]
-        p_countries = tmdb_info.get("production_countries", [])
-        origin_countries = [c.get("iso_3166_1") for c in p_countries if c.get("iso_3166_1")]
-    
-    # --- 类型 ID ---
-    genres = tmdb_info.get("genres", [])
-    genre_ids = [g.get("id") for g in genres if g.get("id")]
-    
-    # --- 原始语言 ---
-    # 放入列表是为了配合 check_condition 的 list 交集逻辑
-    original_language = [tmdb_info.get("original_language")]
-
-    # 4. 遍历规则
-    for category_name, conditions in type_rules.items():
-        # 如果条件为 None (yaml里 key 后没写内容)，且不是排在最后的兜底，通常跳过
-        # 但如果你想表达 "只要写了这个分类名就直接命中"，可以保留 return
-        if not conditions:
-            # 这是一个策略选择：如果是空条件，是否直接命中？
-            # 建议：如果只想让它作为兜底（比如 "未分类"），可以放在 yaml 最后
-            logger.info(f"⚠️ 分类 [{category_name}] 没有定义条件，直接命中")
-            return category_name
-            
-        is_match = True
-        
-        # 检查 origin_country
-        if "origin_country" in conditions:
-            if not check_condition(conditions["origin_country"], origin_countries):
-                is_match = False
-        
-        # 检查 genre_ids
-        if is_match and "genre_ids" in conditions:
-            if not check_condition(conditions["genre_ids"], genre_ids):
-                is_match = False
-                
-        # 检查 original_language
-        if is_match and "original_language" in conditions:
-             if not check_condition(conditions["original_language"], original_language):
-                is_match = False
-
-        if is_match:
-            logger.info(f"✅ 命中分类规则: [{category_name}] | 媒体: {tmdb_info.get('title') or tmdb_info.get('name')}")
-            return category_name
+    # 3. 遍历规则 (纯内存集合求交)
+    category_name = match_category(entries, extract_features(tmdb_info, root_key))
+    if category_name:
+        logger.info(f"✅ 命中分类规则: [{category_name}] | 媒体: {tmdb_info.title}")
+    return category_name
+
+# ===========================
+# 批量分类 (一次取规则，所有条目同一版本)
+# ===========================
+
+def categorize_record(record, rules):
+    """对已取到的编译规则求分类，不打日志 (批量场景用)"""
+    root_key = "movie" if record.media_type == "movie" else "tv"
+    entries = rules.get(root_key)
+    if not entries:
+        return None
+    return match_category(entries, extract_features(record, root_key))
+
+async def categorize_many(targets, concurrency=8):
+    """
+    批量分类：有限并发拉取 TMDB (走缓存)，用同一版编译规则求值
+    :param targets: 异步可迭代的 {"tmdb_id", "media_type", "name"?}
+    :return: 异步生成器，按完成顺序产出每条结果，最后产出一条 summary
+    """
+    from services.tmdb_service import get_tmdb_info, normalize_media_type
+
+    rules = get_compiled_rules()
+    started = time.perf_counter()
+    inbox = asyncio.Queue(maxsize=concurrency * 2)
+    outbox = asyncio.Queue()
+    counts, uncategorized, failed = {}, [], []
+    total = 0
+
+    async def feed():
+        try:
+            async for target in targets:
+                await inbox.put(target)
+        finally:
+            # 出错时也要让 worker 退出；被取消时 worker 同样已被取消，不必通知
+            if not asyncio.current_task().cancelling():
+                for _ in range(concurrency):
+                    await inbox.put(None)
+
+    async def work():
+        while True:
+            target = await inbox.get()
+            if target is None:
+                break
+            media_type = normalize_media_type(target.get("media_type"))
+            result = {"type": "item", "tmdb_id": target["tmdb_id"], "media_type": media_type,
+                      "name": target.get("name"), "category": None}
+            try:
+                record = await get_tmdb_info(target["tmdb_id"], media_type)
+            except Exception as e:
+                record, result["error"] = None, str(e)
+            if record is None:
+                result.setdefault("error", "TMDB 查询失败")
+            else:
+                result["name"] = record.title or result["name"]
+                result["category"] = categorize_record(record, rules)
+            await outbox.put(result)
+        await outbox.put(None)
+
+    tasks = [asyncio.create_task(feed())] + [asyncio.create_task(work()) for _ in range(concurrency)]
+    try:
+        remaining = concurrency
+        while remaining:
+            result = await outbox.get()
+            if result is None:
+                remaining -= 1
+                continue
+            total += 1
+            if result.get("error"):
+                failed.append({k: result[k] for k in ("tmdb_id", "media_type", "name", "error")})
+            elif result["category"] is None:
+                uncategorized.append({k: result[k] for k in ("tmdb_id", "media_type", "name")})
+            else:
+                counts[result["category"]] = counts.get(result["category"], 0) + 1
+            yield result
+        await tasks[0]
+    finally:
+        for t in tasks:
+            t.cancel()
+
+    yield {
+        "type": "summary",
+        "total": total,
+        "counts": counts,
+        "uncategorized": uncategorized,
+        "failed": failed,
+        "elapsed_ms": round((time.perf_counter() - started) * 1000, 1),
+    }
+
+# ===========================
+# 规则试运行 (草稿 vs 当前规则，离线语料)
+# ===========================
+
+def _rule_hits(entries, features):
+    """返回 (首个命中的下标, 所有命中的下标)"""
+    matched = [i for i, (_, preds) in enumerate(entries)
+               if all(not rule_set.isdisjoint(features[field]) for field, rule_set in preds)]
+    return (matched[0] if matched else None), matched
+
+def test_rules(content, records, diff_limit=500):
+    """
+    用草稿 YAML 对离线语料 (TmdbRecord 列表) 求分类，不落盘
+    :return: 解析错误时 {"valid": False, "error"}；否则包括
+             与当前规则的差异、每条规则的命中数 / 求值耗时、无效 (dead) 和被遮蔽 (shadowed) 的规则
+    """
+    try:
+        draft = compile_rules(parse_rules_text(content))
+    except Exception as e:
+        return {"valid": False, "error": str(e)}
+
+    current = get_compiled_rules()
+    stats = {
+        root_key: [{"category": name, "conditions": len(preds), "hits": 0, "matches": 0,
+                    "evaluated": 0, "cost_us": 0.0} for name, preds in entries]
+        for root_key, entries in draft.items()
+    }
+    counts, diff, shadowed_by = {}, [], {}
+    changed = uncategorized = 0
+    started = time.perf_counter()
+
+    for record in records:
+        root_key = "movie" if record.media_type == "movie" else "tv"
+        features = extract_features(record, root_key)
+        entries = draft[root_key]
+        first, matched = _rule_hits(entries, features)
+        after = entries[first][0] if first is not None else None
+        rule_stats = stats[root_key]
+        for i in matched:
+            rule_stats[i]["matches"] += 1
+            if i != first:
+                shadowed_by.setdefault((root_key, i), set()).add(entries[first][0])
+        if first is not None:
+            rule_stats[first]["hits"] += 1
+        if after is None:
+            uncategorized += 1
+        else:
+            counts[after] = counts.get(after, 0) + 1
+
+        before = match_category(current.get(root_key) or [], features)
+        if before != after:
+            changed += 1
+            if len(diff) < diff_limit:
+                diff.append({"tmdb_id": record.tmdb_id, "media_type": record.media_type,
+                             "title": record.title, "before": before, "after": after})
+    elapsed = time.perf_counter() - started
+
+    # 单独计时：每条规则只对"走到它"的记录求值 (与真实分类的短路顺序一致)
+    for root_key, entries in draft.items():
+        pending = [extract_features(r, root_key) for r in records
+                   if ("movie" if r.media_type == "movie" else "tv") == root_key]
+        for i, (_, preds) in enumerate(entries):
+            t0 = time.perf_counter()
+            rest = [f for f in pending
+                    if not all(not rule_set.isdisjoint(f[field]) for field, rule_set in preds)]
+            stats[root_key][i]["evaluated"] = len(pending)
+            stats[root_key][i]["cost_us"] = round((time.perf_counter() - t0) * 1e6, 1)
+            pending = rest
+
+    dead, shadowed = [], []
+    # 语料为空时无法判断规则是否有效
+    for root_key, rule_stats in (stats.items() if records else ()):
+        for i, st in enumerate(rule_stats):
+            label = {"type": root_key, "category": st["category"]}
+            if st["matches"] == 0:
+                dead.append(label)
+            elif st["hits"] == 0:
+                # 能匹配到记录，但这些记录全被前面的规则拿走了
+                shadowed.append({**label, "by": sorted(shadowed_by[(root_key, i)])})
 
-    return None
\ No newline at end of file
+    return {
+        "valid": True,
+        "corpus_size": len(records),
+        "elapsed_ms": round(elapsed * 1000, 2),
+        "counts": counts,
+        "uncategorized": uncategorized,
+        "changed": changed,
+        "diff": diff,
+        "rules": stats,
+        "dead_rules": dead,
+        "shadowed_rules": shadowed,
+    }
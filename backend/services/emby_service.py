@@ -1,8 +1,12 @@
-import requests
+import asyncio
+import copy
 import logging
 import json
 import traceback
 from config.settings import load_config
+from services.http_client import emby_client
+from services.singleflight import coalesce
+from services import library_mirror
 
 logger = logging.getLogger("uvicorn")
 
@@ -20,7 +24,14 @@ def get_emby_headers():
 # ==========================================
 # 🔥 核心修改：升级获取详情逻辑
 # ==========================================
-def get_item_info(item_id):
+def _item_key(item_id):
+    cfg = load_config()
+    return (cfg.get("emby_host", ""), cfg.get("emby_user_id"), item_id)
+
+# 同一剧集被多个入库路径同时查询时合并为一次请求；
+# 调用方 (如 update_item_tags) 会修改返回的字典，所以等待者拿到的是副本
+@coalesce(_item_key, copy_result=copy.deepcopy)
+async def get_item_info(item_id):
     """
     查询 Emby 单个物品详情
     改进点：
@@ -41,19 +52,18 @@ def get_item_info(item_id):
 
     # 准备请求参数：显式要求返回 Tags 和 锁定状态
     params = {
-        'api_key': api_key,
         'Fields': 'Tags,TagItems,LockData,LockedFields,ProviderIds,ProductionYear'
     }
 
     # 优先构造 URL：如果有 UserID，走 User 接口；否则走系统接口
     if user_id:
-        url = f"{host}/emby/Users/{user_id}/Items/{item_id}"
+        url = f"/emby/Users/{user_id}/Items/{item_id}"
     else:
-        url = f"{host}/emby/Items/{item_id}"
+        url = f"/emby/Items/{item_id}"
     
     try:
         # logger.info(f"   ☁️ [发起请求] GET {url}") 
-        resp = requests.get(url, params=params, timeout=10)
+        resp = await emby_client().get(url, params=params, timeout=10)
         
         if resp.status_code == 200:
             return resp.json()
@@ -64,15 +74,48 @@ def get_item_info(item_id):
     
     return None
 
+# ==========================================
+# 批量获取详情 (Ids=a,b,c，一次请求取多个物品)
+# ==========================================
+IDS_PER_REQUEST = 100  # 控制 URL 长度
+
+async def get_items_bulk(item_ids, fields='Overview,ProductionYear,Tags,ProviderIds', client=None, user_id=None):
+    """
+    按 ID 批量查询物品详情，每 IDS_PER_REQUEST 个合并成一次请求 (各批并发)
+    :param client: 前端接口带了 host/key 时传入对应客户端，默认用配置
+    :return: {item_id: item}，查不到的 ID 不在结果里
+    """
+    item_ids = [i for i in dict.fromkeys(item_ids) if i]
+    if not item_ids:
+        return {}
+    client = client or emby_client()
+    if user_id is None:
+        user_id = load_config().get("emby_user_id")
+    url = f"/emby/Users/{user_id}/Items" if user_id else "/emby/Items"
+
+    async def fetch(chunk):
+        resp = await client.get(url, params={'Ids': ','.join(chunk), 'Fields': fields}, timeout=15)
+        resp.raise_for_status()
+        return resp.json().get('Items', [])
+
+    chunks = [item_ids[i:i + IDS_PER_REQUEST] for i in range(0, len(item_ids), IDS_PER_REQUEST)]
+    result = {}
+    for items in await asyncio.gather(*(fetch(c) for c in chunks)):
+        for item in items:
+            if item.get('Id'):
+                result[item['Id']] = item
+    return result
+
 # ==========================================
 # 🔥 配合修改：更新逻辑 (使用上面获取到的完整信息)
 # ==========================================
-def update_item_tags(item_id, new_tags):
+async def update_item_tags(item_id, new_tags, rename=None):
     """
     更新 Emby 物品标签
     1. 获取详情 (包含 LockData)
     2. 解锁 & 清理字段
     3. 提交更新
+    :param rename: {旧标签: 新标签}，先把物品上已有的旧标签替换掉 (标签改名 / 合并时用)
     """
     cfg = load_config()
     host = cfg.get("emby_host", "").rstrip('/')
@@ -82,15 +125,10 @@ def update_item_tags(item_id, new_tags):
         logger.error("❌ 无法更新标签: 配置缺失")
         return False
 
-    headers = {
-        "X-Emby-Token": api_key, # 兼容性写法
-        "Content-Type": "application/json"
-    }
-
     try:
         # 1. 获取详情 (现在的 get_item_info 很健壮)
         # logger.info(f"   🔄 [更新流程] 正在获取旧标签... (ID: {item_id})")
-        item_info = get_item_info(item_id)
+        item_info = await get_item_info(item_id)
         
         if not item_info:
             logger.error(f"   ❌ [更新中止] 无法获取物品详情，可能是网络不通或 ID 错误")
@@ -98,7 +136,8 @@ def update_item_tags(item_id, new_tags):
 
         # 2. 合并标签
         current_tags = item_info.get("Tags", []) or []
-        merged_tags = list(set(current_tags + new_tags))
+        base_tags = [rename.get(t, t) for t in current_tags] if rename else current_tags
+        merged_tags = list(set(base_tags + new_tags))
         
         # 如果标签没变，跳过
         if set(current_tags) == set(merged_tags):
@@ -122,13 +161,12 @@ def update_item_tags(item_id, new_tags):
                 del item_info[k]
 
         # 4. 发送更新
-        url = f"{host}/emby/Items/{item_id}"
-        
-        # 同时在 Query 和 Header 带上 Key，确保成功率
-        resp = requests.post(url, json=item_info, headers=headers, params={'api_key': api_key}, timeout=10)
+        # 连接池客户端已同时在 Query 和 Header 带上 Key，确保成功率
+        resp = await emby_client().post(f"/emby/Items/{item_id}", json=item_info, timeout=10)
         
         if resp.status_code == 204 or resp.status_code == 200:
             logger.info(f"   ✅ [Emby] 标签更新成功！当前标签: {merged_tags}")
+            await asyncio.to_thread(library_mirror.update_tags, item_id, merged_tags)
             return True
         else:
             logger.error(f"   ❌ [更新失败] HTTP {resp.status_code} | {resp.text[:200]}")
@@ -137,4 +175,36 @@ def update_item_tags(item_id, new_tags):
         logger.error(f"❌ [更新异常] {e}")
         logger.error(traceback.format_exc())
         
-    return False
\ No newline at end of file
+    return False
+
+# ==========================================
+# 遍历媒体库 (分页，只取 TMDB ID)
+# ==========================================
+async def iter_library_tmdb_items(library_id, page_size=500):
+    """
+    分页遍历媒体库下的电影 / 剧集，产出 {"tmdb_id", "media_type", "name"}
+    没有 TMDB ID 的条目跳过
+    """
+    cfg = load_config()
+    user_id = cfg.get("emby_user_id")
+    url = f"/emby/Users/{user_id}/Items" if user_id else "/emby/Items"
+    start = 0
+    while True:
+        params = {
+            'IncludeItemTypes': 'Series,Movie', 'Recursive': 'true', 'ParentId': library_id,
+            'Fields': 'ProviderIds', 'StartIndex': start, 'Limit': page_size,
+        }
+        resp = await emby_client().get(url, params=params)
+        resp.raise_for_status()
+        items = resp.json().get('Items', [])
+        for item in items:
+            tmdb_id = (item.get('ProviderIds') or {}).get('Tmdb')
+            if tmdb_id:
+                yield {
+                    "tmdb_id": tmdb_id,
+                    "media_type": "movie" if item.get('Type') == 'Movie' else "tv",
+                    "name": item.get('Name'),
+                }
+        if len(items) < page_size:
+            break
+        start += page_size
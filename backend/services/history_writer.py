@@ -0,0 +1,179 @@
+import asyncio
+import logging
+import queue
+import threading
+import time
+from config.settings import load_config
+from database import SessionLocal
+from models import WashHistory
+
+logger = logging.getLogger("uvicorn")
+
+# ===========================
+# 洗版历史批量写入器
+# ===========================
+# Webhook 路径只把记录放进内存队列就返回；后台线程每攒够 N 条或每隔 M 毫秒，
+# 用一个事务批量写入 (SQLite 上一次 fsync 代替一条一次)。
+# 队列有上限 (背压)：写满时 submit 在线程池里等待写入线程腾出空间，调用方随之变慢，
+# 记录不会丢；事件循环本身不被阻塞。stats() 可查看积压 / 等待情况。
+# 批量写入失败时逐条重试，一条坏数据不会连累整批。
+
+_STOP = object()
+
+class _FlushRequest:
+    def __init__(self):
+        self.done = threading.Event()
+
+class HistoryWriter:
+    def __init__(self):
+        self._queue = None
+        self._thread = None
+        self._batch_size = 50
+        self._flush_interval = 0.5
+        self._capacity = 1000
+        self._stats = {"submitted": 0, "written": 0, "failed": 0, "batches": 0, "waited": 0}
+        # 写入线程和请求线程都会改 / 读统计
+        self._stats_lock = threading.Lock()
+        self._last_warn = 0
+
+    # ---------- 生命周期 ----------
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        cfg = load_config()
+        self._batch_size = max(1, int(cfg.get("history_batch_size") or 50))
+        self._flush_interval = max(10, int(cfg.get("history_flush_ms") or 500)) / 1000
+        self._capacity = max(self._batch_size, int(cfg.get("history_max_pending") or 1000))
+        self._queue = queue.Queue(maxsize=self._capacity)
+        self._thread = threading.Thread(target=self._run, name="history-writer", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        """停止并写完队列里剩余的记录"""
+        if not self._thread:
+            return
+        self._queue.put(_STOP)
+        self._thread.join(timeout)
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    # ---------- 生产者 ----------
+
+    def _count(self, key, n=1):
+        with self._stats_lock:
+            self._stats[key] += n
+
+    async def submit(self, record: dict):
+        """
+        提交一条记录 (在事件循环里 await)
+        队列已满时等待写入线程腾出空间 (在线程里阻塞，不占事件循环)
+        写入器未启动 (如脚本直接调用) 时同步写库。
+        """
+        if not self.running:
+            await asyncio.to_thread(self._write, [record])
+            return
+        self._count("submitted")
+        try:
+            self._queue.put_nowait(record)
+            return
+        except queue.Full:
+            pass
+        self._count("waited")
+        if time.monotonic() - self._last_warn > 10:
+            self._last_warn = time.monotonic()
+            logger.warning(f"⚠️ [历史写入] 队列已满 ({self._capacity})，等待写入线程腾出空间")
+        await asyncio.to_thread(self._queue.put, record)
+
+    def flush(self, timeout=5):
+        """等待当前已提交的记录全部落库 (读历史前调用，保证读到最新数据)"""
+        if not self.running:
+            return
+        req = _FlushRequest()
+        try:
+            self._queue.put(req, timeout=timeout)
+        except queue.Full:
+            return
+        req.done.wait(timeout)
+
+    def stats(self):
+        with self._stats_lock:
+            current = dict(self._stats)
+        return {
+            **current,
+            "pending": self._queue.qsize() if self._queue else 0,
+            "capacity": self._capacity,
+            "batch_size": self._batch_size,
+            "flush_ms": int(self._flush_interval * 1000),
+            "running": self.running,
+        }
+
+    # ---------- 消费者 ----------
+
+    def _run(self):
+        stopping = False
+        while not stopping:
+            batch, waiters = [], []
+            try:
+                item = self._queue.get(timeout=self._flush_interval)
+            except queue.Empty:
+                continue
+            deadline = time.monotonic() + self._flush_interval
+            while True:
+                if item is _STOP:
+                    stopping = True
+                elif isinstance(item, _FlushRequest):
+                    waiters.append(item)
+                else:
+                    batch.append(item)
+                # 攒够一批、收到停止/刷新请求、或到时间，就落库
+                if stopping or waiters or len(batch) >= self._batch_size:
+                    break
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+            if stopping:
+                # 停止前把队列里剩余的记录一起写掉
+                while True:
+                    try:
+                        item = self._queue.get_nowait()
+                    except queue.Empty:
+                        break
+                    if isinstance(item, _FlushRequest):
+                        waiters.append(item)
+                    elif item is not _STOP:
+                        batch.append(item)
+            if batch:
+                self._write(batch)
+            for w in waiters:
+                w.done.set()
+
+    def _write(self, records):
+        db = SessionLocal()
+        try:
+            db.add_all([WashHistory(**r) for r in records])
+            db.commit()
+            self._count("written", len(records))
+            self._count("batches")
+        except Exception as e:
+            db.rollback()
+            if len(records) == 1:
+                self._count("failed")
+                logger.error(f"❌ 写入数据库失败: {e}")
+            else:
+                # 整批失败：逐条重试，只丢真正写不进去的那几条
+                logger.warning(f"⚠️ 批量写入失败 ({len(records)} 条)，改为逐条写入: {e}")
+                db.close()
+                for record in records:
+                    self._write([record])
+        finally:
+            db.close()
+
+writer = HistoryWriter()
@@ -0,0 +1,130 @@
+import asyncio
+import httpx
+import logging
+import threading
+from collections import OrderedDict
+from openai import AsyncOpenAI
+from config.settings import load_config
+from services.rate_limit import UpstreamTransport
+
+logger = logging.getLogger("uvicorn")
+
+# ===========================
+# 共享连接池：每个上游一个长连接异步客户端
+# ===========================
+
+TMDB_BASE_URL = "https://api.themoviedb.org"
+SF_BASE_URL = "https://api.siliconflow.cn/v1"
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_TIMEOUT = 30
+# 每个上游最多同时保留几组客户端 (前端可能带着与配置不同的 host/key 交替请求)
+MAX_CLIENTS_PER_UPSTREAM = 4
+# 被淘汰的客户端延迟关闭，让正在进行的请求先完成
+CLOSE_GRACE_SECONDS = 60
+
+# name -> OrderedDict(fingerprint -> client)，按最近使用排序
+_clients = {}
+_lock = threading.Lock()
+
+def _pool_size(name):
+    sizes = load_config().get("http_pool_sizes") or {}
+    try:
+        return max(1, int(sizes.get(name, DEFAULT_POOL_SIZE)))
+    except (TypeError, ValueError):
+        return DEFAULT_POOL_SIZE
+
+async def _close_client(client):
+    try:
+        # httpx 用 aclose()，AsyncOpenAI 用 close()
+        close = getattr(client, "aclose", None) or client.close
+        await close()
+    except Exception as e:
+        logger.warning(f"⚠️ [连接池] 关闭客户端失败: {e}")
+
+def _schedule_close(client):
+    """宽限期后关闭被淘汰的客户端，释放连接 / 文件描述符"""
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return  # 不在事件循环里 (脚本调用)，交给 GC
+    loop.call_later(CLOSE_GRACE_SECONDS, lambda: loop.create_task(_close_client(client)))
+
+def _get_or_build(name, fingerprint, build):
+    """
+    按指纹 (base_url / 鉴权 / 连接池大小) 复用客户端，每个上游保留最近使用的
+    MAX_CLIENTS_PER_UPSTREAM 组；配置变化或前端带来不同的 host/key 时新建，
+    不会来回重建。超出数量时淘汰最久未用的，宽限期后关闭。
+    """
+    with _lock:
+        group = _clients.setdefault(name, OrderedDict())
+        client = group.get(fingerprint)
+        if client is not None:
+            group.move_to_end(fingerprint)
+            return client
+        client = group[fingerprint] = build()
+        logger.info(f"🔌 [连接池] 已创建 {name} 客户端")
+        evicted = []
+        while len(group) > MAX_CLIENTS_PER_UPSTREAM:
+            evicted.append(group.popitem(last=False)[1])
+    for old in evicted:
+        _schedule_close(old)
+    return client
+
+def _build_http_client(name, base_url="", headers=None, params=None):
+    size = _pool_size(name)
+    limits = httpx.Limits(max_connections=size, max_keepalive_connections=size)
+    # 限流 + 重试包在真实连接池 transport 外层
+    transport = UpstreamTransport(name, httpx.AsyncHTTPTransport(limits=limits))
+    return httpx.AsyncClient(
+        base_url=base_url,
+        headers=headers or {},
+        params=params or {},
+        transport=transport,
+        timeout=DEFAULT_TIMEOUT,
+        follow_redirects=True,
+    )
+
+def emby_client(host=None, api_key=None):
+    """
+    Emby 客户端，默认取配置里的 host/key；
+    前端接口会在请求体里带 host/key，传入即可。
+    """
+    cfg = load_config()
+    host = (host if host is not None else cfg.get("emby_host", "")).rstrip('/')
+    api_key = api_key if api_key is not None else cfg.get("emby_api_key", "")
+    fingerprint = (host, api_key, _pool_size("emby"))
+    return _get_or_build("emby", fingerprint, lambda: _build_http_client(
+        "emby", base_url=host, headers={"X-Emby-Token": api_key}, params={"api_key": api_key}
+    ))
+
+def mp_client():
+    """MP 客户端 (Bearer 令牌随请求附带，由 MpTokenManager 管理)"""
+    host = load_config().get("mp_host", "").rstrip('/')
+    fingerprint = (host, _pool_size("mp"))
+    return _get_or_build("mp", fingerprint, lambda: _build_http_client("mp", base_url=host))
+
+def tmdb_client():
+    api_key = load_config().get("tmdb_api_key", "")
+    fingerprint = (api_key, _pool_size("tmdb"))
+    return _get_or_build("tmdb", fingerprint, lambda: _build_http_client(
+        "tmdb", base_url=TMDB_BASE_URL, params={"api_key": api_key}
+    ))
+
+def ai_client(api_key):
+    """SiliconFlow (OpenAI 兼容) 客户端，按 api_key 复用"""
+    fingerprint = (api_key, _pool_size("siliconflow"))
+    return _get_or_build("siliconflow", fingerprint, lambda: AsyncOpenAI(
+        api_key=api_key,
+        base_url=SF_BASE_URL,
+        http_client=_build_http_client("siliconflow"),
+        max_retries=0,  # 重试由 UpstreamTransport 统一处理
+    ))
+
+async def close_all():
+    """应用关闭时释放所有连接"""
+    with _lock:
+        clients = [c for group in _clients.values() for c in group.values()]
+        _clients.clear()
+    for client in clients:
+        await _close_client(client)
@@ -0,0 +1,471 @@
+import asyncio
+import contextvars
+import logging
+import os
+import random
+import socket
+import traceback
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import desc, or_, text
+from config.settings import load_config
+from database import SessionLocal, engine
+from models import Job
+
+logger = logging.getLogger("uvicorn")
+
+# ===========================
+# 持久化任务队列 (SQLite jobs 表 + 异步 worker 池)
+# ===========================
+# - Webhook 只负责 enqueue，真正的处理由 worker 异步执行
+# - 每种任务类型单独限流 (job_concurrency)
+# - 失败按指数退避重试，超过 max_attempts 进入死信 (dead)
+# - 运行中的任务由所属进程定期续租 (心跳)；只有其他进程 (已崩溃/被杀) 持有且租约过期的
+#   running 任务才会被放回 pending，本进程仍在跑的长任务不会被重复执行
+
+POLL_INTERVAL = 2           # 无任务时的轮询间隔 (秒)
+LEASE_SECONDS = 600         # running 任务的租约，超时未续租视为 worker 已死
+HEARTBEAT_SECONDS = 60      # 续租间隔，需远小于 LEASE_SECONDS
+BACKOFF_BASE = 10           # 重试退避基数 (秒)
+BACKOFF_MAX = 3600          # 单次退避上限 (秒)
+RETENTION_DAYS = 7          # done/cancelled 任务保留天数
+
+HANDLERS = {}
+
+# 本进程的唯一标识，写入 jobs.locked_by
+OWNER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# 当前正在执行的任务 (供处理函数判断是否最后一次尝试)
+_current_job = contextvars.ContextVar("current_job", default=None)
+
+class RetryLater(Exception):
+    """处理函数主动要求稍后重试 (如上游暂时不可用)"""
+
+def register(job_type):
+    """注册任务处理函数，处理函数接收 payload (dict)，抛异常即视为失败"""
+    def decorator(func):
+        HANDLERS[job_type] = func
+        return func
+    return decorator
+
+def is_final_attempt():
+    """当前任务是否是最后一次尝试；不在任务上下文中直接调用时视为 True"""
+    job = _current_job.get()
+    return job is None or job["attempts"] >= job["max_attempts"]
+
+def current_job_id():
+    """当前任务 ID；不在任务上下文中返回 None"""
+    job = _current_job.get()
+    return job["id"] if job else None
+
+def is_cancelled(job_id):
+    """
+    任务是否已被取消 (取消可能来自其他进程，本进程的 cancel_running 够不着)
+    长任务在各阶段之间调用，发现已取消就提前结束
+    """
+    db = SessionLocal()
+    try:
+        return db.query(Job.status).filter(Job.id == job_id).scalar() == "cancelled"
+    finally:
+        db.close()
+
+def checkpoint(job_id, payload):
+    """
+    保存运行中任务的进度 (覆盖 payload)
+    任务被回收 / 关闭时放回队列后重新执行，处理函数可据此跳过已完成的部分
+    """
+    db = SessionLocal()
+    try:
+        db.query(Job).filter(Job.id == job_id, Job.status == "running", Job.locked_by == OWNER_ID).update(
+            {Job.payload: payload}, synchronize_session=False,
+        )
+        db.commit()
+    finally:
+        db.close()
+
+def _utcnow():
+    return datetime.utcnow()
+
+# 对外返回任务时隐藏 payload 里的凭据 (旧版本的任务可能带着)
+_SECRET_MARKERS = ("api_key", "password", "token", "secret")
+
+def _redact(payload):
+    if not isinstance(payload, dict):
+        return payload
+    return {k: ("***" if any(m in str(k).lower() for m in _SECRET_MARKERS) and v else v) for k, v in payload.items()}
+
+def _to_dict(job: Job, redact=True):
+    """redact=False 仅用于交给处理函数执行"""
+    return {
+        "id": job.id, "job_type": job.job_type, "payload": _redact(job.payload) if redact else job.payload,
+        "status": job.status, "attempts": job.attempts, "max_attempts": job.max_attempts,
+        "last_error": job.last_error, "dedup_key": job.dedup_key,
+        "run_after": job.run_after, "created_at": job.created_at, "updated_at": job.updated_at,
+    }
+
+# ===========================
+# 1. 入队
+# ===========================
+
+def enqueue(job_type, payload, delay=0, dedup_key=None, max_attempts=None):
+    """
+    写入一个任务并唤醒 worker。
+    :param delay: 延迟执行秒数
+    :param dedup_key: 若已存在同键的 pending 任务，则更新其 payload 并把执行时间推迟 (防抖)
+    :return: 任务 ID
+    """
+    if job_type not in HANDLERS:
+        raise ValueError(f"未注册的任务类型: {job_type}")
+    if max_attempts is None:
+        max_attempts = int(load_config().get("job_max_attempts") or 5)
+    run_after = _utcnow() + timedelta(seconds=delay)
+
+    db = SessionLocal()
+    try:
+        job = None
+        if dedup_key:
+            job = db.query(Job).filter(
+                Job.dedup_key == dedup_key, Job.status == "pending"
+            ).first()
+        if job:
+            job.payload = payload
+            job.run_after = run_after
+        else:
+            job = Job(
+                job_type=job_type, payload=payload, status="pending",
+                attempts=0, max_attempts=max_attempts,
+                dedup_key=dedup_key, run_after=run_after,
+            )
+            db.add(job)
+        db.commit()
+        job_id = job.id
+    finally:
+        db.close()
+
+    queue.wakeup()
+    return job_id
+
+# ===========================
+# 2. 管理接口 (列表 / 重试 / 取消)
+# ===========================
+
+def list_jobs(status=None, job_type=None, limit=50):
+    db = SessionLocal()
+    try:
+        query = db.query(Job)
+        if status: query = query.filter(Job.status == status)
+        if job_type: query = query.filter(Job.job_type == job_type)
+        return [_to_dict(j) for j in query.order_by(desc(Job.id)).limit(limit).all()]
+    finally:
+        db.close()
+
+def get_job(job_id):
+    db = SessionLocal()
+    try:
+        job = db.query(Job).filter(Job.id == job_id).first()
+        return _to_dict(job) if job else None
+    finally:
+        db.close()
+
+def retry_job(job_id):
+    """把任务重新放回队列 (重置尝试次数)；运行中的任务不可重试"""
+    db = SessionLocal()
+    try:
+        job = db.query(Job).filter(Job.id == job_id).first()
+        if not job or job.status == "running":
+            return None
+        job.status = "pending"
+        job.attempts = 0
+        job.last_error = None
+        job.run_after = _utcnow()
+        db.commit()
+        result = _to_dict(job)
+    finally:
+        db.close()
+    queue.wakeup()
+    return result
+
+def cancel_job(job_id):
+    """取消 pending/running 任务；运行中的任务若在本进程内会被立即中断"""
+    db = SessionLocal()
+    try:
+        job = db.query(Job).filter(Job.id == job_id).first()
+        if not job or job.status not in ("pending", "running"):
+            return None
+        job.status = "cancelled"
+        db.commit()
+        result = _to_dict(job)
+    finally:
+        db.close()
+    queue.cancel_running(job_id)
+    return result
+
+# ===========================
+# 3. Worker 池
+# ===========================
+
+class JobQueue:
+    def __init__(self):
+        self._wakeup = None
+        self._loop = None
+        self._dispatcher = None
+        self._heartbeat = None
+        self._slots = None
+        self._running = {}        # job_id -> asyncio.Task
+        self._type_counts = {}    # job_type -> 本进程内运行中的数量
+        self._stopping = False
+
+    # ---------- 生命周期 ----------
+
+    async def start(self):
+        cfg = load_config()
+        workers = max(1, int(cfg.get("job_workers") or 4))
+        self._loop = asyncio.get_running_loop()
+        self._wakeup = asyncio.Event()
+        self._slots = asyncio.Semaphore(workers)
+        self._stopping = False
+        await asyncio.to_thread(self._ensure_schema)
+        recovered = await asyncio.to_thread(self._recover_expired)
+        if recovered:
+            logger.info(f"♻️ [任务队列] 恢复了 {recovered} 个中断的任务")
+        self._dispatcher = asyncio.create_task(self._dispatch_loop())
+        self._heartbeat = asyncio.create_task(self._heartbeat_loop())
+        logger.info(f"🧵 [任务队列] 已启动，worker 数: {workers}")
+
+    async def stop(self):
+        """停止派发；运行中的任务被中断后放回 pending，不计入尝试次数"""
+        self._stopping = True
+        for loop_task in (self._dispatcher, self._heartbeat):
+            if loop_task:
+                loop_task.cancel()
+                try:
+                    await loop_task
+                except asyncio.CancelledError:
+                    pass
+        tasks = list(self._running.values())
+        for t in tasks:
+            t.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+        logger.info("🧵 [任务队列] 已停止")
+
+    def wakeup(self):
+        """线程安全地唤醒派发循环"""
+        if self._loop and self._wakeup and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def cancel_running(self, job_id):
+        task = self._running.get(job_id)
+        if task and self._loop:
+            self._loop.call_soon_threadsafe(task.cancel)
+
+    # ---------- 派发 ----------
+
+    def _limits(self):
+        return load_config().get("job_concurrency") or {}
+
+    def _saturated_types(self):
+        limits = self._limits()
+        return [t for t, n in self._type_counts.items()
+                if limits.get(t) is not None and n >= int(limits[t])]
+
+    async def _dispatch_loop(self):
+        last_maintenance = 0
+        while not self._stopping:
+            try:
+                now = self._loop.time()
+                if now - last_maintenance > 60:
+                    last_maintenance = now
+                    await asyncio.to_thread(self._maintenance)
+
+                await self._slots.acquire()
+                job = await asyncio.to_thread(self._claim, self._saturated_types())
+                if job is None:
+                    self._slots.release()
+                    self._wakeup.clear()
+                    try:
+                        await asyncio.wait_for(self._wakeup.wait(), POLL_INTERVAL)
+                    except asyncio.TimeoutError:
+                        pass
+                    continue
+
+                self._type_counts[job["job_type"]] = self._type_counts.get(job["job_type"], 0) + 1
+                task = asyncio.create_task(self._run(job))
+                self._running[job["id"]] = task
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"❌ [任务队列] 派发异常: {e}")
+                await asyncio.sleep(POLL_INTERVAL)
+
+    async def _heartbeat_loop(self):
+        """定期刷新本进程运行中任务的租约"""
+        while not self._stopping:
+            await asyncio.sleep(HEARTBEAT_SECONDS)
+            job_ids = list(self._running)
+            if not job_ids:
+                continue
+            try:
+                await asyncio.to_thread(self._renew_leases, job_ids)
+            except Exception as e:
+                logger.error(f"❌ [任务队列] 续租失败: {e}")
+
+    def _claim(self, saturated_types):
+        """抢占一个到期的 pending 任务 (条件更新保证多进程下只有一个 worker 拿到)"""
+        db = SessionLocal()
+        try:
+            query = db.query(Job.id).filter(
+                Job.status == "pending",
+                Job.run_after <= _utcnow(),
+                Job.job_type.in_(list(HANDLERS.keys())),
+            )
+            if saturated_types:
+                query = query.filter(Job.job_type.notin_(saturated_types))
+            for (job_id,) in query.order_by(Job.run_after, Job.id).limit(5).all():
+                updated = db.query(Job).filter(Job.id == job_id, Job.status == "pending").update(
+                    {Job.status: "running", Job.locked_at: _utcnow(), Job.locked_by: OWNER_ID,
+                     Job.attempts: Job.attempts + 1},
+                    synchronize_session=False,
+                )
+                db.commit()
+                if updated:
+                    job = db.query(Job).filter(Job.id == job_id).first()
+                    return _to_dict(job, redact=False)
+            return None
+        finally:
+            db.close()
+
+    async def _run(self, job):
+        token = _current_job.set(job)
+        label = f"#{job['id']} {job['job_type']}"
+        try:
+            logger.info(f"▶️ [任务] 开始 {label} (第 {job['attempts']}/{job['max_attempts']} 次)")
+            await HANDLERS[job["job_type"]](job["payload"])
+            await asyncio.to_thread(self._finish, job["id"], "done", None)
+        except asyncio.CancelledError:
+            # 区分：应用关闭 (放回队列) / 用户取消 (状态已是 cancelled) /
+            # 处理函数内部冒出的 CancelledError (如共享请求被取消)，按失败处理以便重试
+            if self._stopping:
+                await asyncio.to_thread(self._release, job["id"])
+            elif await asyncio.to_thread(self._status, job["id"]) == "cancelled":
+                logger.info(f"⏹ [任务] 已取消 {label}")
+            else:
+                await asyncio.to_thread(self._fail, job, "任务被意外中断 (CancelledError)")
+        except Exception as e:
+            if not isinstance(e, RetryLater):
+                logger.error(traceback.format_exc())
+            await asyncio.to_thread(self._fail, job, str(e) or type(e).__name__)
+        finally:
+            _current_job.reset(token)
+            self._running.pop(job["id"], None)
+            self._type_counts[job["job_type"]] -= 1
+            self._slots.release()
+            self._wakeup.set()
+
+    # ---------- 状态落库 ----------
+
+    @staticmethod
+    def _ensure_schema():
+        # 旧版本建的 jobs 表没有 locked_by 列
+        with engine.begin() as conn:
+            columns = {row[1] for row in conn.execute(text("PRAGMA table_info(jobs)"))}
+            if "locked_by" not in columns:
+                conn.execute(text("ALTER TABLE jobs ADD COLUMN locked_by VARCHAR"))
+
+    @staticmethod
+    def _owned(query, job_id):
+        """只改仍由本进程持有的 running 任务：被取消或被其他进程接管后不覆盖其状态"""
+        return query.filter(Job.id == job_id, Job.status == "running", Job.locked_by == OWNER_ID)
+
+    def _status(self, job_id):
+        db = SessionLocal()
+        try:
+            return db.query(Job.status).filter(Job.id == job_id).scalar()
+        finally:
+            db.close()
+
+    def _renew_leases(self, job_ids):
+        db = SessionLocal()
+        try:
+            db.query(Job).filter(
+                Job.id.in_(job_ids), Job.status == "running", Job.locked_by == OWNER_ID
+            ).update({Job.locked_at: _utcnow()}, synchronize_session=False)
+            db.commit()
+        finally:
+            db.close()
+
+    def _finish(self, job_id, status, error):
+        db = SessionLocal()
+        try:
+            # 只更新仍处于 running 的任务，避免覆盖期间被用户取消的状态
+            self._owned(db.query(Job), job_id).update(
+                {Job.status: status, Job.last_error: error, Job.locked_at: None},
+                synchronize_session=False,
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _fail(self, job, error):
+        if job["attempts"] >= job["max_attempts"]:
+            logger.error(f"💀 [任务] #{job['id']} {job['job_type']} 重试耗尽，进入死信: {error}")
+            self._finish(job["id"], "dead", error)
+            return
+        delay = min(BACKOFF_MAX, BACKOFF_BASE * (2 ** (job["attempts"] - 1)))
+        delay = delay * random.uniform(0.8, 1.2)
+        logger.warning(f"🔁 [任务] #{job['id']} {job['job_type']} 失败，{delay:.0f}s 后重试: {error}")
+        db = SessionLocal()
+        try:
+            self._owned(db.query(Job), job["id"]).update(
+                {Job.status: "pending", Job.last_error: error, Job.locked_at: None, Job.locked_by: None,
+                 Job.run_after: _utcnow() + timedelta(seconds=delay)},
+                synchronize_session=False,
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _release(self, job_id):
+        db = SessionLocal()
+        try:
+            self._owned(db.query(Job), job_id).update(
+                {Job.status: "pending", Job.locked_at: None, Job.locked_by: None, Job.attempts: Job.attempts - 1},
+                synchronize_session=False,
+            )
+            db.commit()
+        finally:
+            db.close()
+
+    def _recover_expired(self):
+        """
+        其他进程持有且租约过期的 running 任务 (worker 崩溃/被杀) 放回 pending
+        本进程的任务由心跳续租，不在回收范围内
+        """
+        db = SessionLocal()
+        try:
+            expired = _utcnow() - timedelta(seconds=LEASE_SECONDS)
+            count = db.query(Job).filter(
+                Job.status == "running",
+                or_(Job.locked_at.is_(None), Job.locked_at < expired),
+                or_(Job.locked_by.is_(None), Job.locked_by != OWNER_ID),
+            ).update(
+                {Job.status: "pending", Job.locked_at: None, Job.locked_by: None}, synchronize_session=False,
+            )
+            db.commit()
+            return count
+        finally:
+            db.close()
+
+    def _maintenance(self):
+        self._recover_expired()
+        db = SessionLocal()
+        try:
+            cutoff = _utcnow() - timedelta(days=RETENTION_DAYS)
+            db.query(Job).filter(Job.status.in_(["done", "cancelled"]), Job.updated_at < cutoff).delete(
+                synchronize_session=False
+            )
+            db.commit()
+        finally:
+            db.close()
+
+queue = JobQueue()
@@ -0,0 +1,277 @@
+import asyncio
+import hashlib
+import logging
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from sqlalchemy.dialects.sqlite import insert
+from config.settings import load_config
+from database import SessionLocal
+from models import EmbyItem, EmbySyncState
+from services import job_queue, search_index
+from services.http_client import emby_client
+
+logger = logging.getLogger("uvicorn")
+
+# ===========================
+# Emby 媒体库本地镜像
+# ===========================
+# - 增量同步：按媒体库记录最大 DateLastSaved，下次只拉 MinDateLastSaved 之后变化的条目
+# - 全量同步：首次或超过 emby_full_sync_hours，顺便清理 Emby 里已删除的条目
+# - 分页拉取 (每页 PAGE_SIZE)，每页一个事务批量 upsert
+# - 定时任务 + Webhook 触发保持新鲜；列表 / 搜索接口直接查本地表
+
+PAGE_SIZE = 500
+SYNC_JOB = "emby.mirror_sync"
+ITEM_FIELDS = 'Tags,TagItems,OriginalTitle,ProductionYear,Overview,ProviderIds,DateCreated,DateLastSaved'
+
+_sync_lock = asyncio.Lock()
+
+def overview_hash(overview):
+    return hashlib.sha1((overview or "").encode("utf-8")).hexdigest()
+
+def _row_from_item(item, library_id, now):
+    # 兼容 Tags 和 TagItems
+    tags = item.get('Tags') or []
+    if not tags and item.get('TagItems'):
+        tags = [t.get('Name') for t in item.get('TagItems')]
+    overview = item.get('Overview') or ""
+    return {
+        "id": item['Id'],
+        "library_id": library_id,
+        "item_type": item.get('Type'),
+        "name": item.get('Name'),
+        "original_title": item.get('OriginalTitle'),
+        "pinyin": search_index.to_pinyin(item.get('Name')),
+        "year": item.get('ProductionYear'),
+        "overview": overview,
+        "overview_hash": overview_hash(overview),
+        "tmdb_id": (item.get('ProviderIds') or {}).get('Tmdb'),
+        "tags": tags,
+        "date_created": item.get('DateCreated'),
+        "date_last_saved": item.get('DateLastSaved'),
+        "synced_at": now,
+    }
+
+def to_api_item(row: EmbyItem):
+    """与原 Emby 代理接口相同的返回格式"""
+    return {
+        "id": row.id, "name": row.name, "year": row.year,
+        "current_tags": row.tags or [], "overview": row.overview or "",
+    }
+
+# ===========================
+# 1. 本地表读写
+# ===========================
+
+def _upsert(rows):
+    if not rows:
+        return
+    db = SessionLocal()
+    try:
+        # executemany：语句只编译一次，比拼一个超长 VALUES 快得多
+        stmt = insert(EmbyItem)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[EmbyItem.id],
+            set_={c: stmt.excluded[c] for c in rows[0] if c != "id"},
+        )
+        db.execute(stmt, rows)
+        db.commit()
+    finally:
+        db.close()
+
+def _prune(library_id, seen_ids):
+    """全量同步后删除 Emby 里已不存在的条目"""
+    db = SessionLocal()
+    try:
+        stale = [i for (i,) in db.query(EmbyItem.id).filter(EmbyItem.library_id == library_id)
+                 if i not in seen_ids]
+        for start in range(0, len(stale), 500):
+            db.query(EmbyItem).filter(EmbyItem.id.in_(stale[start:start + 500])).delete(synchronize_session=False)
+        db.commit()
+        return len(stale)
+    finally:
+        db.close()
+
+def _get_state(library_id):
+    db = SessionLocal()
+    try:
+        state = db.query(EmbySyncState).filter(EmbySyncState.library_id == library_id).first()
+        if state:
+            db.expunge(state)
+        return state
+    finally:
+        db.close()
+
+def _save_state(library_id, last_saved, full):
+    db = SessionLocal()
+    try:
+        state = db.query(EmbySyncState).filter(EmbySyncState.library_id == library_id).first()
+        if not state:
+            state = EmbySyncState(library_id=library_id)
+            db.add(state)
+        now = datetime.utcnow()
+        if last_saved and (not state.last_saved or last_saved > state.last_saved):
+            state.last_saved = last_saved
+        state.last_sync = now
+        if full:
+            state.last_full_sync = now
+        state.item_count = db.query(func.count(EmbyItem.id)).filter(EmbyItem.library_id == library_id).scalar()
+        db.commit()
+    finally:
+        db.close()
+
+def remove_items(item_ids):
+    db = SessionLocal()
+    try:
+        db.query(EmbyItem).filter(EmbyItem.id.in_(list(item_ids))).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+def update_tags(item_id, tags):
+    """本地保存 / AI 打标签成功后同步镜像，不必等下一次同步"""
+    db = SessionLocal()
+    try:
+        db.query(EmbyItem).filter(EmbyItem.id == item_id).update(
+            {EmbyItem.tags: list(tags)}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+def is_synced(library_id=None):
+    db = SessionLocal()
+    try:
+        query = db.query(EmbySyncState.library_id).filter(EmbySyncState.last_sync.isnot(None))
+        if library_id:
+            query = query.filter(EmbySyncState.library_id == library_id)
+        return query.first() is not None
+    finally:
+        db.close()
+
+def list_items(library_id, start_index=0, limit=100):
+    """按入库时间倒序分页；limit = -1 返回全部"""
+    db = SessionLocal()
+    try:
+        query = db.query(EmbyItem).filter(EmbyItem.library_id == library_id)
+        total = query.count()
+        query = query.order_by(EmbyItem.date_created.desc(), EmbyItem.id).offset(max(0, start_index))
+        if limit != -1:
+            query = query.limit(limit)
+        return [to_api_item(r) for r in query.all()], total
+    finally:
+        db.close()
+
+def search_items(term, limit=200):
+    """标题 / 原标题 / 简介 / 标签 / 拼音 全文检索"""
+    return search_index.search(term, limit=limit)["items"]
+
+def sync_status():
+    db = SessionLocal()
+    try:
+        return [{
+            "library_id": s.library_id, "item_count": s.item_count, "last_saved": s.last_saved,
+            "last_sync": s.last_sync, "last_full_sync": s.last_full_sync,
+        } for s in db.query(EmbySyncState).all()]
+    finally:
+        db.close()
+
+# ===========================
+# 2. 从 Emby 同步
+# ===========================
+
+def _items_url():
+    user_id = load_config().get("emby_user_id")
+    return f"/emby/Users/{user_id}/Items" if user_id else "/emby/Items"
+
+async def sync_library(library_id, full=False):
+    """
+    同步单个媒体库
+    :return: {"library_id", "mode", "fetched", "removed"}
+    """
+    state = await asyncio.to_thread(_get_state, library_id)
+    full_hours = float(load_config().get("emby_full_sync_hours") or 24)
+    if not state or not state.last_saved or not state.last_full_sync or \
+            datetime.utcnow() - state.last_full_sync > timedelta(hours=full_hours):
+        full = True
+
+    params = {
+        'IncludeItemTypes': 'Series,Movie', 'Recursive': 'true', 'ParentId': library_id,
+        'Fields': ITEM_FIELDS, 'SortBy': 'DateCreated,SortName', 'SortOrder': 'Ascending',
+        'Limit': PAGE_SIZE,
+    }
+    if not full:
+        params['MinDateLastSaved'] = state.last_saved
+
+    client = emby_client()
+    url = _items_url()
+    fetched, start, max_saved, seen = 0, 0, None, set()
+    while True:
+        resp = await client.get(url, params={**params, 'StartIndex': start})
+        resp.raise_for_status()
+        items = resp.json().get('Items', [])
+        now = datetime.utcnow()
+        rows = [_row_from_item(i, library_id, now) for i in items if i.get('Id')]
+        await asyncio.to_thread(_upsert, rows)
+        for r in rows:
+            seen.add(r["id"])
+            if r["date_last_saved"] and (max_saved is None or r["date_last_saved"] > max_saved):
+                max_saved = r["date_last_saved"]
+        fetched += len(rows)
+        if len(items) < PAGE_SIZE:
+            break
+        start += PAGE_SIZE
+
+    removed = await asyncio.to_thread(_prune, library_id, seen) if full else 0
+    await asyncio.to_thread(_save_state, library_id, max_saved, full)
+    mode = "full" if full else "incremental"
+    if fetched or removed:
+        logger.info(f"🔄 [媒体库镜像] {library_id} {mode} 同步: 更新 {fetched} 条, 删除 {removed} 条")
+    return {"library_id": library_id, "mode": mode, "fetched": fetched, "removed": removed}
+
+async def sync_all(full=False):
+    """同步所有媒体库 (同一时间只跑一个同步)"""
+    async with _sync_lock:
+        resp = await emby_client().get("/emby/Library/VirtualFolders")
+        resp.raise_for_status()
+        results = []
+        for folder in resp.json():
+            library_id = folder.get("Id") or folder.get("ItemId")
+            if library_id:
+                results.append(await sync_library(library_id, full))
+        return results
+
+async def ensure_library(library_id):
+    """从未同步过的媒体库，先同步一次再返回 (之后都走本地)"""
+    if await asyncio.to_thread(is_synced, library_id):
+        return
+    async with _sync_lock:
+        if not await asyncio.to_thread(is_synced, library_id):
+            await sync_library(library_id, full=True)
+
+# ===========================
+# 3. 定时 / Webhook 触发
+# ===========================
+
+def schedule_sync(delay=0, full=False, periodic=False):
+    """
+    安排一次同步；已有待执行的同类同步任务时只调整其执行时间 (防抖)
+    Webhook 连续触发时合并成一次
+    :param periodic: 周期同步与 Webhook 同步用不同的去重键，
+                     否则周期重排会把刚入队的 Webhook 同步推迟整整一个周期
+    """
+    dedup_key = f"{SYNC_JOB}:periodic" if periodic else f"{SYNC_JOB}:webhook"
+    return job_queue.enqueue(SYNC_JOB, {"full": full, "periodic": periodic},
+                             delay=delay, dedup_key=dedup_key, max_attempts=1)
+
+@job_queue.register(SYNC_JOB)
+async def _mirror_sync_job(payload: dict):
+    cfg = load_config()
+    try:
+        if cfg.get("emby_host") and cfg.get("emby_api_key"):
+            await sync_all(bool(payload.get("full")))
+    finally:
+        # 周期同步：每次执行完安排下一次 (Webhook 触发的同步不动周期任务)
+        interval = int(cfg.get("emby_sync_interval_minutes") or 0)
+        if interval > 0 and payload.get("periodic"):
+            await asyncio.to_thread(schedule_sync, interval * 60, periodic=True)
@@ -1,13 +1,18 @@
-import requests
 import logging
 import traceback
 import json
+import asyncio
+import base64
+import time
+import httpx
+from datetime import datetime
 from config.settings import load_config
+from services.http_client import mp_client
 from services.tmdb_service import get_tmdb_info
 from services.category_service import determine_category
-# 引入数据库会话和模型
-from database import SessionLocal
-from models import WashHistory
+from services import job_queue
+from services.scheme_matcher import get_matcher
+from services import history_writer
 
 logger = logging.getLogger("uvicorn")
 
@@ -15,32 +20,125 @@ logger = logging.getLogger("uvicorn")
 # 1. 基础 MP API 交互
 # ===========================
 
-def get_mp_token():
-    cfg = load_config()
-    host = cfg.get("mp_host", "").rstrip('/')
-    username = cfg.get("mp_username")
-    password = cfg.get("mp_password")
-    if not host or not username or not password: return None
-    try:
-        url = f"{host}/api/v1/login/access-token"
-        resp = requests.post(url, data={"username": username, "password": password}, timeout=5)
-        if resp.status_code == 200: return resp.json().get("access_token")
-    except: pass
-    return None
+class MpTokenManager:
+    """
+    MP access-token 缓存
+    - 令牌缓存到过期前 REFRESH_MARGIN 秒
+    - 并发调用方共用一次登录 (持锁刷新，锁内二次检查)
+    - mp_host / 账号变更后自动失效
+    """
+    REFRESH_MARGIN = 60      # 提前刷新的秒数
+    DEFAULT_TTL = 3600       # 无法从 JWT 解析 exp 时的保守有效期
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._token = None
+        self._expires_at = 0
+        self._identity = None
+
+    @staticmethod
+    def _decode_exp(token):
+        """从 JWT payload 中读取 exp，失败返回 None"""
+        try:
+            payload = token.split(".")[1]
+            payload += "=" * (-len(payload) % 4)
+            return int(json.loads(base64.urlsafe_b64decode(payload)).get("exp"))
+        except Exception:
+            return None
+
+    def _valid(self, identity):
+        return (self._token and self._identity == identity
+                and time.time() < self._expires_at - self.REFRESH_MARGIN)
+
+    async def get_token(self, stale_token=None):
+        """
+        :param stale_token: 调用方刚收到 401 的令牌；若缓存仍是它则强制重新登录
+        """
+        cfg = load_config()
+        host = cfg.get("mp_host", "").rstrip('/')
+        username = cfg.get("mp_username")
+        password = cfg.get("mp_password")
+        if not host or not username or not password: return None
+        identity = (host, username, password)
+
+        if self._valid(identity) and self._token != stale_token:
+            return self._token
+
+        async with self._lock:
+            # 二次检查：等锁期间可能已有其他调用方刷新完成
+            if self._valid(identity) and self._token != stale_token:
+                return self._token
+            token = await self._login(host, username, password)
+            if token:
+                self._token = token
+                self._identity = identity
+                self._expires_at = self._decode_exp(token) or (time.time() + self.DEFAULT_TTL)
+            else:
+                self._token = None
+            return token
+
+    async def _login(self, host, username, password):
+        try:
+            resp = await mp_client().post("/api/v1/login/access-token", data={"username": username, "password": password}, timeout=5)
+            if resp.status_code == 200: return resp.json().get("access_token")
+            logger.error(f"❌ MP 登录失败: HTTP {resp.status_code}")
+        except Exception as e:
+            logger.error(f"❌ MP 登录异常: {e}")
+        return None
 
-def probe_resource(endpoints, label):
-    """智能探测资源"""
-    token = get_mp_token()
-    cfg = load_config()
-    host = cfg.get("mp_host", "").rstrip('/')
-    if not token or not host: return []
+_token_manager = MpTokenManager()
 
-    headers = {"Authorization": f"Bearer {token}"}
+async def get_mp_token():
+    return await _token_manager.get_token()
+
+async def _mp_request(method, path, headers=None, **kwargs):
+    """
+    带鉴权的 MP 请求；遇到 401 刷新一次令牌后重试。
+    :return: Response，未配置或无法登录时返回 None
+    """
+    host = load_config().get("mp_host", "").rstrip('/')
+    token = await get_mp_token()
+    if not host or not token: return None
+
+    client = mp_client()
+    req_headers = dict(headers or {})
+    req_headers["Authorization"] = f"Bearer {token}"
+    resp = await client.request(method, path, headers=req_headers, **kwargs)
+    if resp.status_code == 401:
+        token = await _token_manager.get_token(stale_token=token)
+        if not token: return resp
+        req_headers["Authorization"] = f"Bearer {token}"
+        resp = await client.request(method, path, headers=req_headers, **kwargs)
+    return resp
+
+# 资源探测：key -> (候选端点, 日志标签)
+RESOURCE_PROBES = {
+    "sites": (["/api/v1/site/", "/api/v1/site/rss"], "站点"),
+    "filter_groups": (["/api/v1/system/setting/UserFilterRuleGroups", "/api/v1/filter/", "/api/v1/rule/"], "规则组"),
+    "downloaders": (["/api/v1/system/setting/Downloaders", "/api/v1/downloader/"], "下载器"),
+}
+RESOURCE_CACHE_TTL = 300
+
+_endpoint_memory = {}   # (mp_host, 标签) -> 上次探测成功的端点
+_resource_cache = {}    # (mp_host, 账号, 密码) -> (过期时间戳, 资源字典)
+_resource_lock = asyncio.Lock()
+
+async def probe_resource(endpoints, label):
+    """
+    智能探测资源
+    上次探测成功的端点会被记住并优先尝试，后续探测通常一次请求即可命中
+    """
+    if not await get_mp_token(): return []
+
+    host = load_config().get("mp_host", "").rstrip('/')
+    remembered = _endpoint_memory.get((host, label))
+    if remembered in endpoints:
+        endpoints = [remembered] + [ep for ep in endpoints if ep != remembered]
 
     for ep in endpoints:
         try:
-            url = f"{host}{ep}"
-            resp = requests.get(url, headers=headers, params={"page": 1, "size": 1000}, timeout=5)
+            resp = await _mp_request("GET", ep, params={"page": 1, "size": 1000}, timeout=5)
+            if resp is None: return []
             
             if resp.status_code == 200:
                 json_data = resp.json()
@@ -66,50 +164,87 @@ def probe_resource(endpoints, label):
                     if uid is None: uid = name 
                     if name: result.append({"id": uid, "name": name})
                 
-                logger.info(f"✅ [{label}] 探测成功: {url} | 获取到 {len(result)} 条数据")
+                logger.info(f"✅ [{label}] 探测成功: {ep} | 获取到 {len(result)} 条数据")
+                _endpoint_memory[(host, label)] = ep
                 return result
         except Exception as e:
             pass
     return []
 
-def get_mp_resources():
-    return {
-        "sites": probe_resource(["/api/v1/site/", "/api/v1/site/rss"], "站点"),
-        "filter_groups": probe_resource(["/api/v1/system/setting/UserFilterRuleGroups", "/api/v1/filter/", "/api/v1/rule/"], "规则组"),
-        "downloaders": probe_resource(["/api/v1/system/setting/Downloaders", "/api/v1/downloader/"], "下载器")
-    }
-
-def update_subscription(payload):
-    """PUT 更新订阅"""
+async def get_mp_resources(refresh=False):
+    """
+    站点 / 规则组 / 下载器，三路并行探测，结果按 TTL 缓存
+    :param refresh: True 时忽略缓存重新探测
+    """
     cfg = load_config()
-    host = cfg.get("mp_host", "").rstrip('/')
-    token = get_mp_token()
-    if not host or not token: return False
-    
-    if not payload.get("id"):
+    # 不同账号看到的站点 / 规则组 / 下载器可能不同：换账号或改密码后不能用旧缓存
+    identity = (cfg.get("mp_host", "").rstrip('/'), cfg.get("mp_username"), cfg.get("mp_password"))
+    ttl = cfg.get("mp_resource_cache_ttl", RESOURCE_CACHE_TTL)
+    cached = _resource_cache.get(identity)
+    if not refresh and cached and cached[0] > time.time():
+        return cached[1]
+
+    async with _resource_lock:
+        # 二次检查：等锁期间其他请求可能已经探测完
+        cached = _resource_cache.get(identity)
+        if not refresh and cached and cached[0] > time.time():
+            return cached[1]
+
+        keys = list(RESOURCE_PROBES.keys())
+        results = await asyncio.gather(*(probe_resource(*RESOURCE_PROBES[k]) for k in keys))
+        data = dict(zip(keys, results))
+        # 全部为空多半是 MP 不可达，不缓存，下次继续探测
+        if any(data.values()):
+            # 只保留当前配置的缓存，旧账号的条目不会再命中
+            _resource_cache.clear()
+            _resource_cache[identity] = (time.time() + ttl, data)
+        return data
+
+# 只有上游暂时不可用才值得重试；MP 明确拒绝 (200 success:false / 4xx) 重试也不会成功
+TRANSIENT_STATUS = {429}
+
+def _is_transient(resp):
+    """None (未登录 / MP 不可达) / 5xx / 429 视为暂时失败"""
+    return resp is None or resp.status_code >= 500 or resp.status_code in TRANSIENT_STATUS
+
+# POST 新增订阅不是幂等的：只有确定 MP 没处理这个请求 (连不上 / 等连接超时 / 限流 / 服务不可用) 才重试；
+# 读超时、连接中途断开、其他 5xx 时订阅可能已经建好，重试会重复创建，按失败处理
+_NOT_SENT_ERRORS = (httpx.ConnectError, httpx.ConnectTimeout, httpx.PoolTimeout)
+NOT_PROCESSED_STATUS = {429, 503}
+
+def _transient_failure(msg):
+    """暂时失败：任务上下文中还有重试机会就交给队列退避重试，否则按失败返回"""
+    if not job_queue.is_final_attempt():
+        raise job_queue.RetryLater(msg)
+    return False
+
+async def update_subscription(payload):
+    """
+    PUT 更新订阅 (带 id 的完整字段，重复提交结果相同，可以放心重试)
+    网络错误 / 超时 / 5xx / 429 在任务中抛 RetryLater；MP 明确拒绝直接返回 False
+    """
+    if not payload.get("id") or not load_config().get("mp_host"):
         return False
 
     try:
-        url = f"{host}/api/v1/subscribe/"
-        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-        resp = requests.put(url, json=payload, headers=headers, timeout=10)
-        return resp.status_code == 200
-    except Exception as e:
+        resp = await _mp_request("PUT", "/api/v1/subscribe/", json=payload, timeout=10)
+    except httpx.TransportError as e:
         logger.error(f"❌ 更新异常: {e}")
-    return False
+        return _transient_failure(f"更新订阅网络异常: {e}")
+    if _is_transient(resp):
+        return _transient_failure(f"更新订阅暂时失败: HTTP {resp.status_code if resp is not None else '-'}")
+    if resp.status_code != 200:
+        logger.error(f"❌ 更新订阅被拒绝: HTTP {resp.status_code} - {resp.text[:200]}")
+        return False
+    return True
 
-def get_subscription(sub_id):
+async def get_subscription(sub_id):
     """查询单个订阅详情"""
-    cfg = load_config()
-    host = cfg.get("mp_host", "").rstrip('/')
-    token = get_mp_token()
-    if not host or not token or not sub_id: return None
+    if not sub_id: return None
 
     try:
-        url = f"{host}/api/v1/subscribe/{sub_id}"
-        headers = {"Authorization": f"Bearer {token}"}
-        resp = requests.get(url, headers=headers, timeout=10)
-        if resp.status_code == 200:
+        resp = await _mp_request("GET", f"/api/v1/subscribe/{sub_id}", timeout=10)
+        if resp is not None and resp.status_code == 200:
             return resp.json()
     except Exception as e:
         logger.error(f"⚠️ 查询订阅详情失败: {e}")
@@ -119,116 +254,126 @@ def get_subscription(sub_id):
 # 🔥 核心：历史记录 & 纯净API
 # ===========================
 
-def save_history(name, season, tmdb_id, status, msg, details, wash_type="complete"):
+async def save_history(name, season, tmdb_id, status, msg, details, wash_type="complete"):
     """
-    保存历史记录到数据库
+    保存历史记录到数据库 (交给批量写入器；写入器积压时在这里等待，记录不丢)
     :param wash_type: 'complete'(完结洗版) / 'new_sub'(新增追更) / 'other'
     """
     logger.info(f"📝 [历史-{wash_type}] {name} S{season} | {status}: {msg}")
     try:
-        db = SessionLocal()
-        record = WashHistory(
-            name=name,
-            season=season,
-            tmdb_id=tmdb_id,
-            status=status,
-            message=msg,
-            wash_params=details,
-            wash_type=wash_type  # 🔥 写入类型
-        )
-        db.add(record)
-        db.commit()
-        db.close()
+        await history_writer.writer.submit({
+            "name": name,
+            "season": season,
+            "tmdb_id": tmdb_id,
+            "status": status,
+            "message": msg,
+            "wash_params": details,
+            "wash_type": wash_type,  # 🔥 写入类型
+            "created_at": datetime.utcnow(),  # 入队时间，批量落库也保持事件顺序
+        })
     except Exception as e:
         logger.error(f"❌ 写入数据库失败: {e}")
 
-def add_wash_subscription(payload):
+async def add_wash_subscription(payload):
     """
     🔥 纯净API调用：只负责 POST 新增订阅，不负责写历史
+    确定请求未被处理时在任务中抛 RetryLater；结果未知 (可能已创建) 不重试
     :return: Boolean (成功/失败)
     """
-    cfg = load_config()
-    host = cfg.get("mp_host", "").rstrip('/')
-    token = get_mp_token()
-    if not host or not token: return False
+    if not load_config().get("mp_host"): return False
 
-    try:
-        # 自动注入 username 标记
-        if "username" not in payload:
-            payload["username"] = "AI自动洗版"
+    # 自动注入 username 标记
+    if "username" not in payload:
+        payload["username"] = "AI自动洗版"
 
-        logger.info(f"      🚀 [API新增] Payload: {json.dumps(payload, ensure_ascii=False)}")
-        
-        url = f"{host}/api/v1/subscribe/"
-        headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
-        resp = requests.post(url, json=payload, headers=headers, timeout=10)
-        
-        # 判断结果
-        if resp.status_code == 200:
-            res_json = resp.json()
-            # 兼容不同版本 MP 的成功标识
-            if isinstance(res_json, dict):
-                if res_json.get("success") is True or res_json.get("code") == 0:
-                    return True
-            # 如果直接返回列表或空字典也可能表示成功（视版本而定），但通常有 success 字段
-            return False
-        else:
-            logger.error(f"      ❌ [API失败] HTTP {resp.status_code} - {resp.text}")
-            return False
-            
-    except Exception as e:
+    logger.info(f"      🚀 [API新增] Payload: {json.dumps(payload, ensure_ascii=False)}")
+
+    try:
+        resp = await _mp_request("POST", "/api/v1/subscribe/", json=payload, timeout=10)
+    except _NOT_SENT_ERRORS as e:
         logger.error(f"      ❌ [API异常] {e}")
+        return _transient_failure(f"洗版API连接失败: {e}")
+    except httpx.TransportError as e:
+        logger.error(f"      ❌ [API异常] 结果未知，不自动重试以免重复创建订阅: {e}")
+        return False
+
+    # 判断结果：MP 明确没处理的交给任务队列重试，其余失败 (含结果未知的 5xx) 直接算失败
+    if resp is None or resp.status_code in NOT_PROCESSED_STATUS:
+        return _transient_failure(f"洗版API暂时失败: HTTP {resp.status_code if resp is not None else '-'}")
+    if resp.status_code != 200:
+        logger.error(f"      ❌ [API失败] HTTP {resp.status_code} - {resp.text}")
+        return False
+    try:
+        res_json = resp.json()
+    except ValueError:
+        logger.error(f"      ❌ [API失败] 返回不是 JSON: {resp.text[:200]}")
+        return False
+    # 兼容不同版本 MP 的成功标识
+    if isinstance(res_json, dict):
+        if res_json.get("success") is True or res_json.get("code") == 0:
+            return True
+        logger.error(f"      ❌ [API拒绝] {res_json.get('message') or res_json}")
+    # 如果直接返回列表或空字典也可能表示成功（视版本而定），但通常有 success 字段
     return False
 
 # ===========================
 # 2. 核心通用逻辑
 # ===========================
 
+async def _mark_step_done(sub_info, step):
+    """
+    记录已对 MP 生效的步骤 (写进任务 payload)
+    任务之后因异常重试时跳过这些步骤，不重复修改 / 创建订阅
+    """
+    steps = sub_info.setdefault("_done_steps", [])
+    if step not in steps:
+        steps.append(step)
+    job_id = job_queue.current_job_id()
+    if job_id:
+        await asyncio.to_thread(job_queue.checkpoint, job_id, sub_info)
+
 def _find_best_scheme(title, category, schemes, scheme_type="策略"):
     if not schemes: return None
     logger.info(f"      🔍 [开始匹配{scheme_type}] 标题:[{title}] | 分类:[{category}] | 规则数:{len(schemes)}")
 
-    specific_match = None
-    fallback_match = None
-
-    for scheme in schemes:
-        if not scheme.get('active', True) and not scheme.get('enable', True): continue
+    scheme, kw, is_fallback = get_matcher(schemes).match(title, category)
+    if scheme is None:
+        return None
+    if is_fallback:
+        logger.info(f"      ⚠️ [兜底命中] 使用兜底策略: [{scheme.get('name')}]")
+    else:
+        logger.info(f"      ✅ [{scheme_type}命中] 规则:[{scheme.get('name')}] | 匹配词:[{kw}]")
+    return scheme
 
-        raw_keywords = scheme.get('keywords')
-        is_empty = False
-        if raw_keywords is None: is_empty = True
-        elif isinstance(raw_keywords, str) and not raw_keywords.strip(): is_empty = True
-        elif isinstance(raw_keywords, list) and len(raw_keywords) == 0: is_empty = True
-            
-        if is_empty:
-            if not fallback_match: fallback_match = scheme
-            continue
-
-        keywords = raw_keywords if isinstance(raw_keywords, list) else str(raw_keywords).replace('，', ',').split(',')
-        for kw in keywords:
-            kw = str(kw).strip()
-            if not kw: continue
-            
-            match_title = kw in title
-            match_category = False
-            if category:
-                if isinstance(category, list): match_category = kw in category
-                else: match_category = (kw == str(category).strip())
-
-            if match_title or match_category:
-                specific_match = scheme
-                logger.info(f"      ✅ [{scheme_type}命中] 规则:[{scheme.get('name')}] | 匹配词:[{kw}]")
-                return specific_match 
-
-    if fallback_match:
-        logger.info(f"      ⚠️ [兜底命中] 使用兜底策略: [{fallback_match.get('name')}]")
-        return fallback_match
-    return None
+def match_schemes_bulk(items, scheme_type="wash"):
+    """
+    批量匹配策略 (修改策略后重新评估整个订阅列表用)
+    :param items: [{"title": ..., "category": ...}, ...]
+    :param scheme_type: 'wash' (洗版) / 'subscribe' (追更)
+    """
+    cfg = load_config()
+    if scheme_type == "subscribe":
+        schemes = cfg.get("subscribe_schemes", []) or cfg.get("subscribe_rules", [])
+    else:
+        schemes = cfg.get("wash_schemes", [])
+    matcher = get_matcher(schemes)
+    results = matcher.match_many((i.get("title") or "", i.get("category")) for i in items)
+    return [
+        {
+            "title": item.get("title"),
+            "category": item.get("category"),
+            "scheme": scheme.get("name") if scheme else None,
+            "keyword": kw,
+            "fallback": is_fallback,
+        }
+        for item, (scheme, kw, is_fallback) in zip(items, results)
+    ]
 
 # ===========================
 # 3. 业务流程：新增订阅 (追更)
 # ===========================
 
+@job_queue.register("mp.new_subscription")
 async def handle_new_subscription(sub_info):
     try:
         name = sub_info.get("name")
@@ -239,7 +384,7 @@ async def handle_new_subscription(sub_info):
 
         # 1. 防止循环：检查是否为洗版
         if sub_id:
-            full_info = get_subscription(sub_id)
+            full_info = await get_subscription(sub_id)
             if full_info:
                 data_node = full_info.get("data") if "data" in full_info else full_info
                 is_best = data_node.get("best_version") == 1
@@ -271,7 +416,7 @@ async def handle_new_subscription(sub_info):
         
         if need_tmdb:
             logger.info(f"   1️⃣ [补充信息] 查询 TMDB (ID: {tmdb_id})...")
-            tmdb_data = get_tmdb_info(tmdb_id, media_type)
+            tmdb_data = await get_tmdb_info(tmdb_id, media_type)
             if tmdb_data:
                 # A. 自动分类逻辑
                 if not current_category:
@@ -286,16 +431,11 @@ async def handle_new_subscription(sub_info):
                 if not current_total_ep and media_type in ['tv', '电视剧']:
                     try:
                         target_season = int(season) if season else 1
-                        # TMDB 详情里 seasons 是个列表，需找到对应季
-                        seasons_list = tmdb_data.get("seasons", [])
-                        for s in seasons_list:
-                            if s.get("season_number") == target_season:
-                                ep_count = s.get("episode_count")
-                                if ep_count and ep_count > 0:
-                                    final_payload["total_episode"] = ep_count
-                                    has_changes = True
-                                    logger.info(f"      ✅ 修复总集数: {ep_count}")
-                                    break
+                        ep_count = tmdb_data.episode_count(target_season)
+                        if ep_count and ep_count > 0:
+                            final_payload["total_episode"] = ep_count
+                            has_changes = True
+                            logger.info(f"      ✅ 修复总集数: {ep_count}")
                     except Exception as e:
                         logger.warning(f"      ⚠️ 修复总集数失败: {e}")
         # 3. 匹配追更策略
@@ -320,11 +460,18 @@ async def handle_new_subscription(sub_info):
 
         # 4. 提交更改 & 写历史
         if has_changes and sub_id:
-            success = update_subscription(final_payload)
-            if success and matched_scheme:
-                save_history(
-                    name, season, tmdb_id, "success", 
-                    f"匹配策略: [{matched_scheme.get('name')}]", 
+            # 暂时失败会抛 RetryLater 交给队列重试；返回 False 表示 MP 明确拒绝，不再重试
+            if "update_subscription" in sub_info.get("_done_steps", []):
+                logger.info(f"   ⏭ 订阅已在上次尝试中更新，跳过")
+                success = True
+            else:
+                success = await update_subscription(final_payload)
+                if success:
+                    await _mark_step_done(sub_info, "update_subscription")
+            if matched_scheme:
+                await save_history(
+                    name, season, tmdb_id, "success" if success else "failed",
+                    f"匹配策略: [{matched_scheme.get('name')}]" if success else f"更新订阅失败: [{matched_scheme.get('name')}]",
                     {
                         "scheme": matched_scheme.get("name"),
                         "downloader": matched_scheme.get("downloader"),
@@ -338,14 +485,18 @@ async def handle_new_subscription(sub_info):
         else:
             logger.info(f"   💤 无需更新或缺少ID")
 
+    except job_queue.RetryLater:
+        raise
     except Exception as e:
         logger.error(f"❌ 新增订阅处理异常: {e}")
         logger.error(traceback.format_exc())
+        raise
 
 # ===========================
 # 4. 业务流程：订阅完成 (洗版)
 # ===========================
 
+@job_queue.register("mp.wash")
 async def run_wash_process(sub_info):
     try:
         cfg = load_config()
@@ -366,7 +517,7 @@ async def run_wash_process(sub_info):
 
         # 1. 补充分类
         if not current_category and tmdb_id:
-             tmdb_data = get_tmdb_info(tmdb_id, media_type)
+             tmdb_data = await get_tmdb_info(tmdb_id, media_type)
              if tmdb_data:
                  current_category = determine_category(tmdb_data, media_type)
                  logger.info(f"   ✅ 补充分类: {current_category}")
@@ -404,14 +555,22 @@ async def run_wash_process(sub_info):
                 new_sub_payload["quality"] = qual
 
             # 4. 调用纯净 API
-            is_ok = add_wash_subscription(new_sub_payload)
+            # 上游暂时失败会抛 RetryLater 交给任务队列退避重试；MP 明确拒绝或最后一次仍失败才记失败历史
+            # 上次尝试已创建成功的不再重复 POST
+            if "add_wash_subscription" in sub_info.get("_done_steps", []):
+                logger.info(f"   ⏭ 洗版订阅已在上次尝试中创建，跳过")
+                is_ok = True
+            else:
+                is_ok = await add_wash_subscription(new_sub_payload)
+                if is_ok:
+                    await _mark_step_done(sub_info, "add_wash_subscription")
             
             # 5. 🔥 在这里写历史：完结洗版 (wash_type="complete")
             status_str = "success" if is_ok else "failed"
             msg_str = "已触发洗版重订阅" if is_ok else "洗版API请求失败"
             
             # 🔥 记录历史 (增强 details)
-            save_history(
+            await save_history(
                 name, season, tmdb_id, status_str, msg_str,
                 {
                     "scheme": scheme_name,
@@ -427,6 +586,9 @@ async def run_wash_process(sub_info):
         else:
             logger.info("   ⏹ 未命中任何洗版策略 (且无兜底)")
 
+    except job_queue.RetryLater:
+        raise
     except Exception as e:
         logger.error(f"❌ 洗版流程异常: {e}")
-        logger.error(traceback.format_exc())
\ No newline at end of file
+        logger.error(traceback.format_exc())
+        raise
\ No newline at end of file
@@ -0,0 +1,165 @@
+import asyncio
+import email.utils
+import logging
+import random
+import time
+import httpx
+from config.settings import load_config
+
+logger = logging.getLogger("uvicorn")
+
+# ===========================
+# 上游限流 (令牌桶) + 自适应退避重试
+# ===========================
+# 每个上游 (emby / mp / tmdb / siliconflow) 一个令牌桶：
+# - rate: 每秒补充的令牌数，burst: 桶容量 (允许的突发请求数)
+# - 收到 429 时速率减半 (不低于配置的 1/10)，之后每次成功慢慢恢复到配置值 (AIMD)
+# 重试：429 / 503 / 网络错误按带抖动的指数退避重试，优先遵守 Retry-After。
+# 以 httpx transport 的形式挂到连接池客户端上，业务代码无需改动。
+
+DEFAULT_LIMITS = {
+    "emby": {"rate": 50, "burst": 100},
+    "mp": {"rate": 20, "burst": 40},
+    "tmdb": {"rate": 40, "burst": 40},
+    "siliconflow": {"rate": 5, "burst": 10},
+}
+DEFAULT_MAX_RETRIES = 3
+BACKOFF_BASE = 0.5
+BACKOFF_MAX = 30
+RETRY_AFTER_MAX = 60
+RETRY_STATUS = {429, 503}
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS", "PUT", "DELETE"}
+
+class TokenBucket:
+    def __init__(self, name, rate, burst):
+        self.name = name
+        self.configured_rate = float(rate)
+        self.rate = float(rate)
+        self.capacity = float(burst)
+        self.tokens = float(burst)
+        self._updated = time.monotonic()
+        self._lock = asyncio.Lock()
+        self.stats = {"requests": 0, "throttled": 0, "retries": 0, "waited_seconds": 0.0}
+
+    def configure(self, rate, burst):
+        rate, burst = float(rate), float(burst)
+        if rate != self.configured_rate:
+            self.configured_rate = rate
+            self.rate = rate
+        if burst != self.capacity:
+            self.capacity = burst
+            self.tokens = min(self.tokens, burst)
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    async def acquire(self):
+        """取一个令牌，不够时按当前速率等待 (锁保证排队先到先得)"""
+        async with self._lock:
+            self._refill()
+            if self.tokens < 1:
+                wait = (1 - self.tokens) / self.rate
+                self.stats["waited_seconds"] += wait
+                await asyncio.sleep(wait)
+                self._refill()
+            self.tokens -= 1
+            self.stats["requests"] += 1
+
+    def on_throttled(self):
+        self.stats["throttled"] += 1
+        self.rate = max(self.configured_rate / 10, self.rate / 2)
+
+    def on_success(self):
+        if self.rate < self.configured_rate:
+            self.rate = min(self.configured_rate, self.rate + self.configured_rate / 20)
+
+    def snapshot(self):
+        self._refill()
+        return {
+            "tokens": round(self.tokens, 2),
+            "capacity": self.capacity,
+            "rate": round(self.rate, 2),
+            "configured_rate": self.configured_rate,
+            **{k: round(v, 2) if isinstance(v, float) else v for k, v in self.stats.items()},
+        }
+
+_buckets = {}
+
+def get_bucket(name):
+    limits = (load_config().get("rate_limits") or {}).get(name) or DEFAULT_LIMITS.get(name) or {"rate": 10, "burst": 10}
+    rate = max(0.1, float(limits.get("rate", 10)))
+    burst = max(1.0, float(limits.get("burst", rate)))
+    bucket = _buckets.get(name)
+    if bucket is None:
+        bucket = _buckets[name] = TokenBucket(name, rate, burst)
+    else:
+        bucket.configure(rate, burst)
+    return bucket
+
+def upstream_stats():
+    return {name: bucket.snapshot() for name, bucket in _buckets.items()}
+
+def _retry_after(resp):
+    """解析 Retry-After (秒数或 HTTP 日期)，无法解析返回 None"""
+    value = resp.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return min(RETRY_AFTER_MAX, max(0.0, float(value)))
+    except ValueError:
+        pass
+    try:
+        dt = email.utils.parsedate_to_datetime(value)
+        return min(RETRY_AFTER_MAX, max(0.0, dt.timestamp() - time.time()))
+    except Exception:
+        return None
+
+def _backoff(attempt):
+    return min(BACKOFF_MAX, BACKOFF_BASE * (2 ** attempt)) * random.uniform(0.5, 1.5)
+
+class UpstreamTransport(httpx.AsyncBaseTransport):
+    """在真实 transport 外包一层：先拿令牌，再按策略重试"""
+
+    def __init__(self, name, inner: httpx.AsyncBaseTransport):
+        self.name = name
+        self._inner = inner
+
+    async def handle_async_request(self, request):
+        bucket = get_bucket(self.name)
+        max_retries = int(load_config().get("upstream_max_retries", DEFAULT_MAX_RETRIES))
+        attempt = 0
+        while True:
+            await bucket.acquire()
+            try:
+                resp = await self._inner.handle_async_request(request)
+            except (httpx.ConnectError, httpx.ConnectTimeout):
+                # 连接都没建立，任何方法都可以安全重试
+                if attempt >= max_retries: raise
+                delay = _backoff(attempt)
+            except (httpx.ReadTimeout, httpx.RemoteProtocolError):
+                if attempt >= max_retries or request.method not in IDEMPOTENT_METHODS: raise
+                delay = _backoff(attempt)
+            else:
+                if resp.status_code == 429:
+                    bucket.on_throttled()
+                retryable = resp.status_code == 429 or (
+                    resp.status_code in RETRY_STATUS and request.method in IDEMPOTENT_METHODS
+                )
+                if not retryable or attempt >= max_retries:
+                    if resp.status_code < 400:
+                        bucket.on_success()
+                    return resp
+                delay = _retry_after(resp)
+                if delay is None:
+                    delay = _backoff(attempt)
+                await resp.aclose()
+
+            attempt += 1
+            bucket.stats["retries"] += 1
+            logger.warning(f"⏳ [{self.name}] 请求受限/失败，{delay:.1f}s 后第 {attempt} 次重试: {request.method} {request.url.path}")
+            await asyncio.sleep(delay)
+
+    async def aclose(self):
+        await self._inner.aclose()
@@ -0,0 +1,131 @@
+import threading
+from collections import deque
+
+# ===========================
+# 洗版 / 追更策略的编译匹配器
+# ===========================
+# 策略的 keywords 在每个配置版本只解析一次：
+# - 标题子串匹配：所有关键词构建一个 Aho-Corasick 自动机，一次扫描找出全部命中词
+# - 分类精确匹配：关键词 -> 策略下标 的哈希表
+# 命中多个策略时取配置顺序最靠前的一个；都不命中才使用第一个空关键词的兜底策略，
+# 与原来逐个策略、逐个关键词扫描的结果完全一致。
+
+class AhoCorasick:
+    """多模式子串匹配自动机"""
+
+    def __init__(self, patterns):
+        self._goto = [{}]
+        self._fail = [0]
+        self._out = [[]]
+        for pid, pattern in enumerate(patterns):
+            node = 0
+            for ch in pattern:
+                nxt = self._goto[node].get(ch)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[node][ch] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append([])
+                node = nxt
+            self._out[node].append(pid)
+
+        queue = deque(self._goto[0].values())
+        while queue:
+            node = queue.popleft()
+            for ch, nxt in self._goto[node].items():
+                queue.append(nxt)
+                f = self._fail[node]
+                while f and ch not in self._goto[f]:
+                    f = self._fail[f]
+                self._fail[nxt] = self._goto[f].get(ch, 0)
+                self._out[nxt] = self._out[nxt] + self._out[self._fail[nxt]]
+
+    def find_all(self, text):
+        """返回 text 中出现过的模式下标集合"""
+        found = set()
+        node = 0
+        goto, fail, out = self._goto, self._fail, self._out
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            if out[node]:
+                found.update(out[node])
+        return found
+
+def _parse_keywords(raw_keywords):
+    """返回去空白后的关键词列表；None 表示该策略是空关键词 (兜底) 策略"""
+    if raw_keywords is None: return None
+    if isinstance(raw_keywords, str) and not raw_keywords.strip(): return None
+    if isinstance(raw_keywords, list) and len(raw_keywords) == 0: return None
+    keywords = raw_keywords if isinstance(raw_keywords, list) else str(raw_keywords).replace('，', ',').split(',')
+    return [kw for kw in (str(k).strip() for k in keywords) if kw]
+
+class SchemeMatcher:
+    def __init__(self, schemes):
+        self.schemes = list(schemes or [])
+        self.fallback = None
+        self._scheme_keywords = {}          # 策略下标 -> 关键词列表 (保持原顺序，用于日志)
+        keyword_schemes = {}                # 关键词 -> 命中的策略下标列表
+
+        for idx, scheme in enumerate(self.schemes):
+            if not scheme.get('active', True) and not scheme.get('enable', True): continue
+            keywords = _parse_keywords(scheme.get('keywords'))
+            if keywords is None:
+                if self.fallback is None: self.fallback = scheme
+                continue
+            self._scheme_keywords[idx] = keywords
+            for kw in keywords:
+                keyword_schemes.setdefault(kw, [])
+                if idx not in keyword_schemes[kw]:
+                    keyword_schemes[kw].append(idx)
+
+        self._keywords = list(keyword_schemes.keys())
+        self._keyword_schemes = [keyword_schemes[kw] for kw in self._keywords]
+        self._keyword_index = {kw: i for i, kw in enumerate(self._keywords)}
+        self._automaton = AhoCorasick(self._keywords)
+
+    def _category_hits(self, category):
+        if not category: return set()
+        values = category if isinstance(category, list) else [str(category).strip()]
+        return {self._keyword_index[v] for v in values if isinstance(v, str) and v in self._keyword_index}
+
+    def match(self, title, category=None):
+        """
+        :return: (命中的策略, 命中的关键词, 是否兜底)；都不命中返回 (None, None, False)
+        """
+        hits = self._automaton.find_all(title or "") | self._category_hits(category)
+        if hits:
+            best = min(self._keyword_schemes[i][0] for i in hits)
+            hit_words = {self._keywords[i] for i in hits}
+            kw = next(k for k in self._scheme_keywords[best] if k in hit_words)
+            return self.schemes[best], kw, False
+        if self.fallback is not None:
+            return self.fallback, None, True
+        return None, None, False
+
+    def match_many(self, items):
+        """
+        批量匹配
+        :param items: [(title, category), ...]
+        :return: 与输入一一对应的 [(策略, 关键词, 是否兜底), ...]
+        """
+        return [self.match(title, category) for title, category in items]
+
+# 按策略列表对象缓存编译结果：配置快照只读且整体替换，同一对象即同一配置版本
+_compiled = {}
+_lock = threading.Lock()
+
+def get_matcher(schemes):
+    key = id(schemes)
+    entry = _compiled.get(key)
+    if entry and entry[0] is schemes:
+        return entry[1]
+    matcher = SchemeMatcher(schemes)
+    with _lock:
+        # 只保留最近的几个版本 (洗版 / 追更 各一份足够)
+        if len(_compiled) >= 8:
+            _compiled.clear()
+        _compiled[key] = (schemes, matcher)
+    return matcher
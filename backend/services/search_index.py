@@ -0,0 +1,203 @@
+import json
+import logging
+import time
+from sqlalchemy import text
+from database import engine
+
+logger = logging.getLogger("uvicorn")
+
+# 拼音检索：pypinyin 已列入 requirements；未安装时降级为不索引拼音全拼 / 首字母
+try:
+    from pypinyin import lazy_pinyin, Style
+except ImportError:
+    lazy_pinyin = None
+
+# ===========================
+# 全文检索 (SQLite FTS5)
+# ===========================
+# - emby_search 虚拟表索引 标题 / 原标题 / 简介 / 标签 / 拼音
+# - emby_items 主键是字符串，它的隐式 rowid 在 VACUUM 时可能被重新编号；
+#   所以用 emby_search_map (docid INTEGER PRIMARY KEY -> item_id) 显式映射，FTS 行的 rowid = docid
+# - trigram 分词：中日韩文本无需分词也能子串匹配，天然支持前缀 / 边输入边搜
+# - 标签 = Emby 上的标签 + item_tags 里 AI 分析 / 手动保存的标签
+# - 由触发器维护：emby_items / item_tags 任何写入都会自动更新索引，业务代码无需关心
+# - 拼音在写入镜像表时计算好存进 emby_items.pinyin，触发器里只用纯 SQL
+# - 少于 3 个字的词 trigram 无法建索引，退化为对索引表的 LIKE 扫描 (几万条仍是毫秒级)
+
+FTS_TABLE = "emby_search"
+MAP_TABLE = "emby_search_map"
+# bm25 列权重：name, original_title, overview, tags, pinyin
+BM25_WEIGHTS = (10.0, 5.0, 1.0, 3.0, 4.0)
+MIN_TRIGRAM = 3
+
+def to_pinyin(value):
+    """'西游记' -> 'xiyouji xyj'；没装 pypinyin 时返回空串"""
+    if not value or lazy_pinyin is None:
+        return ""
+    syllables = lazy_pinyin(value, errors="ignore")
+    initials = lazy_pinyin(value, style=Style.FIRST_LETTER, errors="ignore")
+    return f"{''.join(syllables)} {''.join(initials)}".lower()
+
+# 组装某个 emby_items 行对应的索引内容
+_ROW_SELECT = f"""
+    INSERT INTO {FTS_TABLE}(rowid, name, original_title, overview, tags, pinyin)
+    SELECT m.docid, coalesce(e.name, ''), coalesce(e.original_title, ''), coalesce(e.overview, ''),
+           coalesce((SELECT group_concat(value, ' ') FROM json_each(e.tags)), '') || ' ' ||
+           coalesce((SELECT group_concat(t.name, ' ') FROM item_tags it JOIN tags t ON t.id = it.tag_id
+                     WHERE it.item_id = e.id), ''),
+           coalesce(e.pinyin, '')
+    FROM emby_items e JOIN {MAP_TABLE} m ON m.item_id = e.id
+"""
+
+def _ensure_map_row(item_id):
+    # 不能用 INSERT OR IGNORE：触发器里的冲突策略会被外层语句覆盖，
+    # library_mirror._upsert 的 ON CONFLICT DO UPDATE 会让重复 item_id 直接报 UNIQUE 错误
+    return (f"INSERT INTO {MAP_TABLE}(item_id) SELECT {item_id} "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {MAP_TABLE} WHERE item_id = {item_id});")
+
+def _delete_row(item_id):
+    return f"DELETE FROM {FTS_TABLE} WHERE rowid = (SELECT docid FROM {MAP_TABLE} WHERE item_id = {item_id});"
+
+_TABLE = f"""CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5(
+    name, original_title, overview, tags, pinyin, tokenize='trigram'
+)"""
+# docid 是 INTEGER PRIMARY KEY (rowid 的别名)，VACUUM 不会改动
+_MAP = f"""CREATE TABLE IF NOT EXISTS {MAP_TABLE} (
+    docid INTEGER PRIMARY KEY AUTOINCREMENT,
+    item_id VARCHAR NOT NULL UNIQUE
+)"""
+
+# 触发器每次启动都删掉重建，索引内容的组装方式变了也能跟着更新
+_TRIGGER_NAMES = ["emby_items_ai", "emby_items_au", "emby_items_ad",
+                  "item_tags_ai", "item_tags_ad", "media_tags_ai", "media_tags_au", "media_tags_ad"]
+_TRIGGERS = [
+    f"""CREATE TRIGGER emby_items_ai AFTER INSERT ON emby_items BEGIN
+        {_ensure_map_row("new.id")}
+        {_delete_row("new.id")}
+        {_ROW_SELECT} WHERE e.id = new.id;
+    END""",
+    f"""CREATE TRIGGER emby_items_au AFTER UPDATE ON emby_items BEGIN
+        {_delete_row("old.id")}
+        DELETE FROM {MAP_TABLE} WHERE item_id = old.id AND old.id <> new.id;
+        {_ensure_map_row("new.id")}
+        {_delete_row("new.id")}
+        {_ROW_SELECT} WHERE e.id = new.id;
+    END""",
+    f"""CREATE TRIGGER emby_items_ad AFTER DELETE ON emby_items BEGIN
+        {_delete_row("old.id")}
+        DELETE FROM {MAP_TABLE} WHERE item_id = old.id;
+    END""",
+    f"""CREATE TRIGGER item_tags_ai AFTER INSERT ON item_tags BEGIN
+        {_delete_row("new.item_id")}
+        {_ROW_SELECT} WHERE e.id = new.item_id;
+    END""",
+    f"""CREATE TRIGGER item_tags_ad AFTER DELETE ON item_tags BEGIN
+        {_delete_row("old.item_id")}
+        {_ROW_SELECT} WHERE e.id = old.item_id;
+    END""",
+]
+
+def ensure_index(force_rebuild=False):
+    """建表 / 触发器；索引与镜像表条数不一致 (首次启用、手动改库) 或 force_rebuild 时重建"""
+    with engine.begin() as conn:
+        # 旧版本建的 emby_items 没有拼音列
+        columns = {row[1] for row in conn.execute(text("PRAGMA table_info(emby_items)"))}
+        if "pinyin" not in columns:
+            conn.execute(text("ALTER TABLE emby_items ADD COLUMN pinyin VARCHAR"))
+        tables = {row[0] for row in conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+        if MAP_TABLE not in tables:
+            # 旧版本的索引按 emby_items 的隐式 rowid 对应，整表作废重建
+            conn.execute(text(f"DROP TABLE IF EXISTS {FTS_TABLE}"))
+            force_rebuild = True
+        conn.execute(text(_MAP))
+        conn.execute(text(_TABLE))
+        for name in _TRIGGER_NAMES:
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+        for stmt in _TRIGGERS:
+            conn.execute(text(stmt))
+        indexed = conn.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar()
+        items = conn.execute(text("SELECT count(*) FROM emby_items")).scalar()
+        mapped = conn.execute(text(f"SELECT count(*) FROM {MAP_TABLE}")).scalar()
+    if force_rebuild or indexed != items or mapped != items:
+        rebuild()
+
+def rebuild():
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        conn.execute(text(f"DELETE FROM {FTS_TABLE}"))
+        conn.execute(text(f"DELETE FROM {MAP_TABLE} WHERE item_id NOT IN (SELECT id FROM emby_items)"))
+        conn.execute(text(f"INSERT OR IGNORE INTO {MAP_TABLE}(item_id) SELECT id FROM emby_items"))
+        conn.execute(text(_ROW_SELECT))
+        conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"))
+        count = conn.execute(text(f"SELECT count(*) FROM {FTS_TABLE}")).scalar()
+    logger.info(f"🔎 [全文索引] 重建完成: {count} 条, 耗时 {(time.perf_counter() - started) * 1000:.0f}ms"
+                f"{'' if lazy_pinyin else ' (未安装 pypinyin，跳过拼音)'}")
+    return count
+
+# ===========================
+# 查询
+# ===========================
+
+def _fts_phrase(term):
+    # 双引号包起来当作短语，避免 - * : 等被解析成 FTS 语法
+    return '"' + term.replace('"', '""') + '"'
+
+def _like_escape(term):
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+def search(q="", tags=None, library_id=None, offset=0, limit=50):
+    """
+    :param q: 关键词，空格分隔多个词 (AND)；每个词匹配标题 / 原标题 / 简介 / 标签 / 拼音的任意子串
+    :param tags: 必须同时带有的标签 (精确匹配)
+    :return: {"items", "total", "took_ms"}
+    """
+    started = time.perf_counter()
+    terms = [t for t in (q or "").split() if t]
+    long_terms = [t for t in terms if len(t) >= MIN_TRIGRAM]
+    short_terms = [t for t in terms if len(t) < MIN_TRIGRAM]
+
+    where, params = [], {}
+    if long_terms:
+        where.append(f"{FTS_TABLE} MATCH :match")
+        params["match"] = " AND ".join(_fts_phrase(t) for t in long_terms)
+    for i, term in enumerate(short_terms):
+        params[f"like{i}"] = f"%{_like_escape(term)}%"
+        where.append("(" + " OR ".join(
+            f"{FTS_TABLE}.{col} LIKE :like{i} ESCAPE '\\'" for col in ("name", "original_title", "overview", "tags", "pinyin")
+        ) + ")")
+    if library_id:
+        where.append("e.library_id = :library_id")
+        params["library_id"] = library_id
+    for i, tag in enumerate(tags or []):
+        params[f"tag{i}"] = tag
+        # 本地标签走 item_tags 索引；Emby 上的标签在镜像表的 JSON 列里
+        where.append(
+            f"(e.id IN (SELECT it.item_id FROM item_tags it JOIN tags t ON t.id = it.tag_id WHERE t.name = :tag{i})"
+            f" OR EXISTS (SELECT 1 FROM json_each(e.tags) WHERE value = :tag{i}))"
+        )
+
+    source = (f"emby_items e JOIN {MAP_TABLE} m ON m.item_id = e.id JOIN {FTS_TABLE} ON {FTS_TABLE}.rowid = m.docid"
+              if terms else "emby_items e")
+    condition = (" WHERE " + " AND ".join(where)) if where else ""
+    if long_terms:
+        order = f"bm25({FTS_TABLE}, {', '.join(str(w) for w in BM25_WEIGHTS)}), e.date_created DESC"
+    elif terms:
+        # 短词没有 bm25 分数：标题开头命中的排前面
+        params["prefix"] = f"{_like_escape(terms[0])}%"
+        order = "(e.name LIKE :prefix ESCAPE '\\') DESC, e.date_created DESC"
+    else:
+        order = "e.date_created DESC"
+    params.update(offset=max(0, offset), limit=max(1, min(limit, 500)))
+
+    with engine.connect() as conn:
+        total = conn.execute(text(f"SELECT count(*) FROM {source}{condition}"), params).scalar()
+        rows = conn.execute(text(
+            f"SELECT e.id, e.name, e.year, e.tags, e.overview FROM {source}{condition}"
+            f" ORDER BY {order} LIMIT :limit OFFSET :offset"
+        ), params).mappings().all()
+
+    items = [{
+        "id": r["id"], "name": r["name"], "year": r["year"],
+        "current_tags": json.loads(r["tags"]) if r["tags"] else [], "overview": r["overview"] or "",
+    } for r in rows]
+    return {"items": items, "total": total, "took_ms": round((time.perf_counter() - started) * 1000, 2)}
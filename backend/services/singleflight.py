@@ -0,0 +1,71 @@
+import asyncio
+import functools
+
+# ===========================
+# Single-flight 请求合并
+# ===========================
+# 同一个 key 的并发调用只真正执行一次，其余调用方等待并共享同一个结果；
+# 执行出错时，异常会传给每一个等待者；执行者本身被取消时，等待者不受影响，
+# 由其中一个重新执行。调用完成即释放，不做任何缓存，
+# 所以不会带来长缓存的过期数据问题。
+
+# 执行者被取消时交给等待者的标记：等待者重新发起，而不是跟着一起被取消
+_LEADER_CANCELLED = object()
+
+class SingleFlight:
+    def __init__(self, copy_result=None):
+        """
+        :param copy_result: 给等待者返回结果前的复制函数 (如 copy.deepcopy)，
+                            防止某个调用方修改结果影响其他人
+        """
+        self._inflight = {}
+        self._copy = copy_result
+        self.stats = {"calls": 0, "shared": 0}
+
+    async def do(self, key, fn, *args, **kwargs):
+        self.stats["calls"] += 1
+        while True:
+            fut = self._inflight.get(key)
+            if fut is None:
+                break
+            self.stats["shared"] += 1
+            # shield：某个等待者被取消不应取消共享的调用
+            result = await asyncio.shield(fut)
+            if result is _LEADER_CANCELLED:
+                # 执行者被取消 (如客户端断开)，与等待者无关：重新竞争，其中一个成为新的执行者
+                self.stats["shared"] -= 1
+                continue
+            return self._copy(result) if self._copy else result
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[key] = fut
+        try:
+            result = await fn(*args, **kwargs)
+        except asyncio.CancelledError:
+            fut.set_result(_LEADER_CANCELLED)
+            raise
+        except BaseException as e:
+            fut.set_exception(e)
+            fut.exception()  # 标记已读取，没有等待者时也不会告警
+            raise
+        else:
+            fut.set_result(result)
+            return result
+        finally:
+            self._inflight.pop(key, None)
+
+def coalesce(key_func, copy_result=None):
+    """
+    装饰器：按 key_func(*args, **kwargs) 计算的 key 合并并发调用
+    被装饰函数上的 .singleflight 属性可查看合并统计
+    """
+    def decorator(fn):
+        group = SingleFlight(copy_result)
+
+        @functools.wraps(fn)
+        async def wrapper(*args, **kwargs):
+            return await group.do(key_func(*args, **kwargs), fn, *args, **kwargs)
+
+        wrapper.singleflight = group
+        return wrapper
+    return decorator
@@ -0,0 +1,188 @@
+import logging
+from sqlalchemy import func, null
+from sqlalchemy.dialects.sqlite import insert
+from sqlalchemy.orm import Session
+from database import SessionLocal
+from models import MediaTag, Tag, ItemTag, EmbyItem
+
+logger = logging.getLogger("uvicorn")
+
+# ===========================
+# 标签存储 (tags 词表 + item_tags 关联表)
+# ===========================
+# 取代 MediaTag.tags 的 JSON 列：
+# - "带某标签的所有物品" / 标签频次 走 item_tags(tag_id) 索引，不再全表扫描 + 解析 JSON
+# - 改名 / 合并只改词表和关联表，不用逐行重写 JSON
+# 函数都接收调用方的 Session，只 flush 不 commit，和原来 db.add + db.commit 的用法一致。
+
+def normalize_tags(tags):
+    """去空白、去重，保持顺序"""
+    result, seen = [], set()
+    for t in tags or []:
+        name = str(t).strip()
+        if name and name not in seen:
+            seen.add(name)
+            result.append(name)
+    return result
+
+def _tag_ids(db: Session, names):
+    """标签名 -> id，不存在的自动创建"""
+    if not names:
+        return {}
+    db.execute(insert(Tag).values([{"name": n} for n in names]).on_conflict_do_nothing(index_elements=["name"]))
+    return dict(db.query(Tag.name, Tag.id).filter(Tag.name.in_(names)).all())
+
+# ===========================
+# 1. 读写单个 / 多个物品
+# ===========================
+
+def get_tags_bulk(db: Session, item_ids):
+    """
+    一次查询取多个物品的标签
+    :return: {item_id: [标签...]}，没有 MediaTag 记录 (从未分析过) 的物品不在结果里
+    """
+    item_ids = list(item_ids)
+    if not item_ids:
+        return {}
+    result = {}
+    for start in range(0, len(item_ids), 500):
+        chunk = item_ids[start:start + 500]
+        for (item_id,) in db.query(MediaTag.item_id).filter(MediaTag.item_id.in_(chunk)):
+            result[item_id] = []
+        rows = db.query(ItemTag.item_id, Tag.name).join(Tag, Tag.id == ItemTag.tag_id) \
+            .filter(ItemTag.item_id.in_(chunk)).order_by(ItemTag.item_id, ItemTag.position)
+        for item_id, name in rows:
+            result.setdefault(item_id, []).append(name)
+    return result
+
+def get_tags(db: Session, item_id):
+    """:return: 标签列表；从未分析过返回 None"""
+    return get_tags_bulk(db, [item_id]).get(item_id)
+
+def get_item(db: Session, item_id):
+    """:return: (名称, 标签列表)；不存在返回 (None, None)"""
+    row = db.query(MediaTag).filter(MediaTag.item_id == item_id).first()
+    if not row:
+        return None, None
+    return row.name, get_tags(db, item_id)
+
+def set_tags_bulk(db: Session, entries):
+    """
+    批量覆盖多个物品的标签
+    :param entries: [(item_id, name, tags), ...]
+    """
+    entries = [(item_id, name, normalize_tags(tags)) for item_id, name, tags in entries]
+    if not entries:
+        return
+    # JSON 列写 SQL NULL (不是 JSON 的 'null')，表示已迁移到关联表
+    stmt = insert(MediaTag)
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[MediaTag.item_id],
+        set_={"name": func.coalesce(stmt.excluded.name, MediaTag.name), "tags": null()},
+    ), [{"item_id": item_id, "name": name} for item_id, name, _ in entries])
+
+    ids = _tag_ids(db, sorted({t for _, _, tags in entries for t in tags}))
+    item_ids = [item_id for item_id, _, _ in entries]
+    for start in range(0, len(item_ids), 500):
+        db.query(ItemTag).filter(ItemTag.item_id.in_(item_ids[start:start + 500])).delete(synchronize_session=False)
+    links = [{"item_id": item_id, "tag_id": ids[t], "position": pos}
+             for item_id, _, tags in entries for pos, t in enumerate(tags)]
+    if links:
+        db.execute(insert(ItemTag), links)
+    db.flush()
+
+def set_tags(db: Session, item_id, name, tags):
+    """覆盖单个物品的标签 (没有记录时创建)"""
+    set_tags_bulk(db, [(item_id, name, tags)])
+
+# ===========================
+# 2. 标签视图：频次 / 按标签取物品
+# ===========================
+
+def facets(db: Session, prefix=None, limit=200):
+    """标签 -> 物品数，按数量倒序"""
+    query = db.query(Tag.name, func.count(ItemTag.item_id).label("count")) \
+        .join(ItemTag, ItemTag.tag_id == Tag.id).group_by(Tag.id)
+    if prefix:
+        query = query.filter(Tag.name.startswith(prefix, autoescape=True))
+    rows = query.order_by(func.count(ItemTag.item_id).desc(), Tag.name).limit(limit).all()
+    return [{"tag": name, "count": count} for name, count in rows]
+
+def items_by_tag(db: Session, tag, offset=0, limit=50):
+    """带某标签的物品 (分页)，附带镜像表里的年份 / 简介"""
+    tag_id = db.query(Tag.id).filter(Tag.name == tag).scalar()
+    if tag_id is None:
+        return {"items": [], "total": 0}
+    base = db.query(ItemTag.item_id).filter(ItemTag.tag_id == tag_id)
+    total = base.count()
+    rows = db.query(MediaTag.item_id, MediaTag.name, EmbyItem.year, EmbyItem.overview) \
+        .join(ItemTag, ItemTag.item_id == MediaTag.item_id) \
+        .outerjoin(EmbyItem, EmbyItem.id == MediaTag.item_id) \
+        .filter(ItemTag.tag_id == tag_id) \
+        .order_by(MediaTag.name, MediaTag.item_id).offset(max(0, offset)).limit(limit).all()
+    tags = get_tags_bulk(db, [r.item_id for r in rows])
+    items = [{"id": r.item_id, "name": r.name, "year": r.year, "overview": r.overview or "",
+              "tags": tags.get(r.item_id, [])} for r in rows]
+    return {"items": items, "total": total}
+
+# ===========================
+# 3. 词表维护：改名 / 合并
+# ===========================
+
+def merge_tags(db: Session, sources, target):
+    """
+    把 sources 里的标签全部并入 target (target 不存在则创建)，删除原标签
+    改名就是只有一个来源的合并
+    :return: 受影响的物品 ID 列表
+    """
+    target = str(target).strip()
+    sources = [s for s in normalize_tags(sources) if s != target]
+    if not target or not sources:
+        return []
+    source_ids = [i for (i,) in db.query(Tag.id).filter(Tag.name.in_(sources))]
+    if not source_ids:
+        return []
+    target_id = _tag_ids(db, [target])[target]
+
+    affected = [i for (i,) in db.query(ItemTag.item_id).filter(ItemTag.tag_id.in_(source_ids)).distinct()]
+    already = {i for (i,) in db.query(ItemTag.item_id).filter(ItemTag.tag_id == target_id)}
+    # 每个物品保留第一次出现的位置；已有 target 的物品直接删掉来源标签
+    first_pos = dict(db.query(ItemTag.item_id, func.min(ItemTag.position))
+                     .filter(ItemTag.tag_id.in_(source_ids)).group_by(ItemTag.item_id).all())
+    db.query(ItemTag).filter(ItemTag.tag_id.in_(source_ids)).delete(synchronize_session=False)
+    links = [{"item_id": i, "tag_id": target_id, "position": first_pos[i]} for i in affected if i not in already]
+    if links:
+        db.execute(insert(ItemTag), links)
+    db.query(Tag).filter(Tag.id.in_(source_ids)).delete(synchronize_session=False)
+    db.flush()
+    logger.info(f"🏷 [标签] {sources} -> {target}，影响 {len(affected)} 个物品")
+    return affected
+
+def rename_tag(db: Session, old, new):
+    return merge_tags(db, [old], new)
+
+# ===========================
+# 4. 旧数据迁移 (MediaTag.tags JSON -> item_tags)
+# ===========================
+
+def migrate_json_tags(batch_size=500):
+    """
+    启动时执行：把仍存在 JSON 列里的标签迁移到关联表，迁移后置空 JSON 列
+    可重复执行，没有待迁移数据时立即返回
+    """
+    db = SessionLocal()
+    migrated = 0
+    try:
+        while True:
+            rows = db.query(MediaTag.item_id, MediaTag.name, MediaTag.tags) \
+                .filter(MediaTag.tags.isnot(None)).limit(batch_size).all()
+            if not rows:
+                break
+            set_tags_bulk(db, [(r.item_id, r.name, r.tags if isinstance(r.tags, list) else []) for r in rows])
+            db.commit()
+            migrated += len(rows)
+        if migrated:
+            logger.info(f"🏷 [标签] 已迁移 {migrated} 条 JSON 标签到 item_tags")
+        return migrated
+    finally:
+        db.close()
@@ -0,0 +1,95 @@
+import asyncio
+import json
+import time
+
+# ===========================
+# 任务进度事件 (进程内广播，供 SSE 推送)
+# ===========================
+# 后台任务按 job_id 发布事件，前端通过 SSE 订阅：
+# - 每个任务保留最近 MAX_EVENTS 条事件，断线重连时按 Last-Event-ID 补发
+# - 任务结束 (close) 后事件再保留 RETENTION_SECONDS，之后清理
+# 只在内存里：任务在其他进程执行 / 本进程重启过时，由调用方回退到轮询 jobs 表。
+
+MAX_EVENTS = 5000
+RETENTION_SECONDS = 600
+HEARTBEAT_SECONDS = 15
+
+class _Channel:
+    def __init__(self):
+        self.events = []          # [(seq, event, data)]
+        self.seq = 0
+        self.closed = False
+        self.closed_at = None
+        self.changed = asyncio.Event()
+
+    def publish(self, event, data):
+        self.seq += 1
+        self.events.append((self.seq, event, data))
+        if len(self.events) > MAX_EVENTS:
+            del self.events[:len(self.events) - MAX_EVENTS]
+        # 唤醒当前所有订阅者，再换一个新的 Event 给下一轮等待
+        self.changed.set()
+        self.changed = asyncio.Event()
+
+_channels = {}
+
+def _cleanup():
+    now = time.monotonic()
+    for key in [k for k, c in _channels.items() if c.closed and now - c.closed_at > RETENTION_SECONDS]:
+        _channels.pop(key, None)
+
+def open_channel(job_id):
+    _cleanup()
+    channel = _channels.get(job_id)
+    if channel is None or channel.closed:
+        channel = _channels[job_id] = _Channel()
+    return channel
+
+def has_channel(job_id):
+    return job_id in _channels
+
+def publish(job_id, event, data=None):
+    channel = _channels.get(job_id)
+    if channel is None:
+        channel = open_channel(job_id)
+    if not channel.closed:
+        channel.publish(event, data or {})
+
+def close(job_id, event=None, data=None):
+    """发布最后一个事件 (done / cancelled / error) 并结束订阅；已结束时忽略"""
+    channel = _channels.get(job_id)
+    if channel is None:
+        channel = open_channel(job_id)
+    if channel.closed:
+        return
+    channel.closed = True
+    channel.closed_at = time.monotonic()
+    if event:
+        channel.publish(event, data or {})
+    else:
+        channel.changed.set()
+
+def format_sse(seq, event, data):
+    """seq 为 None 时不带 id (不改变浏览器的 Last-Event-ID)"""
+    head = f"id: {seq}\n" if seq is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False, default=str)}\n\n"
+
+async def subscribe(job_id, last_event_id=0):
+    """
+    产出 SSE 文本：先补发 last_event_id 之后的历史，再实时推送，直到任务结束
+    空闲时每 HEARTBEAT_SECONDS 发一条注释行保活 (防止代理断开)
+    """
+    channel = _channels.get(job_id) or open_channel(job_id)
+    sent = last_event_id
+    while True:
+        waiter = channel.changed
+        for seq, event, data in channel.events:
+            if seq > sent:
+                sent = seq
+                yield format_sse(seq, event, data)
+        if channel.closed:
+            return
+        try:
+            await asyncio.wait_for(waiter.wait(), HEARTBEAT_SECONDS)
+        except asyncio.TimeoutError:
+            yield ": ping\n\n"
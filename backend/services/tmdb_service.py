@@ -1,13 +1,212 @@
-import requests
+import asyncio
 import logging
+import threading
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy import func
 from config.settings import load_config
+from database import SessionLocal
+from models import TmdbCache
+from services.http_client import tmdb_client
+from services.singleflight import coalesce
 
 logger = logging.getLogger("uvicorn")
 
-def get_tmdb_info(tmdb_id, media_type="tv"):
+TMDB_LANGUAGE = "zh-CN"
+DEFAULT_TTL_HOURS = 72
+DEFAULT_LRU_SIZE = 2000
+
+# ===========================
+# 精简 TMDB 记录
+# ===========================
+# 分类和修复总集数只用到产地 / 类型 / 原始语言 / 各季集数，
+# 简介、演职员、图片等字段一律不保留，缓存整个媒体库也只占很少内存。
+
+class TmdbRecord:
+    __slots__ = ("tmdb_id", "media_type", "title", "origin_country", "production_countries",
+                 "genre_ids", "original_language", "season_episodes")
+
+    def __init__(self, tmdb_id, media_type, title=None, origin_country=(), production_countries=(),
+                 genre_ids=(), original_language=None, season_episodes=None):
+        self.tmdb_id = tmdb_id
+        self.media_type = media_type
+        self.title = title
+        self.origin_country = frozenset(origin_country)
+        self.production_countries = frozenset(production_countries)
+        self.genre_ids = frozenset(genre_ids)
+        self.original_language = original_language
+        # {季号: 集数}
+        self.season_episodes = dict(season_episodes or {})
+
+    @classmethod
+    def from_tmdb(cls, data, media_type):
+        """从 TMDB 完整详情 JSON 投影出需要的字段"""
+        seasons = {}
+        for s in data.get("seasons") or []:
+            if s.get("season_number") is not None and s.get("episode_count"):
+                seasons[int(s["season_number"])] = int(s["episode_count"])
+        return cls(
+            tmdb_id=data.get("id"),
+            media_type=media_type,
+            title=data.get("title") or data.get("name"),
+            origin_country=[c for c in data.get("origin_country") or [] if c],
+            production_countries=[c.get("iso_3166_1") for c in data.get("production_countries") or [] if c.get("iso_3166_1")],
+            genre_ids=[g.get("id") for g in data.get("genres") or [] if g.get("id")],
+            original_language=data.get("original_language"),
+            season_episodes=seasons,
+        )
+
+    @classmethod
+    def from_dict(cls, data, media_type):
+        """从缓存表读取；兼容旧版本缓存的完整 TMDB JSON"""
+        if "genre_ids" not in data:
+            return cls.from_tmdb(data, media_type)
+        return cls(
+            tmdb_id=data.get("id"),
+            media_type=data.get("media_type") or media_type,
+            title=data.get("title"),
+            origin_country=data.get("origin_country") or (),
+            production_countries=data.get("production_countries") or (),
+            genre_ids=data.get("genre_ids") or (),
+            original_language=data.get("original_language"),
+            season_episodes={int(k): v for k, v in (data.get("seasons") or {}).items()},
+        )
+
+    def to_dict(self):
+        return {
+            "id": self.tmdb_id,
+            "media_type": self.media_type,
+            "title": self.title,
+            "origin_country": sorted(self.origin_country),
+            "production_countries": sorted(self.production_countries),
+            "genre_ids": sorted(self.genre_ids),
+            "original_language": self.original_language,
+            "seasons": {str(k): v for k, v in self.season_episodes.items()},
+        }
+
+    @property
+    def countries(self):
+        """分类用的产地：电影取 production_countries，剧集取 origin_country"""
+        return self.production_countries if self.media_type == "movie" else self.origin_country
+
+    def episode_count(self, season_number):
+        return self.season_episodes.get(int(season_number))
+
+    def __repr__(self):
+        return f"TmdbRecord({self.media_type}/{self.tmdb_id} {self.title})"
+
+# ===========================
+# TMDB 缓存：内存 LRU -> SQLite -> 条件请求
+# ===========================
+# - 过期前直接返回缓存，不请求 TMDB
+# - 过期后带 If-None-Match / If-Modified-Since 重新验证，304 只刷新有效期
+# - TMDB 不可达时返回过期数据 (总比没有分类强)
+
+class _Entry:
+    __slots__ = ("record", "etag", "last_modified", "expires_at")
+
+    def __init__(self, record, etag, last_modified, expires_at):
+        self.record = record
+        self.etag = etag
+        self.last_modified = last_modified
+        self.expires_at = expires_at
+
+    @property
+    def fresh(self):
+        return self.expires_at and self.expires_at > datetime.utcnow()
+
+_lru = OrderedDict()
+_lru_lock = threading.Lock()
+
+def _lru_get(key):
+    with _lru_lock:
+        entry = _lru.get(key)
+        if entry is not None:
+            _lru.move_to_end(key)
+        return entry
+
+def _lru_put(key, entry):
+    size = int(load_config().get("tmdb_cache_lru_size") or DEFAULT_LRU_SIZE)
+    with _lru_lock:
+        _lru[key] = entry
+        _lru.move_to_end(key)
+        while len(_lru) > size:
+            _lru.popitem(last=False)
+
+def _db_get(key):
+    db = SessionLocal()
+    try:
+        row = db.query(TmdbCache).filter(
+            TmdbCache.media_type == key[0], TmdbCache.tmdb_id == key[1], TmdbCache.language == key[2]
+        ).first()
+        if not row:
+            return None
+        return _Entry(TmdbRecord.from_dict(row.payload or {}, key[0]), row.etag, row.last_modified, row.expires_at)
+    finally:
+        db.close()
+
+def _db_put(key, entry):
+    db = SessionLocal()
+    try:
+        db.merge(TmdbCache(
+            media_type=key[0], tmdb_id=key[1], language=key[2],
+            payload=entry.record.to_dict(), etag=entry.etag, last_modified=entry.last_modified,
+            fetched_at=datetime.utcnow(), expires_at=entry.expires_at,
+        ))
+        db.commit()
+    except Exception as e:
+        db.rollback()
+        logger.warning(f"⚠️ TMDB 缓存写入失败: {e}")
+    finally:
+        db.close()
+
+# 离线语料：缓存表里所有记录 (规则试运行用)，表没变化时复用上次加载结果
+_corpus = {"signature": None, "records": []}
+
+def load_cached_records():
+    """读取 tmdb_cache 中的全部记录 (包括已过期的)，返回 TmdbRecord 列表"""
+    db = SessionLocal()
+    try:
+        signature = db.query(func.count(TmdbCache.tmdb_id), func.max(TmdbCache.fetched_at)).one()
+        if signature == _corpus["signature"]:
+            return _corpus["records"]
+        records = [TmdbRecord.from_dict(payload or {}, media_type)
+                   for media_type, payload in db.query(TmdbCache.media_type, TmdbCache.payload)]
+        _corpus.update(signature=signature, records=records)
+        return records
+    finally:
+        db.close()
+
+def _ttl():
+    hours = load_config().get("tmdb_cache_ttl_hours", DEFAULT_TTL_HOURS)
+    return timedelta(hours=float(hours))
+
+def normalize_media_type(media_type):
+    """MP 传过来的 type 是中文，需要转换"""
+    return "movie" if media_type in ("电影", "movie") else "tv"
+
+async def _load_cached(key):
+    entry = _lru_get(key)
+    if entry is None:
+        entry = await asyncio.to_thread(_db_get, key)
+        if entry is not None:
+            _lru_put(key, entry)
+    return entry
+
+async def _store(key, entry):
+    _lru_put(key, entry)
+    await asyncio.to_thread(_db_put, key, entry)
+
+def _tmdb_key(tmdb_id, media_type="tv"):
+    return (normalize_media_type(media_type), str(tmdb_id))
+
+# 同一部剧的多个 Webhook 几乎同时到达时，只发一次请求
+@coalesce(_tmdb_key)
+async def get_tmdb_info(tmdb_id, media_type="tv"):
     """
     查询 TMDB 详情
     media_type: 'tv' (电视剧) or 'movie' (电影)
+    :return: TmdbRecord (精简记录)，查询失败返回 None
     """
     cfg = load_config()
     api_key = cfg.get("tmdb_api_key")
@@ -16,24 +215,39 @@ def get_tmdb_info(tmdb_id, media_type="tv"):
         logger.error("❌ 未配置 TMDB API Key，无法自动分类")
         return None
 
-    # MP 传过来的 type 是中文，需要转换
-    target_type = "tv"
-    if media_type == "电影":
-        target_type = "movie"
-    
-    url = f"https://api.themoviedb.org/3/{target_type}/{tmdb_id}"
+    target_type = normalize_media_type(media_type)
+    key = (target_type, str(tmdb_id), TMDB_LANGUAGE)
+
+    cached = await _load_cached(key)
+    if cached and cached.fresh:
+        return cached.record
+
     params = {
-        "api_key": api_key,
-        "language": "zh-CN"
+        "language": TMDB_LANGUAGE
     }
+    headers = {}
+    if cached:
+        if cached.etag: headers["If-None-Match"] = cached.etag
+        if cached.last_modified: headers["If-Modified-Since"] = cached.last_modified
 
     try:
-        resp = requests.get(url, params=params, timeout=10)
+        resp = await tmdb_client().get(f"/3/{target_type}/{tmdb_id}", params=params, headers=headers, timeout=10)
+        if resp.status_code == 304 and cached:
+            cached.expires_at = datetime.utcnow() + _ttl()
+            await _store(key, cached)
+            return cached.record
         if resp.status_code == 200:
-            return resp.json()
+            record = TmdbRecord.from_tmdb(resp.json(), target_type)
+            entry = _Entry(record, resp.headers.get("ETag"), resp.headers.get("Last-Modified"),
+                           datetime.utcnow() + _ttl())
+            await _store(key, entry)
+            return record
         else:
             logger.error(f"❌ TMDB 查询失败: {resp.status_code} - {resp.text}")
     except Exception as e:
         logger.error(f"❌ TMDB 连接异常: {e}")
-    
-    return None
\ No newline at end of file
+
+    if cached:
+        logger.warning(f"⚠️ TMDB 不可用，使用过期缓存: {target_type}/{tmdb_id}")
+        return cached.record
+    return None
@@ -0,0 +1,117 @@
+import logging
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy.exc import IntegrityError
+from config.settings import load_config
+from database import SessionLocal
+from models import WebhookEvent
+
+logger = logging.getLogger("uvicorn")
+
+# ===========================
+# Webhook 幂等去重 (内存 + SQLite)
+# ===========================
+# MP 会对同一订阅重复推送 subscribe.added / subscribe.complete，
+# Emby 对同一入库会同时发 item.created 和 library.new。
+# 在去重窗口内，同一个事件键只放行第一次，后续直接丢弃，不产生任何上游请求。
+# 内存层挡住同进程内的重复；SQLite 层让多 worker 进程、重启前后也能去重。
+
+DEFAULT_WINDOW = 300      # 默认去重窗口 (秒)
+PURGE_INTERVAL = 600      # 清理过期记录的间隔 (秒)
+
+# 同义事件归一：不同事件名代表同一件事
+EVENT_ALIASES = {
+    "subscribe": "subscribe.added",
+    "subscribe.add": "subscribe.added",
+    "item.created": "emby.item_added",
+    "library.new": "emby.item_added",
+}
+
+_memory = {}              # event_key -> 过期时间戳
+_lock = threading.Lock()
+_last_purge = 0
+
+def make_key(event, *parts):
+    """事件键：归一化事件名 + 订阅ID / TMDB ID / 季 等标识"""
+    event = EVENT_ALIASES.get(event, event)
+    return "|".join([str(event)] + ["" if p is None else str(p) for p in parts])
+
+def _window():
+    try:
+        return max(0, int(load_config().get("webhook_dedup_window", DEFAULT_WINDOW)))
+    except (TypeError, ValueError):
+        return DEFAULT_WINDOW
+
+def claim(event_key):
+    """
+    尝试占用事件键。
+    :return: True 表示首次出现 (应继续处理)；False 表示窗口期内的重复事件
+    """
+    window = _window()
+    if window == 0:
+        return True
+    now = time.time()
+
+    with _lock:
+        expires = _memory.get(event_key)
+        if expires and expires > now:
+            return False
+        _memory[event_key] = now + window
+
+    if not _claim_db(event_key, window):
+        return False
+    _maybe_purge(now)
+    return True
+
+def release(event_key):
+    """处理入队失败时释放事件键，让上游的重试能够再次进入"""
+    with _lock:
+        _memory.pop(event_key, None)
+    db = SessionLocal()
+    try:
+        db.query(WebhookEvent).filter(WebhookEvent.event_key == event_key).delete()
+        db.commit()
+    finally:
+        db.close()
+
+def _claim_db(event_key, window):
+    now = datetime.utcnow()
+    expires_at = now + timedelta(seconds=window)
+    db = SessionLocal()
+    try:
+        db.add(WebhookEvent(event_key=event_key, expires_at=expires_at))
+        try:
+            db.commit()
+            return True
+        except IntegrityError:
+            db.rollback()
+        # 已存在：只有过期了才能重新占用 (条件更新保证并发下只有一个赢家)
+        updated = db.query(WebhookEvent).filter(
+            WebhookEvent.event_key == event_key, WebhookEvent.expires_at <= now
+        ).update({WebhookEvent.expires_at: expires_at}, synchronize_session=False)
+        db.commit()
+        return bool(updated)
+    except Exception as e:
+        # 去重索引不可用时宁可放行，也不能丢事件
+        logger.error(f"❌ [去重] 写入去重索引失败: {e}")
+        return True
+    finally:
+        db.close()
+
+def _maybe_purge(now):
+    global _last_purge
+    if now - _last_purge < PURGE_INTERVAL:
+        return
+    _last_purge = now
+    with _lock:
+        for key in [k for k, v in _memory.items() if v <= now]:
+            del _memory[key]
+    db = SessionLocal()
+    try:
+        db.query(WebhookEvent).filter(WebhookEvent.expires_at <= datetime.utcnow()).delete()
+        db.commit()
+    except Exception as e:
+        logger.warning(f"⚠️ [去重] 清理过期记录失败: {e}")
+    finally:
+        db.close()
@@ -0,0 +1,30 @@
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+import models
+from services import library_mirror, search_index
+
+@pytest.fixture
+def mirror_db(tmp_path, monkeypatch):
+    """镜像表 + 全文索引指向临时库"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'test.db'}", connect_args={"check_same_thread": False})
+    models.Base.metadata.create_all(bind=engine)
+    monkeypatch.setattr(search_index, "engine", engine)
+    monkeypatch.setattr(library_mirror, "SessionLocal", sessionmaker(bind=engine))
+    search_index.ensure_index()
+    yield engine
+    engine.dispose()
+
+def _rows(names):
+    return [{"id": f"item{i}", "library_id": "lib", "name": name, "overview": "", "tags": []}
+            for i, name in enumerate(names)]
+
+def test_upsert_existing_items_keeps_index_in_sync(mirror_db):
+    library_mirror._upsert(_rows(["Interstellar", "Spirited Away"]))
+    # 再次同步同一批物品 (ON CONFLICT DO UPDATE) 不应触发 emby_search_map 的唯一约束
+    library_mirror._upsert(_rows(["Interstellar", "千与千寻 Spirited Away"]))
+
+    assert [i["id"] for i in search_index.search("Interstellar")["items"]] == ["item0"]
+    assert [i["id"] for i in search_index.search("千与千寻")["items"]] == ["item1"]
+    assert search_index.search("Spirited")["total"] == 1